@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Time the Python hot paths of steps 6, 8 and 10 on seeded synthetic data.
+
+Usage:
+    python benchmarks/run_benchmarks.py                        # small and medium scales
+    python benchmarks/run_benchmarks.py --scales small,medium,large --repeat 3
+    python benchmarks/run_benchmarks.py --scales small --compare   # against benchmarks/baseline_small.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier>.json
+
+Inputs are generated once per scale and seed in the work directory and
+reused. External tools are replaced by no-op stubs on PATH, so the suite
+runs offline and without AUGUSTUS/Exonerate/BLAST installed. Results are
+written as JSON (one entry per scale and case with the first, best and
+mean run times) and can be compared against the committed baseline of the
+small scale (regenerate it with --scales small --output benchmarks/baseline_small.json
+when a change is meant to alter the timings) or any earlier result file.
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASE_DIR = BENCH_DIR.parent
+BIN_DIR = BASE_DIR / "bin"
+sys.path.insert(0, str(BIN_DIR))
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import synthetic
+
+RESULTS_DIR = BENCH_DIR / "results"
+DEFAULT_WORKDIR = BENCH_DIR / ".data"
+DEFAULT_SEED = 20240501
+BASELINE_FILE = BENCH_DIR / "baseline_small.json"
+DEFAULT_TOLERANCE = 0.20 # Slowdown (best time) reported as a regression by --compare
+DEFAULT_MIN_DELTA = 0.005 # Seconds a case must also lose to count as slower (sub-ms cases are noise)
+
+
+# Time func over `repeat` runs (setup runs untimed before each run), step output silenced
+def time_case(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return {"first": round(times[0], 6), "best": round(min(times), 6),
+            "mean": round(sum(times) / len(times), 6), "runs": len(times)}
+
+
+def load_steps():
+    return {
+        "split": importlib.import_module("6_SEQUENCES_SPLIT"),
+        "augustus": importlib.import_module("8_AUGUSTUS"),
+        "schema": importlib.import_module("10_SCHEMA"),
+    }
+
+
+# Benchmark cases of one dataset: [(name, func, setup)]
+def build_cases(steps, dataset, out_dir):
+    from ptpp import catalog, ids, tables
+
+    split, augustus, schema = steps["split"], steps["augustus"], steps["schema"]
+    genome = Path(dataset["genome"])
+    cfg = synthetic.write_augustus_config(out_dir / "augustus_config")
+
+    id_cache = out_dir / "id_cache"
+    table = ids.load_id_table(dataset["table"], id_cache)
+    genus_groups = table.groupby("Genus", observed=True)["ID"].apply(set)
+
+    def reset_catalog():
+        for path in (genome.with_name(genome.name + ".fai"), genome.parent / catalog.CATALOG_NAME):
+            path.unlink(missing_ok=True)
+        catalog._catalogs.clear()
+
+    def split_dir():
+        path = out_dir / "filtered_fasta"
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+        return path
+
+    def extract_regions():
+        contig_lengths = catalog.genome_catalog(genome.parent).contig_lengths(genome)
+        augustus.extract_regions(dataset["hits"], genome, contig_lengths,
+                                 out_dir / "regions.fasta", out_dir / "regions_map.tsv")
+
+    # Every region of the synthetic AUGUSTUS output shares one sequence (references only, no copies)
+    region_sequences = {}
+
+    def collect_regions():
+        if not region_sequences:
+            region_sequence = "ACGT" * 5001
+            for path in dataset["augustus_gffs"]:
+                with open(path) as f:
+                    region_sequences.update((line.split("\t", 1)[0], region_sequence) for line in f if not line.startswith("#"))
+
+    def convert_augustus_gff():
+        augustus.convert_augustus_gff(dataset["augustus_gffs"][0], out_dir / "augustus.gtf", out_dir / "augustus_clean.gtf",
+                                      out_dir / "transcripts.fasta", region_sequences)
+
+    positions = {}
+
+    def read_gff():
+        positions.update(schema.read_gff_file(dataset["hints"]))
+
+    # Parquet copy of the hints, written next to a copy so the cached dataset stays text only
+    parquet_hints = out_dir / Path(dataset["hints"]).name
+
+    def write_parquet_hints():
+        if not tables.parquet_path(parquet_hints).exists():
+            shutil.copy(dataset["hints"], parquet_hints)
+            tables.write_table(parquet_hints, "gff", "parquet")
+
+    return [
+        ("ids.load_id_table.parse", lambda: ids.normalize(ids.read_source(dataset["table"])), None),
+        ("ids.load_id_table.cached", lambda: ids.load_id_table(dataset["table"], id_cache), None),
+        ("6_SEQUENCES_SPLIT.GenusMatcher", lambda: split.GenusMatcher(genus_groups), None),
+        ("6_SEQUENCES_SPLIT.stream_split_by_genus",
+         lambda: split.stream_split_by_genus(dataset["proteins"], genus_groups, split_dir()), None),
+        ("8_AUGUSTUS.extract_regions", extract_regions, None),
+        ("8_AUGUSTUS.generate_hints_file",
+         lambda: augustus.generate_hints_file(dataset["hits"], out_dir / "hints.gff", cfg), None),
+        ("8_AUGUSTUS.merge_augustus_gff",
+         lambda: augustus.merge_augustus_gff(dataset["augustus_gffs"], out_dir / "augustus.gff"), None),
+        ("8_AUGUSTUS.convert_augustus_gff", convert_augustus_gff, collect_regions),
+        ("10_SCHEMA.read_genome_file.cold", lambda: schema.read_genome_file(str(genome)), reset_catalog),
+        ("10_SCHEMA.read_genome_file.warm", lambda: schema.read_genome_file(str(genome)), None),
+        ("10_SCHEMA.read_gff_file", read_gff, None),
+        ("10_SCHEMA.read_gff_file.parquet", lambda: schema.read_gff_file(str(parquet_hints)), write_parquet_hints),
+        ("10_SCHEMA.visualize_chromosomes",
+         lambda: schema.visualize_chromosomes(dataset["contigs"], positions, str(out_dir / "SYNTHETIC.png")), None),
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Compare best times with an earlier result file; returns the regressions
+def compare(results, baseline, tolerance, min_delta=DEFAULT_MIN_DELTA):
+    regressions = []
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Baseline {baseline.get('revision')} of {baseline.get('date')} "
+          f"({baseline.get('platform')}, {baseline.get('cpu_count')} CPUs)")
+    print(f"{'scale':<8} {'case':<42} {'baseline(s)':>12} {'current(s)':>12} {'ratio':>7}")
+    for scale, cases in results["results"].items():
+        for case, timing in cases.items():
+            old = baseline.get("results", {}).get(scale, {}).get(case)
+            if not old:
+                print(f"{scale:<8} {case:<42} {'-':>12} {timing['best']:>12.4f} {'-':>7} (not in baseline)")
+                continue
+            ratio = timing["best"] / old["best"] if old["best"] else float("inf")
+            slower = ratio > 1 + tolerance and timing["best"] - old["best"] > min_delta
+            flag = " <- slower" if slower else ""
+            print(f"{scale:<8} {case:<42} {old['best']:>12.4f} {timing['best']:>12.4f} {ratio:>7.2f}{flag}")
+            if flag:
+                regressions.append((scale, case, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PTPP Python hot paths on synthetic data")
+    parser.add_argument("--scales", default="small,medium", help=f"Comma-separated scales ({', '.join(synthetic.SCALES)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic data")
+    parser.add_argument("--workdir", default=str(DEFAULT_WORKDIR), help="Where synthetic inputs are generated and kept")
+    parser.add_argument("--cases", help="Only run cases whose name contains one of these comma-separated words")
+    parser.add_argument("--output", help="Result JSON (default: benchmarks/results/<date>_<revision>.json)")
+    parser.add_argument("--compare", nargs="?", const=str(BASELINE_FILE),
+                        help="Result JSON to compare against (default: the committed small-scale baseline)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown before --compare fails")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA, help="Seconds a case must also lose before --compare fails")
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    for scale in scales:
+        if scale not in synthetic.SCALES:
+            parser.error(f"unknown scale {scale}")
+
+    workdir = Path(args.workdir)
+    stub_dir = synthetic.write_tool_stubs(workdir / "stubs")
+    os.environ["PATH"] = f"{stub_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ["AUGUSTUS_CONFIG_PATH"] = str(workdir / "augustus_config")
+    synthetic.write_augustus_config(workdir / "augustus_config")
+    os.environ["PTPP_METRICS_FILE"] = str(workdir / "metrics.jsonl")
+    steps = load_steps()
+
+    results = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": {}
+    }
+    for scale in scales:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Generating {scale} dataset (seed {args.seed})..", flush=True)
+        dataset = synthetic.generate(workdir, scale, args.seed)
+        out_dir = workdir / f"out-{scale}"
+        shutil.rmtree(out_dir, ignore_errors=True)
+        out_dir.mkdir(parents=True)
+
+        results["results"][scale] = {}
+        for name, func, setup in build_cases(steps, dataset, out_dir):
+            if args.cases and not any(word in name for word in args.cases.split(",")):
+                continue
+            timing = time_case(func, args.repeat, setup)
+            results["results"][scale][name] = timing
+            print(f"  {scale:<8} {name:<42} best {timing['best']:>9.4f}s  first {timing['first']:>9.4f}s", flush=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{results['revision'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1))
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Results saved to {output}")
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.tolerance, args.min_delta)
+        if regressions:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] {len(regressions)} cases slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
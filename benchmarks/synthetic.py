@@ -0,0 +1,190 @@
+"""Seeded synthetic inputs for the PTPP benchmarks.
+
+Everything is generated from one numpy Generator, so the same scale and seed
+always produce byte-identical files. Sequences are written in blocks, so
+multi-Gb genomes are generated without holding them in memory.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Input sizes of each benchmark scale
+SCALES = {
+    "small": {"genome_bp": 20_000_000, "contigs": 10, "proteins": 5_000, "genera": 20, "hits": 5_000},
+    "medium": {"genome_bp": 300_000_000, "contigs": 20, "proteins": 50_000, "genera": 100, "hits": 50_000},
+    "large": {"genome_bp": 3_000_000_000, "contigs": 21, "proteins": 500_000, "genera": 500, "hits": 500_000},
+}
+
+NUCLEOTIDES = np.frombuffer(b"ACGT", dtype=np.uint8)
+AMINO_ACIDS = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+DATA_VERSION = 1 # Bump when the generators change, so cached datasets are regenerated
+LINE_WIDTH = 60
+BLOCK_LINES = 100_000
+
+
+# Write random sequence wrapped at LINE_WIDTH, in blocks of BLOCK_LINES lines
+def write_sequence(out, rng, length, alphabet):
+    written = 0
+    while written < length:
+        n = min(length - written, LINE_WIDTH * BLOCK_LINES)
+        codes = alphabet[rng.integers(0, len(alphabet), n, dtype=np.uint8)]
+        full = n // LINE_WIDTH * LINE_WIDTH
+        lines = np.hstack([codes[:full].reshape(-1, LINE_WIDTH),
+                           np.full((full // LINE_WIDTH, 1), ord("\n"), dtype=np.uint8)])
+        out.write(lines.tobytes())
+        if n > full:
+            out.write(codes[full:].tobytes() + b"\n")
+        written += n
+
+
+# Genome FASTA with contigs of similar size; returns {contig: length}
+def write_genome(path, rng, genome_bp, n_contigs):
+    weights = rng.uniform(0.5, 1.5, n_contigs)
+    lengths = np.floor(weights / weights.sum() * genome_bp).astype(np.int64)
+    contigs = {f"chr{i + 1:02d}": int(length) for i, length in enumerate(lengths)}
+    with open(path, "wb") as out:
+        for contig, length in contigs.items():
+            out.write(f">{contig}\n".encode())
+            write_sequence(out, rng, length, NUCLEOTIDES)
+    return contigs
+
+
+# Protein FASTA and ID table (ID, Tax_Name) in the PROT_IDS layout
+# IDs vary (version suffixes, "|" fields, prefixes) so exact, substring and partial matching are all exercised
+def write_proteins(fasta_path, table_path, rng, n_proteins, n_genera):
+    genera = [f"Genus{i:04d}" for i in range(n_genera)]
+    ids = [f"P{i:08d}" for i in range(n_proteins)]
+    genus_of = rng.integers(0, n_genera, n_proteins)
+    variants = rng.integers(0, 4, n_proteins)
+    lengths = rng.integers(80, 800, n_proteins)
+
+    with open(fasta_path, "wb") as out:
+        for protein_id, variant, length in zip(ids, variants, lengths):
+            record_id = {0: protein_id, 1: f"{protein_id}.1", 2: f"{protein_id}|sp", 3: f"x{protein_id}_2"}[int(variant)]
+            out.write(f">{record_id} synthetic protein\n".encode())
+            write_sequence(out, rng, int(length), AMINO_ACIDS)
+
+    with open(table_path, "w") as out:
+        out.write("ID\tTax_Name\n")
+        for protein_id, variant, genus in zip(ids, variants, genus_of):
+            table_id = f"{protein_id}.2" if variant == 1 else protein_id
+            out.write(f"{table_id}\t{genera[genus]} species{genus % 7}\n")
+    return genera
+
+
+# Best-hit outfmt 6 table (one hit per query) on the synthetic genome
+def write_hits(path, rng, contigs, n_hits):
+    names = list(contigs)
+    contig_of = rng.integers(0, len(names), n_hits)
+    spans = rng.integers(90, 3000, n_hits)
+    plus = rng.random(n_hits) < 0.5
+    evalues = 10.0 ** -rng.uniform(5, 120, n_hits)
+    with open(path, "w") as out:
+        for i in range(n_hits):
+            contig = names[contig_of[i]]
+            start = int(rng.integers(1, contigs[contig] - spans[i]))
+            end = start + int(spans[i])
+            sstart, send = (start, end) if plus[i] else (end, start)
+            qlen = int(spans[i]) // 3
+            out.write(f"P{i:08d}\t{contig}\t{rng.uniform(30, 100):.3f}\t{qlen}\t0\t0\t1\t{qlen}\t"
+                      f"{sstart}\t{send}\t{evalues[i]:.2e}\t{rng.uniform(40, 900):.1f}\n")
+
+
+# AUGUSTUS hints GFF, as written by step 8
+def write_hints(path, rng, contigs, n_hints):
+    names = list(contigs)
+    with open(path, "w") as out:
+        for i in range(n_hints):
+            contig = names[int(rng.integers(0, len(names)))]
+            start = int(rng.integers(1, contigs[contig] - 3000))
+            end = start + int(rng.integers(90, 3000))
+            strand = "+" if rng.random() < 0.5 else "-"
+            out.write(f"{contig}\tblastX\texonpart\t{start}\t{end}\t1e-10\t{strand}\t.\tgrp=P{i:08d};pri=4;src=M\n")
+
+
+# AUGUSTUS-style GFF3 (gene, transcript, exons/CDS, start/stop codons) on region sequences,
+# split into shards the way step 8 runs AUGUSTUS
+def write_augustus_gff(paths, rng, contigs, n_genes):
+    names = list(contigs)
+    per_shard = -(-n_genes // len(paths))
+    for n, path in enumerate(paths):
+        with open(path, "w") as out:
+            out.write("##gff-version 3\n")
+            for g in range(1, min(per_shard, n_genes - n * per_shard) + 1):
+                contig = names[int(rng.integers(0, len(names)))]
+                region_start = int(rng.integers(1, contigs[contig] - 20000))
+                seqid = f"{contig}:{region_start}-{region_start + 20000}"
+                strand = "+" if rng.random() < 0.5 else "-"
+                exons = np.sort(rng.choice(np.arange(100, 19000, 10), size=2 * int(rng.integers(1, 6)), replace=False))
+                start, end = int(exons[0]), int(exons[-1])
+                gene = f"g{g}"
+                out.write(f"# start gene {gene}\n")
+                out.write(f"{seqid}\tAUGUSTUS\tgene\t{start}\t{end}\t0.9\t{strand}\t.\tID={gene};\n")
+                out.write(f"{seqid}\tAUGUSTUS\ttranscript\t{start}\t{end}\t0.9\t{strand}\t.\tID={gene}.t1;Parent={gene};\n")
+                out.write(f"{seqid}\tAUGUSTUS\tstart_codon\t{start}\t{start + 2}\t.\t{strand}\t0\tParent={gene}.t1;\n")
+                for e in range(0, len(exons), 2):
+                    exon_start, exon_end = int(exons[e]), int(exons[e + 1])
+                    out.write(f"{seqid}\tAUGUSTUS\tCDS\t{exon_start}\t{exon_end}\t0.9\t{strand}\t0\tID={gene}.t1.cds;Parent={gene}.t1;\n")
+                    out.write(f"{seqid}\tAUGUSTUS\texon\t{exon_start}\t{exon_end}\t.\t{strand}\t.\tParent={gene}.t1;\n")
+                out.write(f"{seqid}\tAUGUSTUS\tstop_codon\t{end - 2}\t{end}\t.\t{strand}\t0\tParent={gene}.t1;\n")
+                out.write(f"# protein sequence = [M]\n# end gene {gene}\n")
+
+
+# Extrinsic config (AUGUSTUS_CONFIG_PATH layout) accepting exonpart hints
+def write_augustus_config(config_dir):
+    cfg = Path(config_dir) / "extrinsic" / "extrinsic.M.RM.E.W.cfg"
+    cfg.parent.mkdir(parents=True, exist_ok=True)
+    cfg.write_text("[SOURCES]\nM RM E W\n\n[GENERAL]\nexonpart 1 .992 M 1 1e+100 RM 1 1 E 1 1 W 1 1\n")
+    return cfg
+
+
+# No-op executables for the external tools, so nothing reaches a real installation
+def write_tool_stubs(stub_dir):
+    stub_dir = Path(stub_dir)
+    stub_dir.mkdir(parents=True, exist_ok=True)
+    for tool in ("augustus", "exonerate", "tblastn", "makeblastdb", "datasets"):
+        stub = stub_dir / tool
+        stub.write_text("#!/bin/sh\nexit 0\n")
+        stub.chmod(0o755)
+    return stub_dir
+
+
+# Generate (or reuse) the inputs of one scale; returns the dataset description
+def generate(workdir, scale, seed):
+    params = SCALES[scale]
+    data_dir = Path(workdir) / f"{scale}-{seed}-v{DATA_VERSION}"
+    marker = data_dir / "dataset.json"
+    if marker.exists():
+        return json.loads(marker.read_text())
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    genome_dir = data_dir / "genomes"
+    genome_dir.mkdir(exist_ok=True)
+    genome = genome_dir / "Synthetic_genomic.fna"
+    contigs = write_genome(genome, rng, params["genome_bp"], params["contigs"])
+    write_proteins(data_dir / "proteins.fasta", data_dir / "PROT_IDS.tsv", rng, params["proteins"], params["genera"])
+    write_hits(data_dir / "Synthetic_BH.txt", rng, contigs, params["hits"])
+    write_hints(data_dir / "Synthetic_hints.gff", rng, contigs, params["hits"] * 4)
+    shard_gffs = [data_dir / f"augustus_shard_{i:02d}.gff" for i in range(8)]
+    write_augustus_gff(shard_gffs, rng, contigs, params["hits"])
+
+    dataset = {
+        "scale": scale,
+        "seed": seed,
+        "params": params,
+        "genome": str(genome),
+        "contigs": contigs,
+        "proteins": str(data_dir / "proteins.fasta"),
+        "table": str(data_dir / "PROT_IDS.tsv"),
+        "hits": str(data_dir / "Synthetic_BH.txt"),
+        "hints": str(data_dir / "Synthetic_hints.gff"),
+        "augustus_gffs": [str(path) for path in shard_gffs],
+    }
+    tmp_marker = marker.with_suffix(f".{os.getpid()}.tmp")
+    tmp_marker.write_text(json.dumps(dataset, indent=1))
+    os.replace(tmp_marker, marker)
+    return dataset
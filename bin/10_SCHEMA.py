@@ -3,13 +3,22 @@
 
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
+from matplotlib.collections import PatchCollection, PolyCollection
 import numpy as np
 import os
+import sys
 import re
 from pathlib import Path
 import glob
+import argparse
 from collections import defaultdict
 from datetime import datetime
+from ptpp.catalog import genome_catalog
+from ptpp.jobs import run_genera, print_failures
+from ptpp.manifest import RunManifest
+from ptpp.metrics import measure, track_step
+from ptpp.query import SOURCES, ResultIndex, parse_region
+from ptpp.tables import read_table
 
 
 # Directories
@@ -24,31 +33,18 @@ SCHEMA_DIR = OUTPUT_DIR / "schema"
 for d in [OUTPUT_DIR, LOG_DIR, SCHEMA_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
-# Read genome files and their sizes
+# Rendering configuration
+output_format = "png" # png, svg or pdf (vector outputs stay small with collections and density bins)
+density_threshold = 100000 # Above this number of hints, draw per-chromosome hint density
+density_bins = 500 # Bins per chromosome in density mode
+window_labels = 60 # Most records per track labelled with their protein/transcript name in window mode (--region)
+force = False # Redraw schematics whose hints, genome and settings are unchanged (--force)
+
+# Read genome files and their sizes (contig lengths cached in the genome catalog)
 def read_genome_file(genome_file):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Reading genome file: {genome_file}..")
-    chromosomes = {}
-    current_chr = None
-    sequence = ""
-    
     try:
-        with open(genome_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('>'):
-                    if current_chr:
-                        chromosomes[current_chr] = len(sequence)
-                    
-                    # Extract chromosome name
-                    header = line[1:].split()
-                    current_chr = header[0]
-                    sequence = ""
-                else:
-                    sequence += line
-        
-        # Add last chromosome
-        if current_chr:
-            chromosomes[current_chr] = len(sequence)
+        chromosomes = genome_catalog(Path(genome_file).parent).contig_lengths(genome_file)
     except Exception as e:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Failed to read genome file {genome_file}: {str(e)}!")
         return {}
@@ -62,24 +58,38 @@ def read_gff_file(gff_file):
     positions = defaultdict(list)
     
     try:
-        with open(gff_file, 'r') as f:
-            count = 0
-            for line in f:
-                if line.startswith('#'):
-                    continue
-                
-                parts = line.strip().split('\t')
-                if len(parts) >= 5:
-                    chrom = parts[0]
-                    start = int(parts[3])
-                    end = int(parts[4])
-                    positions[chrom].append((start, end))
-                    count += 1
+        # Only the seqid, start and end columns (from the Parquet or bgzip copy when present)
+        hints = read_table(gff_file, "gff", columns=["seqid", "start", "end"])
+        count = len(hints)
+        for chrom, group in hints.groupby("seqid", sort=False):
+            positions[chrom] = np.column_stack([group["start"].to_numpy(), group["end"].to_numpy()])
         print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Found {count} hints in {len(positions)} chromosomes/scaffolds!")
     except Exception as e:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Reading GFF file {gff_file}: {str(e)}!")
     return positions
 
+# Merge overlapping [start, end] spans (sorted sweep on arrays)
+def merge_spans(starts, ends):
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+    reach = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] > reach[:-1]) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks - 1, [len(starts) - 1]))
+    return starts[first], reach[last]
+
+# Rectangles (x0, y0, width, height) as polygon vertices for a PolyCollection
+def bar_vertices(x0, y0, width, height):
+    x1 = x0 + width
+    y1 = y0 + height
+    return np.stack([
+        np.column_stack([x0, y0]),
+        np.column_stack([x0, y1]),
+        np.column_stack([x1, y1]),
+        np.column_stack([x1, y0])
+    ], axis=1)
+
 # Generate visualizations with marked hints
 def visualize_chromosomes(chromosomes, positions, output_file):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Generating visualizations for: {output_file}..")
@@ -151,39 +161,61 @@ def visualize_chromosomes(chromosomes, positions, output_file):
     max_length = max(chromosomes[chrom] for chrom in selected_chroms)
     scale_factor = 10 / max_length  # Larger chromosome with 10 units
     
-    # Draw chromosomes
-    for i, chrom in enumerate(selected_chroms):
-        length = chromosomes[chrom] * scale_factor
-        
-        # Draw chromosomes as rectangle with rounded edges
-        rect = patches.FancyBboxPatch(
-            (0, y_positions[i] - chrom_width/2),
-            length, chrom_width,
-            boxstyle=patches.BoxStyle("Round", pad=0.02, rounding_size=0.05),
-            linewidth=0.8, edgecolor=chrom_edge_color, facecolor=chrom_color, alpha=0.9
+    # Draw chromosomes as rectangles with rounded edges (single collection)
+    lengths = np.array([chromosomes[chrom] for chrom in selected_chroms], dtype=float) * scale_factor
+    chrom_patches = [
+        patches.FancyBboxPatch(
+            (0, y - chrom_width/2), length, chrom_width,
+            boxstyle=patches.BoxStyle("Round", pad=0.02, rounding_size=0.05)
         )
-        ax.add_patch(rect)
-        
-        # Add chromosomes label
-        font_size = max(6, min(9, 300 / len(selected_chroms)))
-        ax.text(-0.5, y_positions[i], chrom, va='center', ha='right', 
+        for y, length in zip(y_positions, lengths)
+    ]
+    ax.add_collection(PatchCollection(
+        chrom_patches, linewidth=0.8, edgecolor=chrom_edge_color, facecolor=chrom_color, alpha=0.9
+    ))
+    
+    # Add chromosomes label
+    font_size = max(6, min(9, 300 / len(selected_chroms)))
+    for y, chrom in zip(y_positions, selected_chroms):
+        ax.text(-0.5, y, chrom, va='center', ha='right', 
                 fontsize=font_size, fontweight='bold', color='#303030')
+    
+    # Add hints
+    n_hints = sum(len(positions[chrom]) for chrom in selected_chroms if chrom in positions)
+    density_mode = n_hints > density_threshold
+    bars = []
+    counts = []
+    for i, chrom in enumerate(selected_chroms):
+        if chrom not in positions or len(positions[chrom]) == 0:
+            continue
+        hints = np.asarray(positions[chrom], dtype=float)
+        y0 = y_positions[i] - chrom_width/2
         
-        # Add hints
-        if chrom in positions:
-            for start, end in positions[chrom]:
-                start_scaled = start * scale_factor
-                end_scaled = end * scale_factor
-                width_scaled = max(end_scaled - start_scaled, 0.01)
-                
-                # Draw each hint
-                mark = patches.Rectangle(
-                    (start_scaled, y_positions[i] - chrom_width/2),
-                    width_scaled, chrom_width,
-                    linewidth=0, edgecolor=None, facecolor=mark_color, alpha=0.85,
-                    zorder=3
-                )
-                ax.add_patch(mark)
+        if density_mode:
+            # Hint density along the chromosome
+            midpoints = hints.mean(axis=1)
+            hist, edges = np.histogram(midpoints, bins=density_bins, range=(0, chromosomes[chrom]))
+            filled = hist > 0
+            x0 = edges[:-1][filled] * scale_factor
+            width = np.diff(edges)[filled] * scale_factor
+            counts.append(hist[filled])
+        else:
+            # Each hint as a bar (overlapping hints merged)
+            starts, ends = merge_spans(hints.min(axis=1), hints.max(axis=1))
+            x0 = starts * scale_factor
+            width = np.maximum((ends - starts) * scale_factor, 0.01)
+        bars.append(bar_vertices(x0, np.full(len(x0), y0), width, np.full(len(x0), chrom_width)))
+    
+    if bars:
+        hint_collection = PolyCollection(np.concatenate(bars), linewidth=0, zorder=3)
+        if density_mode:
+            hint_collection.set_array(np.concatenate(counts))
+            hint_collection.set_cmap('Reds')
+            fig.colorbar(hint_collection, ax=ax, fraction=0.02, pad=0.01, label='Hints per bin')
+        else:
+            hint_collection.set_facecolor(mark_color)
+            hint_collection.set_alpha(0.85)
+        ax.add_collection(hint_collection)
     
     # Configure axes
     ax.set_xlim(-2, 11)
@@ -194,7 +226,7 @@ def visualize_chromosomes(chromosomes, positions, output_file):
     ax.set_facecolor('white')
     
     # Add titles
-    genus_name = os.path.basename(output_file).replace('.png', '')
+    genus_name = Path(output_file).stem
     plt.title(f'Chromosome visualization with hints - {genus_name}', 
               fontsize=14, fontweight='bold', pad=15)
     
@@ -202,7 +234,7 @@ def visualize_chromosomes(chromosomes, positions, output_file):
     legend_elements = [
         patches.Patch(facecolor=chrom_color, edgecolor=chrom_edge_color, 
                     label='Chromosomes/Scaffolds', alpha=0.9),
-        patches.Patch(facecolor=mark_color, label='Hint region', alpha=0.85)
+        patches.Patch(facecolor=mark_color, label='Hint density' if density_mode else 'Hint region', alpha=0.85)
     ]
     legend = ax.legend(handles=legend_elements, loc='upper right', 
                       frameon=True, framealpha=0.9, fontsize=9)
@@ -218,64 +250,170 @@ def visualize_chromosomes(chromosomes, positions, output_file):
     
     # Save figure
     plt.tight_layout()
-    plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white')
+    plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white', format=Path(output_file).suffix[1:])
     plt.close()
     
     print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][STATUS] Visualization saved as: {output_file}!")
 
+# Draw the records of one genome window, one track per source (hits, hints, genes, alignments)
+def visualize_window(records, contig, start, end, output_file):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Generating window visualization for: {output_file}..")
+    
+    track_colors = {'hits': '#1F77B4', 'hints': '#D62728', 'genes': '#2CA02C', 'alignments': '#9467BD'}
+    track_height = 0.6
+    y_tracks = {source: (len(SOURCES) - 1 - i) * 1.2 for i, source in enumerate(SOURCES)}
+    
+    plt.style.use('seaborn-v0_8-whitegrid')
+    plt.rcParams['font.family'] = 'sans-serif'
+    plt.rcParams['font.sans-serif'] = ['Arial', 'DejaVu Sans', 'Liberation Sans', 'Bitstream Vera Sans']
+    fig = plt.figure(figsize=(14, 4 + len(SOURCES)), facecolor='white')
+    ax = fig.add_subplot(111)
+    
+    for source in SOURCES:
+        rows = [row for row in records if row[0] == source]
+        y = y_tracks[source]
+        ax.text(start - (end - start) * 0.01, y, source, va='center', ha='right', fontsize=9, fontweight='bold', color='#303030')
+        if not rows:
+            continue
+        starts = np.array([max(row[2], start) for row in rows], dtype=float)
+        ends = np.array([min(row[3], end) for row in rows], dtype=float)
+        # Overlapping records are stacked in lanes inside the track
+        lanes = np.zeros(len(rows), dtype=int)
+        lane_ends = []
+        for i, row_start in enumerate(starts):
+            lane = next((n for n, lane_end in enumerate(lane_ends) if lane_end < row_start), len(lane_ends))
+            if lane == len(lane_ends):
+                lane_ends.append(0)
+            lane_ends[lane] = ends[i]
+            lanes[i] = lane
+        lane_height = track_height / len(lane_ends)
+        y0 = y - track_height/2 + lanes * lane_height
+        width = np.maximum(ends - starts + 1, (end - start) * 0.001)
+        bars = PolyCollection(bar_vertices(starts, y0, width, np.full(len(rows), lane_height * 0.8)),
+                              facecolor=track_colors[source], linewidth=0, alpha=0.85, zorder=3)
+        ax.add_collection(bars)
+        if len(rows) <= window_labels:
+            for row, x, y_row in zip(rows, starts, y0):
+                ax.text(x, y_row + lane_height * 0.4, f" {row[5]}", va='center', ha='left', fontsize=6, color='#202020', zorder=4)
+    
+    ax.set_xlim(start, end)
+    ax.set_ylim(-1, max(y_tracks.values()) + 1)
+    ax.set_yticks([])
+    ax.set_xlabel(f"{contig} (bp)")
+    ax.ticklabel_format(axis='x', style='plain', useOffset=False)
+    genus_name = Path(output_file).stem.split('_')[0]
+    plt.title(f'{genus_name} - {contig}:{start:,}-{end:,} ({len(records)} records)', fontsize=14, fontweight='bold', pad=15)
+    
+    plt.tight_layout()
+    plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white', format=Path(output_file).suffix[1:])
+    plt.close()
+    
+    print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][STATUS] Visualization saved as: {output_file}!")
+
+# Draw the requested windows of a genus from its result index
+def process_windows(genus_name, regions):
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][STATUS] Processing windows of {genus_name}..")
+    with measure("result_index"):
+        index = ResultIndex(genus_name)
+    if not index.sources():
+        print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] No results found for {genus_name}!")
+        return
+    
+    for region in regions:
+        contig, start, end = parse_region(region)
+        if end is None:
+            genome_file = find_matching_genome_file(genus_name, DATA_DIR)
+            end = read_genome_file(genome_file).get(contig) if genome_file else None
+        records = index.region(contig, start, end)
+        if end is None:
+            end = max((row[3] for row in records), default=start + 1)
+        safe_contig = re.sub(r'[^\w.-]', '_', contig)
+        output_file = os.path.join(SCHEMA_DIR, f"{genus_name.upper()}_{safe_contig}_{start}-{end}.{output_format}")
+        with measure("visualize_window"):
+            visualize_window(records, contig, start, end, output_file)
+
 # Find genome file for each genus
 def find_matching_genome_file(genus_name, genome_dir):
-    extensions = ['.fa', '.fna', '.fasta']
-    for ext in extensions:
-        pattern = os.path.join(genome_dir, f"{genus_name}*{ext}")
-        files = glob.glob(pattern)
-        if files:
-            return files[0]
-    
-    # Fallback if not find genus
-    for ext in extensions:
-        pattern = os.path.join(genome_dir, f"*{genus_name}*{ext}")
-        files = glob.glob(pattern)
-        if files:
-            return files[0]
-    return None
+    genome_file = genome_catalog(genome_dir).find(genus_name)
+    return str(genome_file) if genome_file else None
+
+# Process one GFF file with _hints.gff
+# (force is an argument, not a module global, so process pool workers get it under any start method)
+def process_hint_file(hint_file, genus_name, force):
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][STATUS] Processing {genus_name}..")
+    
+    # Find genome file
+    genome_file = find_matching_genome_file(genus_name, DATA_DIR)
+    
+    if not genome_file:
+        print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Genome file not found for {genus_name}!")
+        return
+    
+    # Output file
+    output_file = os.path.join(SCHEMA_DIR, f"{genus_name.upper()}.{output_format}")
+    
+    # Skip schematics already drawn from the same hints, genome and settings
+    manifest = RunManifest("10_SCHEMA")
+    inputs = [hint_file, genome_file]
+    params = {"output_format": output_format, "density_threshold": density_threshold, "density_bins": density_bins}
+    if not force and manifest.is_current(genus_name, inputs, params, [output_file]):
+        print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SKIP] {genus_name} is up to date, use --force to redraw..")
+        return
+    manifest.invalidate(genus_name)
+    
+    # Read files
+    with measure("read_genome_file"):
+        chromosomes = read_genome_file(genome_file)
+    if not chromosomes:
+        print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Genome and hint files not matching for: {genome_file}!")
+        return
+    
+    with measure("read_gff_file"):
+        positions = read_gff_file(hint_file)
+    if not positions:
+        print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][WARNING] Hint file with nno positions: {hint_file}!")
+    
+    # Generate visualization
+    with measure("visualize_chromosomes"):
+        visualize_chromosomes(chromosomes, positions, output_file)
+    manifest.record(genus_name, inputs, params, [output_file])
 
 # Process all GFF files wit _hints.gff
-def process_all_files():
+def process_all_files(jobs=1, genera=None, force=False):
     hint_files = glob.glob(os.path.join(OUTPUT_DIR, "*_hints.gff"))
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][STATUS] Found {len(hint_files)} hint files, continuing..")
     
+    # Extract genus from file
+    items = []
     for hint_file in hint_files:
-        # Extract genus from file
         genus_name = os.path.basename(hint_file).split('_')[0]
         genus_name = genus_name.capitalize()
-        
-        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][STATUS] Processing {genus_name}..")
-        
-        # Find genome file
-        genome_file = find_matching_genome_file(genus_name, DATA_DIR)
-        
-        if not genome_file:
-            print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Genome file not found for {genus_name}!")
-            continue
-        
-        # Output file
-        output_file = os.path.join(SCHEMA_DIR, f"{genus_name.upper()}.png")
-        
-        # Read files
-        chromosomes = read_genome_file(genome_file)
-        if not chromosomes:
-            print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Genome and hint files not matching for: {genome_file}!")
+        if genera and genus_name not in genera:
             continue
-        
-        positions = read_gff_file(hint_file)
-        if not positions:
-            print(f"  [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][WARNING] Hint file with nno positions: {hint_file}!")
-        
-        # Generate visualization
-        visualize_chromosomes(chromosomes, positions, output_file)
+        items.append((genus_name, (hint_file, genus_name, force)))
+    
+    _, failures = run_genera(process_hint_file, items, jobs)
+    print_failures(failures, len(items))
+    return failures
 
 if __name__ == "__main__":
-    print("[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Initializing..")
-    process_all_files()
-    print("\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISH] Finished!")
+    parser = argparse.ArgumentParser(description="Generate chromosome schematics with marked hint regions")
+    parser.add_argument("--jobs", type=int, default=1, help="Genera processed in parallel")
+    parser.add_argument("--force", action="store_true", default=force, help="Redraw schematics that are up to date")
+    parser.add_argument("--genus", nargs="+", help="Only draw these genera")
+    parser.add_argument("--region", nargs="+", help="Only draw these windows (CONTIG:START-END or CONTIG) of the --genus genera")
+    args = parser.parse_args()
+    track_step()
+    
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Initializing..")
+    if args.region:
+        if not args.genus:
+            parser.error("--region needs --genus")
+        for genus in args.genus:
+            process_windows(genus.capitalize(), args.region)
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISH] Finished!")
+        sys.exit(0)
+    failures = process_all_files(max(1, args.jobs), [genus.capitalize() for genus in args.genus or []], args.force)
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISH] Finished!")
+    if failures:
+        sys.exit(1)
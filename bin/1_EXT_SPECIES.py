@@ -1,20 +1,20 @@
-import pandas as pd
 from pathlib import Path
 from datetime import datetime
+from ptpp.ids import find_id_table, load_id_table
+from ptpp.metrics import track_step
+
+track_step()
 
 print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Generating table for species frequencies..")
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent
 
-# Load the input file from
-input_file = BASE_DIR.parent / "inputs" / "PROT_IDS.xlsx"
-df = pd.read_excel(input_file)
-
-# Standardize species names
-df["Species"] = df["Tax_Name"].str.strip().str.replace(r"[^\w]", "_", regex=True)
+# Load the input file (PROT_IDS.xlsx, .tsv or .csv) with standardized species names
+input_file = find_id_table(BASE_DIR.parent / "inputs")
+df = load_id_table(input_file)
 
 # Count frequency of each species
-freq_table = df["Species"].value_counts().reset_index()
+freq_table = df["Species"].astype(object).value_counts().reset_index()
 freq_table.columns = ["Species", "Frequency"]
 
 # Ensure the 'outputs' directory exists
@@ -1,37 +1,165 @@
 from pathlib import Path
 import pandas as pd
 import subprocess
+import argparse
+import json
 import os
+import sys
+import time
+import random
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from ptpp.manifest import RunManifest
+from ptpp import metrics
+
+# Download configuration
+max_downloads = 4 # Concurrent downloads (NCBI throttles clients with too many parallel requests)
+retries = 3 # Extra attempts after a failed download or an invalid zip
+backoff = 30 # Seconds before the first retry, doubled on each next retry
+download_timeout = 6 * 3600 # Longest time (s) of one download attempt
+datasets_bin = os.environ.get("PTPP_DATASETS", "datasets") # NCBI datasets binary (or a local stand-in, --datasets)
+force = False # Download again species whose zip is valid and unchanged (--force)
 
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent
 
 # Input file directory
 input_file = BASE_DIR.parent / "inputs" / "species_frequency.csv"
-df = pd.read_csv(input_file, sep=";")
 
 # Genomes files directory
 genomes_base_dir = BASE_DIR.parent / "data" / "genomes"
-genomes_base_dir.mkdir(parents=True, exist_ok=True)
+LOG_DIR = BASE_DIR.parent / "logs"
 
-# Loop for downloading species files
-for species in df["Species"]:
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Downloading genome files for: {species}")
-    safe_species = species.replace("_", " ")
-    
-    output_dir = genomes_base_dir / species
-    output_dir.mkdir(parents=True, exist_ok=True)
+# One write per line, so lines of concurrent downloads do not interleave
+def log(message):
+    sys.stdout.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]{message}\n")
+    sys.stdout.flush()
 
-    zip_path = output_dir / f"{species}.zip"
-    cmd = [
-        "datasets", "download", "genome", "taxon", f"{safe_species}",
+def download_command(species, zip_path):
+    return [
+        datasets_bin, "download", "genome", "taxon", species.replace("_", " "),
         "--reference", "--include", "genome",
         "--filename", str(zip_path)
     ]
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Downloading genome files for: {species}")
+
+# Integrity of a downloaded zip: readable, CRCs match and at least one genome FASTA inside
+def check_zip(zip_path):
+    if not zip_path.exists() or zip_path.stat().st_size == 0:
+        return "missing or empty file"
+    if not zipfile.is_zipfile(zip_path):
+        return "not a zip file"
     try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] {species}: File not downloaded")
-print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISHED]")
+        with zipfile.ZipFile(zip_path) as archive:
+            bad_member = archive.testzip()
+            if bad_member:
+                return f"corrupted member {bad_member}"
+            if not any(name.endswith("_genomic.fna") for name in archive.namelist()):
+                return "no *_genomic.fna in the archive"
+    except (zipfile.BadZipFile, OSError, EOFError) as e:
+        return str(e)
+    return None
+
+# Genome already extracted by step 3 (the zip is removed by step 3)
+def already_unpacked(species):
+    return any(genomes_base_dir.glob(f"{species}_*_genomic.fna")) or any(genomes_base_dir.glob(f"{species}_*_genomic.fna.gz"))
+
+# Download one species with retries; returns (status, attempts, detail)
+def download_species(species, manifest):
+    output_dir = genomes_base_dir / species
+    zip_path = output_dir / f"{species}.zip"
+    params = {"taxon": species, "command": download_command(species, "")[1:-1]}
+
+    if not force:
+        if manifest.is_current(species, [], params, [zip_path]):
+            log(f"[SKIP] {species}: zip already downloaded and unchanged")
+            return "skipped", 0, str(zip_path)
+        if not zip_path.exists() and already_unpacked(species):
+            log(f"[SKIP] {species}: genome already unpacked in {genomes_base_dir}")
+            return "skipped", 0, "unpacked"
+        # A complete zip from an earlier run without a manifest record
+        if zip_path.exists() and check_zip(zip_path) is None:
+            manifest.record(species, [], params, [zip_path])
+            log(f"[SKIP] {species}: valid zip found, recorded in the manifest")
+            return "skipped", 0, str(zip_path)
+    manifest.invalidate(species)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    part_path = output_dir / f"{species}.zip.part"
+    error = None
+    for attempt in range(1, retries + 2):
+        if attempt > 1:
+            delay = backoff * 2 ** (attempt - 2) * random.uniform(0.8, 1.2)
+            log(f"[RETRY] {species}: attempt {attempt}/{retries + 1} in {delay:.0f}s ({error})")
+            time.sleep(delay)
+        log(f"[START] Downloading genome files for: {species}")
+        part_path.unlink(missing_ok=True)
+        try:
+            result = metrics.run(download_command(species, part_path), fields={"species": species},
+                                 capture_output=True, text=True, timeout=download_timeout)
+        except subprocess.TimeoutExpired:
+            error = f"timeout after {download_timeout}s"
+            continue
+        except OSError as e:
+            # Binary missing: retrying will not help
+            error = str(e)
+            break
+        if result.returncode != 0:
+            lines = (result.stderr or result.stdout or "").strip().splitlines()
+            error = lines[-1] if lines else f"exit code {result.returncode}"
+            continue
+        error = check_zip(part_path)
+        if error:
+            continue
+        os.replace(part_path, zip_path)
+        manifest.record(species, [], params, [zip_path])
+        log(f"[DONE] Downloading genome files for: {species} ({zip_path.stat().st_size / 1024**2:.1f} MB)")
+        return "downloaded", attempt, str(zip_path)
+
+    part_path.unlink(missing_ok=True)
+    log(f"[ERROR] {species}: File not downloaded ({error})")
+    return "failed", attempt, error
+
+def main():
+    global max_downloads, force, datasets_bin
+    parser = argparse.ArgumentParser(description="Download the reference genomes of the species list from NCBI")
+    parser.add_argument("--jobs", type=int, default=max_downloads, help="Concurrent downloads")
+    parser.add_argument("--force", action="store_true", default=force, help="Download species that are up to date")
+    parser.add_argument("--datasets", default=datasets_bin, help="datasets binary (or a local stand-in)")
+    parser.add_argument("--species", nargs="+", help="Only download these species")
+    args = parser.parse_args()
+    max_downloads = max(1, args.jobs)
+    force = args.force
+    datasets_bin = args.datasets
+    metrics.track_step()
+
+    df = pd.read_csv(input_file, sep=";")
+    species_list = list(dict.fromkeys(str(s) for s in df["Species"].dropna()))
+    if args.species:
+        species_list = [species for species in species_list if species in args.species]
+    genomes_base_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = RunManifest("2_GENOMES_DOWNLOAD")
+    log(f"[INFO] Downloading {len(species_list)} species with {max_downloads} concurrent downloads..")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_downloads) as pool:
+        results = list(pool.map(lambda species: download_species(species, manifest), species_list))
+
+    # Final report
+    report = [{"species": species, "status": status, "attempts": attempts, "detail": detail}
+              for species, (status, attempts, detail) in zip(species_list, results)]
+    counts = {status: sum(1 for row in report if row["status"] == status) for status in ("downloaded", "skipped", "failed")}
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    report_file = LOG_DIR / f"download_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    report_file.write_text(json.dumps({"elapsed": round(time.perf_counter() - start, 1), "counts": counts, "species": report}, indent=1))
+
+    log(f"[REPORT] {counts['downloaded']} downloaded, {counts['skipped']} up to date, {counts['failed']} failed (details in {report_file})")
+    for row in report:
+        if row["status"] == "failed":
+            log(f"[REPORT] {row['species']}: failed after {row['attempts']} attempts ({row['detail']}), rerun to retry")
+    log("[FINISHED]")
+    if counts["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
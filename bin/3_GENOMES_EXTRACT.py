@@ -0,0 +1,146 @@
+from pathlib import Path
+import argparse
+import os
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ptpp.catalog import FaiBuilder
+from ptpp.genome import BgzfWriter
+from ptpp import metrics
+
+# Extraction configuration
+max_jobs = 4 # Archives extracted in parallel
+compress = False # Write bgzip genomes ({name}.fna.gz) with their .fai and .gzi indexes (--bgzip)
+keep_zip = False # Keep the archives after extraction (--keep-zip), step 3 removed them
+force = False # Extract again genomes that already exist (--force)
+chunk_size = 1 << 22 # Bytes read from an archive member at a time
+
+# Base directory
+BASE_DIR = Path(__file__).resolve().parent
+
+# Genomes files directory
+genomes_base_dir = BASE_DIR.parent / "data" / "genomes"
+
+# One write per line, so lines of concurrent archives do not interleave
+def log(message):
+    sys.stdout.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]{message}\n")
+    sys.stdout.flush()
+
+# Genome FASTA members of an NCBI datasets archive (cds_from_genomic.fna and rna_from_genomic.fna are annotations)
+def is_genome(name):
+    base = os.path.basename(name)
+    return base.endswith("_genomic.fna") and not base.startswith(("cds_from_", "rna_from_"))
+
+# data/genomes/{species}_{code}_genomic.fna(.gz), as step 4 named them
+def output_path(species, member_name):
+    code = os.path.basename(member_name)[:-len("_genomic.fna")]
+    return genomes_base_dir / f"{species}_{code}_genomic.fna{'.gz' if compress else ''}"
+
+# Stream one FASTA into its output, indexing it on the way; the output only appears once complete
+def write_genome(source, output):
+    part = output.with_name(f"{output.name}.part")
+    fai = FaiBuilder()
+    writer = BgzfWriter(part) if compress else open(part, "wb")
+    try:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            writer.write(chunk)
+            fai.feed(chunk)
+    except BaseException:
+        writer.close()
+        part.unlink(missing_ok=True)
+        raise
+    writer.close()
+    os.replace(part, output)
+    # Indexes are written after the genome, so they are not seen as stale
+    if compress:
+        writer.write_gzi(f"{output}.gzi")
+    fai.write(f"{output}.fai")
+
+# Extract the genome FASTA members of one archive; returns (species, genomes written, error)
+def extract_archive(zip_path):
+    species = zip_path.relative_to(genomes_base_dir).parts[0]
+    written = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = [info for info in archive.infolist() if is_genome(info.filename)]
+            if not members:
+                return species, written, "no *_genomic.fna in the archive"
+            for info in members:
+                output = output_path(species, info.filename)
+                if not force and output.exists() and output.stat().st_mtime >= zip_path.stat().st_mtime:
+                    log(f"[SKIP] {output.name}: already extracted")
+                    continue
+                log(f"[START] Extracting: {zip_path.name}:{info.filename} -> {output.name} ({info.file_size / 1024**2:.1f} MB)")
+                with metrics.measure("extract_genome", species=species, bytes=info.file_size):
+                    with archive.open(info) as source:
+                        write_genome(source, output)
+                written.append(output)
+                log(f"[DONE] Extracting: {output.name}")
+    except (zipfile.BadZipFile, OSError, EOFError) as e:
+        return species, written, str(e)
+
+    if not keep_zip:
+        log(f"[INFO] Removing zip file: {zip_path}")
+        zip_path.unlink()
+    return species, written, None
+
+# Genomes unzipped by hand (or by 3_GENOMES_UNZIP.sh) are moved like step 4 did, or compressed with --bgzip
+def move_unpacked(path):
+    species = path.relative_to(genomes_base_dir).parts[0]
+    output = output_path(species, path.name)
+    log(f"[START] Moving: {path} -> {output.name}..")
+    if compress:
+        with open(path, "rb") as source:
+            write_genome(source, output)
+        path.unlink()
+    else:
+        shutil.move(path, output)
+    log(f"[DONE] Moving: {path} -> {output.name}!")
+    return output
+
+def main():
+    global max_jobs, compress, keep_zip, force
+    parser = argparse.ArgumentParser(description="Extract the genome FASTA files of the NCBI datasets archives into data/genomes")
+    parser.add_argument("--jobs", type=int, default=max_jobs, help="Archives extracted in parallel")
+    parser.add_argument("--bgzip", action="store_true", default=compress, help="Write bgzip genomes with .fai and .gzi indexes")
+    parser.add_argument("--keep-zip", action="store_true", default=keep_zip, help="Keep the archives after extraction")
+    parser.add_argument("--force", action="store_true", default=force, help="Extract genomes that already exist")
+    args = parser.parse_args()
+    max_jobs = max(1, args.jobs)
+    compress = args.bgzip
+    keep_zip = args.keep_zip
+    force = args.force
+    metrics.track_step()
+
+    genomes_base_dir.mkdir(parents=True, exist_ok=True)
+    archives = sorted(genomes_base_dir.glob("*/**/*.zip"))
+    log(f"[START] Extracting {len(archives)} archives with {max_jobs} jobs..")
+    start = time.perf_counter()
+    # Largest archives first, so the longest extraction does not start last
+    archives.sort(key=lambda path: -path.stat().st_size)
+    with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+        results = list(pool.map(extract_archive, archives))
+
+    unpacked = [path for path in sorted(genomes_base_dir.glob("*/**/*_genomic.fna")) if is_genome(path.name)]
+    for path in unpacked:
+        move_unpacked(path)
+
+    # Remove empty directories left by the archives and the moved files
+    for root, dirs, files in os.walk(genomes_base_dir, topdown=False):
+        if Path(root) != genomes_base_dir and not os.listdir(root):
+            os.rmdir(root)
+
+    failed = [(species, error) for species, _, error in results if error]
+    written = sum(len(outputs) for _, outputs, _ in results)
+    log(f"[REPORT] {written} genomes extracted from {len(archives)} archives, {len(unpacked)} moved, {len(failed)} failed in {time.perf_counter() - start:.1f}s")
+    for species, error in failed:
+        log(f"[ERROR] {species}: {error}")
+    log("[FINISHED]")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+from pathlib import Path
+import argparse
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ptpp.catalog import GENOME_PATTERN, GZIP_MAGIC, FaiBuilder, file_md5, genome_catalog
+from ptpp.genome import BgzfWriter
+from ptpp.jobs import available_cores
+from ptpp import metrics
+
+# makeblastdb params
+parse_seqids = True # -parse_seqids for the per-genus DBs (as 5a did; the merged DBs of 5b did not use it)
+reserved_cores = 2 # Cores left free (same as nproc --ignore=2)
+force = False # Rebuild DBs whose stamp matches their sources (--force)
+chunk_size = 1 << 22 # Bytes streamed to makeblastdb at a time
+
+# Merged DBs (5b): {DB name: [FASTA files]}; the headers of each file get the file name
+# (up to the first dot) as prefix, so contig names stay unique across the genomes
+merged_databases = {
+    # "Saccharum": ["data/genomes_manual/AP85-441.genome.fa", "data/genomes_manual/XTT22.genome.fa"],
+}
+merged_genome = True # Also write each merged genome to data/genomes/{name}_combined.fa.gz (bgzip, for steps 8 to 10)
+
+# Directories
+BASE_DIR = Path(__file__).resolve().parent.parent
+GENOMES_DIR = BASE_DIR/"data/genomes"
+DATABASE_DIR = BASE_DIR/"data/blast_db"
+LOG_DIR = BASE_DIR/"logs/makeblastdb"
+
+# One write per line, so lines of concurrent builds do not interleave
+def log(message):
+    sys.stdout.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]{message}\n")
+    sys.stdout.flush()
+
+def stamp_file(db_name):
+    return DATABASE_DIR/f"{db_name}.stamp.json"
+
+# DB files of a name (NAME.nhr, ... or volumes NAME.00.nhr, NAME.01.nhr, ... and NAME.nal)
+def database_files(db_name):
+    pattern = re.compile(re.escape(db_name) + r'(\.\d{2,3})?\.n[a-z]{2}$')
+    return sorted(path for path in DATABASE_DIR.glob(f"{db_name}.*") if pattern.match(path.name))
+
+# MD5 of a source FASTA, kept in the genome catalog of its folder while size and mtime are unchanged
+# (the catalogs are shared by the build threads)
+catalog_lock = threading.Lock()
+
+def source_md5(path):
+    if not GENOME_PATTERN.search(path.name):
+        return file_md5(path)
+    with catalog_lock:
+        return genome_catalog(path.parent).checksum(path)
+
+def source_state(path, prefix=None):
+    stat = path.stat()
+    state = {"path": str(path), "size": stat.st_size, "mtime": stat.st_mtime, "md5": source_md5(path)}
+    if prefix is not None:
+        state["prefix"] = prefix
+    return state
+
+# The stamp is written after makeblastdb succeeded: a DB is up to date only when its stamp matches
+# the sources (size, mtime and hash) and parameters, and the DB files it lists are still there
+def is_current(db_name, sources, params, outputs=()):
+    try:
+        stamp = json.loads(stamp_file(db_name).read_text())
+    except (OSError, ValueError):
+        return False
+    if stamp.get("params") != params or len(stamp.get("sources", [])) != len(sources):
+        return False
+    for recorded, (path, prefix) in zip(stamp["sources"], sources):
+        if not path.exists():
+            return False
+        stat = path.stat()
+        if (recorded.get("path"), recorded.get("prefix"), recorded.get("size"), recorded.get("mtime")) != (str(path), prefix, stat.st_size, stat.st_mtime):
+            return False
+        if recorded.get("md5") != source_md5(path):
+            return False
+    return all((DATABASE_DIR/name).exists() for name in stamp.get("files", [])) and all(Path(p).exists() for p in outputs)
+
+def write_stamp(db_name, sources, params):
+    stamp = {
+        "sources": [source_state(path, prefix) for path, prefix in sources],
+        "params": params,
+        "files": [path.name for path in database_files(db_name)],
+        "built": datetime.now().isoformat(timespec="seconds")
+    }
+    tmp_file = stamp_file(db_name).with_name(f"{stamp_file(db_name).name}.{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(stamp, indent=1))
+    os.replace(tmp_file, stamp_file(db_name))
+
+def open_genome(path):
+    with open(path, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+# Chunks of a FASTA (decompressed) with ">{prefix}_" in place of every ">" starting a header line
+def prefixed_chunks(path, prefix=None):
+    tag = b">" + prefix.encode() + b"_" if prefix else b">"
+    line_start = True
+    with open_genome(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            if prefix:
+                if line_start and chunk.startswith(b">"):
+                    chunk = tag + chunk[1:]
+                chunk = chunk.replace(b"\n>", b"\n" + tag)
+            line_start = chunk.endswith(b"\n")
+            yield chunk
+    # The next file must start on a new line
+    if not line_start:
+        yield b"\n"
+
+# Stream the sources to makeblastdb, optionally writing the same stream as a bgzip genome
+# (the genome only replaces the previous one if makeblastdb read the whole stream)
+def stream_sources(sources, genome_output=None):
+    if not genome_output:
+        for path, prefix in sources:
+            yield from prefixed_chunks(path, prefix)
+        return
+    part = genome_output.with_name(f"{genome_output.name}.part")
+    writer, fai = BgzfWriter(part), FaiBuilder()
+    complete = False
+    try:
+        for path, prefix in sources:
+            for chunk in prefixed_chunks(path, prefix):
+                writer.write(chunk)
+                fai.feed(chunk)
+                yield chunk
+        complete = True
+    finally:
+        writer.close()
+        if not complete:
+            part.unlink(missing_ok=True)
+    os.replace(part, genome_output)
+    writer.write_gzi(f"{genome_output}.gzi")
+    fai.write(f"{genome_output}.fai")
+
+# Build one DB; sources: [(FASTA, header prefix or None)]
+# A single plain FASTA is read by makeblastdb itself, anything else is streamed through stdin
+def build_database(db_name, sources, params, genome_output=None):
+    outputs = [genome_output] if genome_output else []
+    if not force and is_current(db_name, sources, params, outputs):
+        log(f"[SKIP] BLAST DB for {db_name} is up to date, skipping...")
+        return db_name, "skipped", None
+
+    # Without its stamp a half-written DB is never taken as done
+    stamp_file(db_name).unlink(missing_ok=True)
+    for path in database_files(db_name):
+        path.unlink()
+
+    streamed = genome_output is not None or len(sources) > 1 or any(prefix for _, prefix in sources)
+    if not streamed:
+        with open(sources[0][0], "rb") as f:
+            streamed = f.read(2) == GZIP_MAGIC
+    command = ["makeblastdb", "-dbtype", "nucl", "-out", str(DATABASE_DIR/db_name)]
+    if params["parse_seqids"]:
+        command.append("-parse_seqids")
+    if streamed:
+        command += ["-in", "-", "-title", db_name]
+    else:
+        command += ["-in", str(sources[0][0])]
+
+    log(f"[START] Creating BLAST DB for: {db_name} from {', '.join(path.name for path, _ in sources)}..")
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_file = LOG_DIR/f"{db_name}.log"
+    try:
+        with open(log_file, "w") as out:
+            result = metrics.run(command, fields={"genus": db_name}, stdout=out, stderr=subprocess.STDOUT,
+                                 input=stream_sources(sources, genome_output) if streamed else None)
+    except OSError as e:
+        log(f"[ERROR] BLAST DB for {db_name} was not created: {e}")
+        return db_name, "failed", str(e)
+    if result.returncode != 0 or not database_files(db_name):
+        lines = log_file.read_text(errors="replace").strip().splitlines()
+        error = lines[-1] if lines else f"exit code {result.returncode}"
+        log(f"[ERROR] BLAST DB for {db_name} was not created properly ({error}, see {log_file}), continuing..")
+        return db_name, "failed", error
+
+    write_stamp(db_name, sources, params)
+    log(f"[DONE] DB {db_name} created successfully!")
+    return db_name, "built", None
+
+# Per-genus DBs (5a): one DB per genus, from the genome steps 8 and 9 use for it
+def genus_databases(skip):
+    catalog = genome_catalog(GENOMES_DIR)
+    catalog.refresh()
+    databases = {}
+    for name in sorted(catalog.files):
+        genus = name.split("_")[0]
+        if genus in skip or genus in databases:
+            continue
+        genome_file = catalog.find(genus)
+        if genome_file is None:
+            continue
+        # A merged DB (built with --merge) is not replaced by a per-genus DB of its combined genome
+        try:
+            stamp = json.loads(stamp_file(genus).read_text())
+        except (OSError, ValueError):
+            stamp = {}
+        if any(source.get("prefix") for source in stamp.get("sources", [])):
+            log(f"[SKIP] BLAST DB for {genus} is a merged DB, rebuild it with --merge")
+            skip.add(genus)
+            continue
+        databases[genus] = [(genome_file, None)]
+    for name in sorted(catalog.files):
+        genus = name.split("_")[0]
+        if genus in databases and databases[genus][0][0].name != name:
+            log(f"[INFO] {name}: DB {genus} is built from {databases[genus][0][0].name}")
+    return databases
+
+def main():
+    global force
+    parser = argparse.ArgumentParser(description="Build the BLAST databases of the genomes in parallel")
+    parser.add_argument("--cores", type=int, default=max(1, available_cores() - reserved_cores), help="makeblastdb processes run at once")
+    parser.add_argument("--force", action="store_true", default=force, help="Rebuild DBs that are up to date")
+    parser.add_argument("--genus", nargs="+", help="Only build the DBs of these genera")
+    parser.add_argument("--merge", nargs="+", action="append", metavar="NAME FILE", help="Build a merged DB NAME from the given FASTA files (repeatable)")
+    args = parser.parse_args()
+    force = args.force
+    metrics.track_step()
+
+    merged = {name: list(files) for name, files in merged_databases.items()}
+    for name, *files in args.merge or []:
+        if not files:
+            parser.error(f"--merge {name} needs at least one FASTA file")
+        merged[name] = files
+
+    DATABASE_DIR.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for genus, sources in genus_databases(set(merged)).items():
+        if not args.genus or genus in args.genus:
+            jobs.append((genus, sources, {"parse_seqids": parse_seqids}, None))
+    for name, files in merged.items():
+        paths = [Path(f) if Path(f).is_absolute() else BASE_DIR/f for f in files]
+        missing = [str(path) for path in paths if not path.exists()]
+        if missing:
+            log(f"[ERROR] Merged DB {name}: missing {', '.join(missing)}")
+            continue
+        sources = [(path, path.name.split(".")[0]) for path in paths]
+        genome_output = GENOMES_DIR/f"{name}_combined.fa.gz" if merged_genome else None
+        jobs.append((name, sources, {"parse_seqids": False}, genome_output))
+
+    # makeblastdb uses one core: run as many as the budget allows, largest genomes first
+    cores = max(1, args.cores)
+    jobs.sort(key=lambda job: -sum(path.stat().st_size for path, _ in job[1]))
+    log(f"[START] Building {len(jobs)} BLAST DBs with {cores} parallel jobs..")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cores) as pool:
+        results = list(pool.map(lambda job: build_database(*job), jobs))
+
+    counts = {status: sum(1 for _, s, _ in results if s == status) for status in ("built", "skipped", "failed")}
+    log(f"[REPORT] {counts['built']} built, {counts['skipped']} up to date, {counts['failed']} failed in {time.perf_counter() - start:.1f}s")
+    log("[FINISHED] All available DBs were processed!")
+    if counts["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
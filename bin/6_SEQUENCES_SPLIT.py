@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
+import argparse
 import pandas as pd
 from Bio import SeqIO
 import re
+from collections import defaultdict
 from datetime import datetime
+from ptpp.fasta import open_text, read_fasta, record_id, FastaWriterPool
+from ptpp.ids import find_id_table, load_id_table
+from ptpp.manifest import RunManifest
+from ptpp.metrics import measure, track_step
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # Directories
 BASE_DIR = Path(__file__).resolve().parent
@@ -13,60 +24,198 @@ OUTPUT_DIR = BASE_DIR.parent / "outputs"
 INPUT_DIR = BASE_DIR.parent / "inputs"
 LOG_DIR = BASE_DIR.parent / "logs"
 DATA_DIR = BASE_DIR.parent / "data" / "genomes"
-for d in [OUTPUT_DIR, LOG_DIR, OUTPUT_DIR / "filtered_fasta"]:
-    d.mkdir(parents=True, exist_ok=True)
 
 # File names
 protein_fasta = INPUT_DIR / "PROT_DJ-DIR-JRL_unique.fasta"
-xlsx_file = INPUT_DIR / "PROT_IDS.xlsx"
+id_table_file = find_id_table(INPUT_DIR) # PROT_IDS.xlsx, .tsv or .csv
 log_file = LOG_DIR / "extract_species.log"
 
-# Extract genus name from table
-df = pd.read_excel(xlsx_file)
-df['Genus'] = df['Tax_Name'].str.extract(r'^(\w+)', expand=False)
-
-# Group IDs by genus
-genus_groups = df.groupby('Genus')['ID'].apply(lambda x: set(x.astype(str)))
-
-# Load ALL sequences
-all_records = list(SeqIO.parse(protein_fasta, "fasta"))
-
-# Start processing
-print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] FILTERING genus-specific FASTA files..")
-with open(log_file, "w") as log:
-    log.write("[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Starting sequence extraction by genus\n")
-    
-    for genus, ids in genus_groups.items():
-        if pd.isna(genus):
-            continue
-            
-        filtered_records = []
-        for record in all_records:
-            # Verify for multiple match
-            record_id = record.id.split('|')[0] if '|' in record.id else record.id
-            
-            # 1. Exact match
-            if any(id == record_id for id in ids):
-                filtered_records.append(record)
-                continue
-                
-            # 2. Verify if ID table matches FASTA ID
-            if any(id in record_id for id in ids):
-                filtered_records.append(record)
+# Streaming mode (read the FASTA once, write records as they are matched)
+streaming = True
+max_open_files = 256 # Open per-genus writers, least recently used are reopened in append mode
+force = False # Split again even if the FASTA and the ID table are unchanged (--force)
+
+# Matching rules, in order of precedence
+MATCH_RULES = ("exact", "substring", "partial")
+PARTIAL_SPLIT = re.compile(r'[._]')
+
+# Index of table IDs built once, matches each FASTA ID against all genera in one pass
+class GenusMatcher:
+    def __init__(self, genus_groups):
+        # 1. Exact match: table ID -> genera
+        self.exact = defaultdict(set)
+        # 2/3. Substring patterns (full table IDs and their partial IDs): pattern -> {genus: rule}
+        self.patterns = defaultdict(dict)
+
+        for genus, ids in genus_groups.items():
+            if pd.isna(genus):
                 continue
-                
-            # 3. Verify partial IDs (table ID and FASTA file IDs might diverge)
             for id in ids:
-                id_part = re.split(r'[._]', id)[0]
-                if id_part and id_part in record_id:
-                    filtered_records.append(record)
-                    break
-        
-        # Generate FASTA file by genus
-        output_fasta = OUTPUT_DIR / "filtered_fasta" / f"{genus}.fasta"
-        SeqIO.write(filtered_records, output_fasta, "fasta")
-        log.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] {genus} sequences extracted: {len(filtered_records)}\n")
-        log.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Output FASTA: {output_fasta}\n")
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] {len(filtered_records)} {genus} sequences saved to: {output_fasta}!")
-
-print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISHED] All genus-specific FASTA files created successfully!")
+                self.exact[id].add(genus)
+                self._add_pattern(id, genus, 1)
+
+                # Partial IDs (table ID and FASTA file IDs might diverge)
+                id_part = PARTIAL_SPLIT.split(id, 1)[0]
+                if id_part:
+                    self._add_pattern(id_part, genus, 2)
+
+        # Substring automaton over all patterns
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for pattern in self.patterns:
+                self.automaton.add_word(pattern, pattern)
+            if self.patterns:
+                self.automaton.make_automaton()
+            else:
+                self.automaton = None
+        else:
+            # Fallback: hash lookups of every window with a pattern length
+            self.automaton = None
+            self.lengths = sorted({len(pattern) for pattern in self.patterns})
+
+    def _add_pattern(self, pattern, genus, rule):
+        genera = self.patterns[pattern]
+        if rule < genera.get(genus, len(MATCH_RULES)):
+            genera[genus] = rule
+
+    def _substrings(self, record_id):
+        if ahocorasick is not None:
+            if self.automaton is not None:
+                for _, pattern in self.automaton.iter(record_id):
+                    yield pattern
+            return
+        for length in self.lengths:
+            if length > len(record_id):
+                break
+            for i in range(len(record_id) - length + 1):
+                window = record_id[i:i + length]
+                if window in self.patterns:
+                    yield window
+
+    # Return {genus: rule} with the highest precedence rule that matched each genus
+    def match(self, record_id):
+        hits = {genus: 0 for genus in self.exact.get(record_id, ())}
+        for pattern in self._substrings(record_id):
+            for genus, rule in self.patterns[pattern].items():
+                if rule < hits.get(genus, len(MATCH_RULES)):
+                    hits[genus] = rule
+        return hits
+
+# Split records by genus
+def split_by_genus(records, genus_groups):
+    matcher = GenusMatcher(genus_groups)
+    filtered_records = defaultdict(list)
+    rule_counts = dict.fromkeys(MATCH_RULES, 0)
+
+    for record in records:
+        # Verify for multiple match
+        record_id = record.id.split('|')[0] if '|' in record.id else record.id
+        hits = matcher.match(record_id)
+        for genus in hits:
+            filtered_records[genus].append(record)
+        # A record matching several genera is counted once per rule
+        for rule in set(hits.values()):
+            rule_counts[MATCH_RULES[rule]] += 1
+
+    return filtered_records, rule_counts
+
+# Split records by genus streaming from the input file to per-genus writers
+def stream_split_by_genus(fasta_file, genus_groups, output_dir):
+    matcher = GenusMatcher(genus_groups)
+    rule_counts = dict.fromkeys(MATCH_RULES, 0)
+
+    with FastaWriterPool(max_open_files) as writers:
+        for genus in genus_groups.index:
+            if not pd.isna(genus):
+                writers.add(genus, output_dir / f"{genus}.fasta")
+
+        for header, sequence in read_fasta(fasta_file):
+            rid = record_id(header)
+            rid = rid.split('|')[0] if '|' in rid else rid
+            hits = matcher.match(rid)
+            for genus in hits:
+                writers.write(genus, header, sequence)
+            # A record matching several genera is counted once per rule
+            for rule in set(hits.values()):
+                rule_counts[MATCH_RULES[rule]] += 1
+
+    return writers.counts, rule_counts
+
+# Accept gzip compressed input next to the plain FASTA
+def find_protein_fasta():
+    if not protein_fasta.exists():
+        gz_file = protein_fasta.with_name(protein_fasta.name + ".gz")
+        if gz_file.exists():
+            return gz_file
+    return protein_fasta
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the protein FASTA into one FASTA per genus")
+    parser.add_argument("--force", action="store_true", default=force, help="Split again even if up to date")
+    args = parser.parse_args()
+    track_step()
+
+    for d in [OUTPUT_DIR, LOG_DIR, OUTPUT_DIR / "filtered_fasta"]:
+        d.mkdir(parents=True, exist_ok=True)
+
+    # ID table with the genus of each ID (parsed once, then loaded from its cache)
+    with measure("load_id_table"):
+        df = load_id_table(id_table_file)
+
+    # Group IDs by genus
+    genus_groups = df.groupby('Genus', observed=True)['ID'].apply(set)
+
+    fasta_file = find_protein_fasta()
+    filtered_dir = OUTPUT_DIR / "filtered_fasta"
+
+    # Skip when the inputs are unchanged and every genus FASTA is in place
+    # (rewritten genus files with the same content do not invalidate the next steps)
+    manifest = RunManifest("6_SEQUENCES_SPLIT")
+    inputs = [fasta_file, id_table_file]
+    params = {"match_rules": MATCH_RULES}
+    outputs = [filtered_dir / f"{genus}.fasta" for genus in genus_groups.index if not pd.isna(genus)]
+    if not args.force and manifest.is_current("all", inputs, params, outputs):
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SKIP] Genus FASTA files are up to date, use --force to split again..")
+        return
+    manifest.invalidate("all")
+
+    # Start processing
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] FILTERING genus-specific FASTA files..")
+    with open(log_file, "w") as log:
+        log.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Starting sequence extraction by genus\n")
+
+        if streaming:
+            with measure("stream_split_by_genus"):
+                genus_counts, rule_counts = stream_split_by_genus(fasta_file, genus_groups, filtered_dir)
+        else:
+            # Load ALL sequences
+            with open_text(fasta_file) as handle:
+                all_records = list(SeqIO.parse(handle, "fasta"))
+            with measure("split_by_genus"):
+                filtered_records, rule_counts = split_by_genus(all_records, genus_groups)
+
+            # Generate FASTA file by genus
+            genus_counts = {}
+            for genus in genus_groups.index:
+                if pd.isna(genus):
+                    continue
+                records = filtered_records.get(genus, [])
+                SeqIO.write(records, filtered_dir / f"{genus}.fasta", "fasta")
+                genus_counts[genus] = len(records)
+
+        for genus, count in genus_counts.items():
+            output_fasta = filtered_dir / f"{genus}.fasta"
+            log.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] {genus} sequences extracted: {count}\n")
+            log.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Output FASTA: {output_fasta}\n")
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] {count} {genus} sequences saved to: {output_fasta}!")
+
+        # Report matches by rule
+        for rule, count in rule_counts.items():
+            log.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Records matched by {rule} ID: {count}\n")
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Records matched by {rule} ID: {count}")
+
+    manifest.record("all", inputs, params, outputs)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISHED] All genus-specific FASTA files created successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import subprocess
+from pathlib import Path
+import sys
+import os
+import json
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ptpp.blast import best_hits, chain_loci
+from ptpp.fasta import read_fasta, format_record
+from ptpp.jobs import available_cores
+from ptpp.manifest import RunManifest
+from ptpp.tables import TABLE_FORMATS, write_tables
+from ptpp import metrics
+
+# tblastn params
+evalue = 1e-5
+max_target_seqs = 1
+chunk_size = 200 # Query sequences per tblastn process
+threads_per_job = 2 # Threads of each tblastn process (tblastn scales poorly past a few)
+reserved_cores = 2 # Cores left free (same as nproc --ignore=2)
+chain_hits = True # Also chain collinear HSPs into gene-level loci ({genus}_loci.txt)
+max_intron = 50000 # Largest subject gap between chained HSPs
+force = False # Rerun genera whose queries, database and parameters are unchanged (--force)
+table_format = "text" # Also write tblastn and best hit tables as "parquet" or "bgzip" (bgzip + tabix) copies (--table-format)
+
+# Directories
+BASE_DIR = Path(__file__).resolve().parent.parent
+PROTEIN_DIR = BASE_DIR/"outputs/filtered_fasta"
+DATABASE_DIR = BASE_DIR/"data/blast_db"
+OUTPUT_DIR = BASE_DIR/"outputs/blast_results"
+
+# BLAST DB volumes of a genus and their total size (None if the DB does not exist)
+def database_size(genus):
+    volumes = list(DATABASE_DIR.glob(f"{genus}*.nsq"))
+    if not volumes:
+        return None
+    return sum(volume.stat().st_size for volume in volumes)
+
+# Files a genus result depends on (queries and BLAST DB volumes) and produces
+def genus_files(genus, protein_file):
+    inputs = [protein_file] + sorted(
+        path for path in DATABASE_DIR.glob(f"{genus}*")
+        if path.suffix in (".nal", ".nhr", ".nin", ".nsq")
+    )
+    outputs = [OUTPUT_DIR/f"{genus}_tblastn.txt", OUTPUT_DIR/f"{genus}_BH.txt"]
+    if chain_hits:
+        outputs.append(OUTPUT_DIR/f"{genus}_loci.txt")
+    return inputs, outputs
+
+# Tables with optional Parquet or bgzip/tabix copies
+def genus_tables(genus):
+    return [(OUTPUT_DIR/f"{genus}_tblastn.txt", "outfmt6"), (OUTPUT_DIR/f"{genus}_BH.txt", "outfmt6")]
+
+def manifest_params():
+    return {"evalue": evalue, "max_target_seqs": max_target_seqs, "chain_hits": chain_hits, "max_intron": max_intron}
+
+def tblastn_command(query_file, genus, output_file, threads):
+    return [
+        "tblastn",
+        "-query", str(query_file),
+        "-db", str(DATABASE_DIR/genus),
+        "-out", str(output_file),
+        "-evalue", str(evalue),
+        "-outfmt", "6",
+        "-max_target_seqs", str(max_target_seqs),
+        "-num_threads", str(threads)
+    ]
+
+def chunks_dir(genus):
+    return OUTPUT_DIR/f"{genus}_chunks"
+
+# Split the queries of a genus into chunk FASTA files (reused with their results while the
+# queries, BLAST DB volumes and parameters are unchanged, so an interrupted run can resume)
+def split_queries(genus, protein_file):
+    chunk_dir = chunks_dir(genus)
+    inputs, _ = genus_files(genus, protein_file)
+    source = {
+        "inputs": [[str(path), path.stat().st_size, path.stat().st_mtime] for path in inputs],
+        "chunk_size": chunk_size,
+        "params": tblastn_command("", genus, "", 1)[3:-2]
+    }
+    source_file = chunk_dir/"source.json"
+    if source_file.exists():
+        try:
+            if json.loads(source_file.read_text()) == source:
+                return sorted(chunk_dir.glob("chunk_*.fasta"))
+        except ValueError:
+            pass
+
+    if chunk_dir.exists():
+        shutil.rmtree(chunk_dir)
+    chunk_dir.mkdir(parents=True)
+
+    chunks = []
+    out = None
+    for n, (header, sequence) in enumerate(read_fasta(protein_file)):
+        if n % chunk_size == 0:
+            if out:
+                out.close()
+            chunks.append(chunk_dir/f"chunk_{len(chunks):04d}.fasta")
+            out = open(chunks[-1], "w")
+        out.write(format_record(header, sequence))
+    if out:
+        out.close()
+    source_file.write_text(json.dumps(source))
+    return chunks
+
+def main():
+    parser = argparse.ArgumentParser(description="Run tblastn for each genus on query chunks sharing a core budget")
+    parser.add_argument("--cores", type=int, default=max(1, available_cores() - reserved_cores), help="Total core budget")
+    parser.add_argument("--threads-per-job", type=int, default=threads_per_job, help="Threads of each tblastn process")
+    parser.add_argument("--force", action="store_true", default=force, help="Rerun genera that are up to date")
+    parser.add_argument("--genus", nargs="+", help="Only process these genera")
+    parser.add_argument("--table-format", choices=TABLE_FORMATS, default=table_format, help="Also write the tables as Parquet or bgzip/tabix copies")
+    args = parser.parse_args()
+    metrics.track_step()
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    threads = max(1, min(args.threads_per_job, args.cores))
+    workers = max(1, args.cores // threads)
+
+    # Genera with a BLAST DB, largest DB first so the run does not end on one slow genus
+    # Genera whose queries, database and parameters are unchanged are skipped
+    manifest = RunManifest("7_SEQUENCES_TBLASTN")
+    genera = []
+    n_found = 0
+    for protein_file in sorted(PROTEIN_DIR.glob("*.fasta")):
+        genus = protein_file.stem
+        if args.genus and genus not in args.genus:
+            continue
+        db_size = database_size(genus)
+        if db_size is None:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][WARNING] Database for {genus} not found, skipping...")
+            continue
+        n_found += 1
+        inputs, outputs = genus_files(genus, protein_file)
+        if not args.force and manifest.is_current(genus, inputs, manifest_params(), outputs):
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SKIP] {genus} is up to date, use --force to rerun..")
+            write_tables(genus_tables(genus), args.table_format)
+            continue
+        # A forced or stale genus (one with a record of a completed run) is rerun from scratch;
+        # only a genus without a record, i.e. an interrupted run, resumes from its chunk results
+        if args.force or manifest.has_record(genus):
+            shutil.rmtree(chunks_dir(genus), ignore_errors=True)
+        manifest.invalidate(genus)
+        genera.append((db_size, genus, protein_file))
+    genera.sort(key=lambda x: x[0], reverse=True)
+
+    if not n_found:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] No protein FASTA with a BLAST DB found, run previous steps first!")
+        sys.exit(1)
+
+    # Chunks without complete output
+    tasks = []
+    chunks = {}
+    for _, genus, protein_file in genera:
+        chunks[genus] = split_queries(genus, protein_file)
+        for chunk in chunks[genus]:
+            if not chunk.with_suffix(".tsv").exists():
+                tasks.append((genus, chunk))
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Running {len(tasks)} tblastn chunks ({sum(len(c) for c in chunks.values()) - len(tasks)} already complete) with {workers} x {threads} threads..")
+
+    failed = set()
+    lock = threading.Lock()
+
+    def run_chunk(task):
+        genus, chunk = task
+        part_file = chunk.with_suffix(".tsv.part")
+        try:
+            metrics.run(tblastn_command(chunk, genus, part_file, threads), fields={"genus": genus}, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] tblastn failed for {chunk.name} of {genus}: {e}", flush=True)
+            with lock:
+                failed.add(genus)
+            return
+        os.replace(part_file, chunk.with_suffix(".tsv"))
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] tblastn {genus} {chunk.stem}", flush=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_chunk, tasks))
+
+    # Concatenate chunk results in a fixed order and select best hits
+    for _, genus, protein_file in genera:
+        if genus in failed:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] {genus} has failed chunks, rerun to resume..")
+            continue
+        tblastn_file = OUTPUT_DIR/f"{genus}_tblastn.txt"
+        with open(tblastn_file, "w") as out:
+            for chunk in chunks[genus]:
+                with open(chunk.with_suffix(".tsv")) as f:
+                    shutil.copyfileobj(f, out)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SUCCESS] tblastn for {protein_file}, continuing..")
+
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Filtering best hits for {protein_file}...")
+        with metrics.measure("best_hits", genus=genus):
+            n_hits = best_hits(tblastn_file, OUTPUT_DIR/f"{genus}_BH.txt")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SUCCESS] Filtered {n_hits} best hits for {protein_file}, continuing..")
+        if chain_hits:
+            with metrics.measure("chain_loci", genus=genus):
+                n_loci = chain_loci(tblastn_file, OUTPUT_DIR/f"{genus}_loci.txt", max_intron)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SUCCESS] Chained HSPs into {n_loci} loci for {protein_file}, continuing..")
+        write_tables(genus_tables(genus), args.table_format)
+        inputs, outputs = genus_files(genus, protein_file)
+        manifest.record(genus, inputs, manifest_params(), outputs)
+        # Chunks are only kept to resume an interrupted run
+        shutil.rmtree(chunks_dir(genus), ignore_errors=True)
+
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISHED] tblastn process completed with best hits extracted!")
+
+if __name__ == "__main__":
+    main()
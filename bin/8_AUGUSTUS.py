@@ -1,15 +1,42 @@
-from pyfaidx import Fasta
 import subprocess
 from pathlib import Path
 import sys
 import glob
+import argparse
 import re
 import os
+import shutil
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime 
+from ptpp.blast import read_loci
+from ptpp.catalog import genome_catalog
+from ptpp.fasta import read_fasta, format_record
+from ptpp.genome import GenomeReader
+from ptpp.gff import convert_augustus_gff
+from ptpp.intervals import cluster_sorted, merge_by_contig
+from ptpp.jobs import available_cores, balanced_shards, run_genera, print_failures
+from ptpp.manifest import RunManifest
+from ptpp.tables import TABLE_FORMATS, read_table, write_tables
+from ptpp import metrics
 
 # Base configuration
 padding = 1000 # For sequence sizes (+-)
+merge_distance = 0 # Padded windows overlapping or closer than this (bp) are merged into one region
 species = "wheat"  # Check with 'augustus --species=help'
+hit_source = "bh" # "bh": tblastn best hits ({genus}_BH.txt), "loci": chained HSP loci from step 7 ({genus}_loci.txt)
+augustus_shards = 0 # Region shards balanced by bp (0 = available cores, 1 = single AUGUSTUS process)
+augustus_workers = 0 # Concurrent AUGUSTUS processes per genus (0 = available cores / --jobs)
+jobs = 1 # Genera processed in parallel (--jobs)
+mmap_genome = False # Memory-map plain genomes during region extraction (bgzip genomes are read through their .gzi)
+write_buffer = 1 << 22 # Output buffer (bytes) of the regions FASTA and map
+write_batch = 1024 # Regions joined into one write
+force = False # Rerun genera whose inputs, parameters and outputs are unchanged (--force)
+table_format = "text" # Also write hints, AUGUSTUS GFF and GTFs as "parquet" or "bgzip" (bgzip + tabix) copies (--table-format)
+compact_hints = True # Merge near-identical hints into one hint with mult=N (queries kept in {genus}_hints_groups.tsv)
+hint_min_overlap = 0.9 # Overlap (fraction of both lengths) of hints merged into one
 
 # Directories
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -17,6 +44,14 @@ BLAST_RESULTS_DIR = BASE_DIR/"outputs/blast_results"
 GENOMES_DIR = BASE_DIR/"data/genomes"
 OUTPUT_DIR = BASE_DIR/"outputs"
 
+# Usual locations of the extrinsic configuration when AUGUSTUS is not on the PATH
+common_paths = [
+    Path(os.environ.get("CONDA_PREFIX", "/opt/conda"))/"config/extrinsic/extrinsic.M.RM.E.W.cfg",
+    Path("/usr/share/augustus/config/extrinsic/extrinsic.M.RM.E.W.cfg"),
+    Path("/usr/local/share/augustus/config/extrinsic/extrinsic.M.RM.E.W.cfg"),
+    Path("/opt/augustus/config/extrinsic/extrinsic.M.RM.E.W.cfg"),
+]
+
 # Function to find extrinsic file:
 def find_extrinsic_cfg():
     # 1. Find in Augustus Path
@@ -42,57 +77,294 @@ def find_extrinsic_cfg():
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Extrinsic configuration file not found, check your Augustus installation!")
     return None
 
-# Check extrinsic valid types
+# Check extrinsic valid types (parsed once per file version, genera share the result)
+@lru_cache(maxsize=None)
+def read_hint_types(cfg_file, size, mtime):
+    valid_types = set()
+    with open(cfg_file, 'r') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            parts = line.strip().split()
+            if len(parts) >= 2:
+                valid_types.add(parts[0])
+    return frozenset(valid_types)
+
 def list_valid_hint_types(cfg_file):
-    valid_types = []
     try:
-        with open(cfg_file, 'r') as f:
-            for line in f:
-                if line.startswith('#') or not line.strip():
-                    continue
-                parts = line.strip().split()
-                if len(parts) >= 2:
-                    valid_types.append(parts[0])
-        return list(set(valid_types))
+        stat = os.stat(cfg_file)
+        return list(read_hint_types(str(cfg_file), stat.st_size, stat.st_mtime))
     except Exception as e:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Invalid hint type: {e}, using 'exonpart' as failback..")
         return ["CDS", "start", "stop", "dss", "ass", "tss", "tts", "exonpart"]
 
 # Find match genome with inserted genus
 def find_genome_file(genus):
-    pattern = re.compile(rf'{genus}.*\.(fa|fna|fasta)$', re.IGNORECASE)
-    for file in GENOMES_DIR.glob('*'):
-        if pattern.search(file.name):
-            return file
-    return None
+    return genome_catalog(GENOMES_DIR).find(genus)
+
+# Hit segments (query, contig, start, end, strand, evalue) from best hits or chained loci (one per HSP)
+def read_hit_segments(blast_results):
+    if Path(blast_results).name.endswith("_loci.txt"):
+        for locus in read_loci(blast_results):
+            for start, end in locus["hsps"]:
+                yield locus["query"], locus["contig"], start, end, locus["strand"], locus["evalue"]
+        return
+    
+    hits = read_table(blast_results, "outfmt6", columns=["qseqid", "sseqid", "sstart", "send", "evalue"])
+    for query, contig, start, end, evalue in hits.itertuples(index=False, name=None):
+        strand = '+' if start < end else '-'
+        
+        # Check start < end
+        if start > end:
+            start, end = end, start
+        yield query, contig, start, end, strand, evalue
+
+# Hit segments as a table with the same columns (vectorized for best hits)
+def read_hit_table(blast_results):
+    columns = ["query", "contig", "start", "end", "strand", "evalue"]
+    if Path(blast_results).name.endswith("_loci.txt"):
+        return pd.DataFrame.from_records(list(read_hit_segments(blast_results)), columns=columns)
+    
+    hits = read_table(blast_results, "outfmt6", columns=["qseqid", "sseqid", "sstart", "send", "evalue"])
+    return pd.DataFrame({
+        "query": hits["qseqid"], "contig": hits["sseqid"],
+        "start": np.minimum(hits["sstart"], hits["send"]), "end": np.maximum(hits["sstart"], hits["send"]),
+        "strand": np.where(hits["sstart"] < hits["send"], "+", "-"), "evalue": hits["evalue"]
+    }, columns=columns)
 
-# Generate hints file formated for Augustus
-def generate_hints_file(blast_results, hints_gff, cfg_file):
+# Hit spans (query, contig, start, end) to extract: whole loci, or single best hits
+def read_hit_spans(blast_results):
+    if Path(blast_results).name.endswith("_loci.txt"):
+        for locus in read_loci(blast_results):
+            yield locus["query"], locus["contig"], locus["start"], locus["end"]
+        return
+    
+    for query, contig, start, end, _, _ in read_hit_segments(blast_results):
+        yield query, contig, start, end
+
+# Side table of the queries (grp) behind each hint of a hints file
+def hints_groups_path(hints_gff):
+    return Path(hints_gff).with_name(f"{Path(hints_gff).stem}_groups.tsv")
+
+# Generate hints file formated for Augustus; returns (hits read, hints written)
+# With compact_hints, hints of one contig, strand and type overlapping by hint_min_overlap are written
+# once with mult=N and the best e-value; single hints keep their grp= and every hint is listed with
+# its queries in the groups side table
+def generate_hints_file(blast_results, hints_gff, cfg_file, groups_file=None):
     valid_types = list_valid_hint_types(cfg_file)
     hint_type = "ep" if "ep" in valid_types else "exonpart"
     
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Using hint type: {hint_type}..")
     
-    with open(blast_results) as fin, open(hints_gff, 'w') as fout:
-        for line in fin:
-            if line.strip():
-                fields = line.strip().split('\t')
-                contig = fields[1]
-                start = int(fields[8])
-                end = int(fields[9])
-                
-                # Check start < end
-                if start > end:
-                    start, end = end, start
-                
-                strand = '+' if int(fields[8]) < int(fields[9]) else '-'
-                evalue = fields[10]
-                
+    if not compact_hints:
+        n_hits = 0
+        with open(hints_gff, 'w') as fout:
+            for query, contig, start, end, strand, evalue in read_hit_segments(blast_results):
                 # Formatting for Augustus
-                fout.write(f"{contig}\tblastX\t{hint_type}\t{start}\t{end}\t{evalue}\t{strand}\t.\tgrp={fields[0]};pri=4;src=M\n")
+                fout.write(f"{contig}\tblastX\t{hint_type}\t{start}\t{end}\t{evalue}\t{strand}\t.\tgrp={query};pri=4;src=M\n")
+                n_hits += 1
+        return n_hits, n_hits
+    
+    # Clusters are searched on hits sorted by contig, strand and start (numeric keys, the table is not reordered)
+    hits = read_hit_table(blast_results)
+    contig_codes = pd.factorize(hits["contig"])[0]
+    keys = contig_codes * 2 + (hits["strand"].to_numpy() == "-")
+    starts, ends = hits["start"].to_numpy(), hits["end"].to_numpy()
+    order = np.lexsort((ends, starts, keys))
+    cluster = np.empty(len(hits), dtype=np.int64)
+    cluster[order] = cluster_sorted(keys[order].tolist(), starts[order].tolist(), ends[order].tolist(), hint_min_overlap)
+    
+    # One hint per cluster: union of the intervals, best e-value (as written by BLAST) and hit count
+    clusters = hits.groupby(cluster)
+    best = hits.loc[hits["evalue"].astype(float).groupby(cluster).idxmin()]
+    hints = pd.DataFrame({
+        "contig": best["contig"].to_numpy(),
+        "start": clusters["start"].min().to_numpy(),
+        "end": clusters["end"].max().to_numpy(),
+        "strand": best["strand"].to_numpy(),
+        "evalue": best["evalue"].astype(str).to_numpy(),
+        "mult": clusters.size().to_numpy(),
+        "grp": best["query"].to_numpy()
+    })
+    merged = (hints["mult"] > 1).to_numpy()
+    if merged.any():
+        in_merged = merged[cluster]
+        queries = hits["query"][in_merged].groupby(cluster[in_merged])
+        hints.loc[merged, "grp"] = queries.agg(lambda names: ",".join(dict.fromkeys(names))).to_numpy()
+    hints = hints.iloc[np.lexsort((hints["end"], hints["start"], contig_codes[best.index]))]
+    
+    columns = [hints[column].tolist() for column in ("contig", "start", "end", "strand", "evalue", "mult", "grp")]
+    with open(hints_gff, 'w') as fout, open(groups_file or hints_groups_path(hints_gff), 'w') as groups:
+        groups.write("contig\tstart\tend\tstrand\ttype\tmult\tevalue\tgrp\n")
+        for contig, start, end, strand, evalue, mult, grp in zip(*columns):
+            # Formatting for Augustus (a merged hint belongs to no single alignment group)
+            attributes = f"grp={grp}" if mult == 1 else f"mult={mult}"
+            fout.write(f"{contig}\tblastX\t{hint_type}\t{start}\t{end}\t{evalue}\t{strand}\t.\t{attributes};pri=4;src=M\n")
+            groups.write(f"{contig}\t{start}\t{end}\t{strand}\t{hint_type}\t{mult}\t{evalue}\t{grp}\n")
+    return len(hits), len(hints)
+
+# Padded windows around each hit, merged per contig and mapped back to their queries
+def merge_regions(blast_results, contig_lengths):
+    windows = []
+    for query, contig, start, end in read_hit_spans(blast_results):
+        # Find valid coordinates
+        region_start = max(1, start - padding)
+        region_end = min(contig_lengths[contig], end + padding)
+        windows.append((contig, region_start, region_end, query))
+    
+    return merge_by_contig(windows, merge_distance)
+
+# Write merged regions and the region -> queries map
+# Regions are read in genome file order (one forward pass) and written in that order
+# sequences: optional dict filled with {region_id: sequence}
+def extract_regions(blast_results, genome_file, contig_lengths, output_fasta, regions_map, sequences=None):
+    merged = merge_regions(blast_results, contig_lengths)
+    regions = [(contig, region_start, region_end, queries)
+               for contig, windows in merged.items()
+               for region_start, region_end, queries in windows]
+    n_regions = 0
+    records = []
+    rows = []
+    
+    with GenomeReader(genome_file, use_mmap=mmap_genome) as genome, \
+            open(output_fasta, "w", buffering=write_buffer) as out, \
+            open(regions_map, "w", buffering=write_buffer) as map_out:
+        map_out.write("region\tcontig\tstart\tend\tqueries\n")
+        for (contig, region_start, region_end, queries), seq in genome.fetch_many(regions):
+            region_id = f"{contig}:{region_start}-{region_end}"
+            if seq is None:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Ignoring region {region_id}: contig not in genome, continuing..")
+                continue
+            records.append(f">{region_id}\n{seq}\n")
+            if sequences is not None:
+                sequences[region_id] = seq
+            rows.append(f"{region_id}\t{contig}\t{region_start}\t{region_end}\t{','.join(dict.fromkeys(queries))}\n")
+            n_regions += 1
+            if len(records) >= write_batch:
+                out.write("".join(records))
+                map_out.write("".join(rows))
+                records.clear()
+                rows.clear()
+        out.write("".join(records))
+        map_out.write("".join(rows))
+    return n_regions
+
+# Build Augustus command line
+def augustus_command(regions_fasta, hints_gff, extrinsic_cfg):
+    cmd = [
+        "augustus",
+        f"--species={species}",
+        "--protein=on",
+        "--gff3=on"
+    ]
+    
+    # Include extrinsic file
+    if extrinsic_cfg:
+        cmd.append(f"--extrinsicCfgFile={extrinsic_cfg}")
+        cmd.append(f"--hintsfile={hints_gff}")
+    
+    cmd.append(str(regions_fasta))
+    return cmd
+
+# Split regions and their hints into shards balanced by total base pairs
+def split_regions(regions_fasta, hints_gff, shard_dir, n_shards):
+    regions = [(header, len(seq)) for header, seq in read_fasta(regions_fasta)]
+    shards = balanced_shards(regions, n_shards, weight=lambda region: region[1])
+    shard_of = {}
+    for i, shard in enumerate(shards):
+        for header, _ in shard:
+            shard_of[header] = i
+    
+    # Hints follow the regions of their contig (hints may use contig or region names)
+    contig_shards = {}
+    for header, i in shard_of.items():
+        contig_shards.setdefault(header.split()[0].rsplit(':', 1)[0], set()).add(i)
+    
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    fasta_files = [shard_dir/f"shard_{i:04d}.fasta" for i in range(len(shards))]
+    hints_files = [shard_dir/f"shard_{i:04d}_hints.gff" for i in range(len(shards))]
+    fasta_out = [open(path, "w") for path in fasta_files]
+    try:
+        for header, seq in read_fasta(regions_fasta):
+            fasta_out[shard_of[header]].write(format_record(header, seq))
+    finally:
+        for out in fasta_out:
+            out.close()
+    
+    hints_out = [open(path, "w") for path in hints_files]
+    try:
+        if hints_gff and Path(hints_gff).exists():
+            with open(hints_gff) as f:
+                for line in f:
+                    seqid = line.split('\t', 1)[0]
+                    targets = {shard_of[seqid]} if seqid in shard_of else contig_shards.get(seqid, ())
+                    for i in targets:
+                        hints_out[i].write(line)
+    finally:
+        for out in hints_out:
+            out.close()
+    
+    return list(zip(fasta_files, hints_files))
+
+# Merge shard GFF3 outputs in order, renumbering genes so IDs stay unique
+GENE_ID = re.compile(r'(?<![\w.])g(\d+)(?=[.;,\s]|$)')
+
+def merge_augustus_gff(shard_gffs, merged_gff):
+    offset = 0
+    with open(merged_gff, "w") as out:
+        for n, shard_gff in enumerate(shard_gffs):
+            max_gene = 0
+            
+            def renumber(match):
+                nonlocal max_gene
+                gene = int(match.group(1))
+                max_gene = max(max_gene, gene)
+                return f"g{gene + offset}"
+            
+            with open(shard_gff) as f:
+                for line in f:
+                    if line.startswith('##gff-version') and n > 0:
+                        continue
+                    if line.startswith('#'):
+                        if line.startswith(('# start gene', '# end gene')):
+                            line = GENE_ID.sub(renumber, line)
+                    else:
+                        fields = line.rstrip('\n').split('\t')
+                        if len(fields) == 9:
+                            fields[8] = GENE_ID.sub(renumber, fields[8])
+                            line = '\t'.join(fields) + '\n'
+                    out.write(line)
+            offset += max_gene
+
+# Run Augustus on region shards with a bounded pool of processes
+def run_augustus_sharded(genus, regions_fasta, hints_gff, extrinsic_cfg, augustus_gff, jobs):
+    n_shards = augustus_shards or available_cores()
+    n_workers = augustus_workers or max(1, available_cores() // jobs)
+    shard_dir = OUTPUT_DIR/f"{genus}_augustus_shards"
+    if shard_dir.exists():
+        shutil.rmtree(shard_dir)
+    
+    with metrics.measure("split_regions"):
+        shards = split_regions(regions_fasta, hints_gff, shard_dir, n_shards)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Running {len(shards)} Augustus shards with {n_workers} workers..")
+    
+    def run_shard(shard):
+        shard_fasta, shard_hints = shard
+        shard_gff = shard_fasta.with_suffix(".gff")
+        with open(shard_gff, "w") as out:
+            metrics.run(augustus_command(shard_fasta, shard_hints, extrinsic_cfg), check=True, stdout=out)
+        return shard_gff
+    
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        shard_gffs = list(pool.map(run_shard, shards))
+    
+    with metrics.measure("merge_augustus_gff"):
+        merge_augustus_gff(shard_gffs, augustus_gff)
+    shutil.rmtree(shard_dir)
 
 # Processing each genus
-def process_genus(genus):
+# (settings are arguments, not module globals, so process pool workers get them under any start method)
+def process_genus(genus, jobs, force, table_format):
     print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Processing {genus} with {species}..")
     
     # Find genome files
@@ -112,109 +384,89 @@ def process_genus(genus):
     
     # Dynamic IO
     blast_results = BLAST_RESULTS_DIR/f"{genus}_BH.txt"
+    if hit_source == "loci":
+        blast_results = BLAST_RESULTS_DIR/f"{genus}_loci.txt"
     output_fasta = OUTPUT_DIR/f"{genus}_regions.fasta"
+    regions_map = OUTPUT_DIR/f"{genus}_regions_map.tsv"
     augustus_gff = OUTPUT_DIR/f"{genus}_{species}_augustus.gff"
     augustus_gtf = OUTPUT_DIR/f"{genus}_{species}_augustus.gtf"
     augustus_gtf_clean = OUTPUT_DIR/f"{genus}_{species}_augustus_clean.gtf"
     augustus_transcripts = OUTPUT_DIR/f"{genus}_transcripts.fasta"
     hints_gff = OUTPUT_DIR/f"{genus}_hints.gff"
+    hints_groups = hints_groups_path(hints_gff)
+    
+    # Skip genera already processed with the same inputs and parameters
+    manifest = RunManifest("8_AUGUSTUS")
+    inputs = [blast_results, genome_file] + ([extrinsic_cfg] if extrinsic_cfg else [])
+    params = {"padding": padding, "merge_distance": merge_distance, "species": species, "hit_source": hit_source,
+              "compact_hints": compact_hints, "hint_min_overlap": hint_min_overlap}
+    outputs = [output_fasta, regions_map, hints_gff, augustus_gff, augustus_gtf, augustus_gtf_clean, augustus_transcripts]
+    if compact_hints:
+        outputs.append(hints_groups)
+    tables = [(hints_gff, "gff"), (augustus_gff, "gff"), (augustus_gtf, "gff"), (augustus_gtf_clean, "gff")]
+    if not force and manifest.is_current(genus, inputs, params, outputs):
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SKIP] {genus} is up to date, use --force to rerun..")
+        write_tables(tables, table_format)
+        return
+    manifest.invalidate(genus)
 
     # Extract regions
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Extracting regions..")
-    genome = Fasta(genome_file)
-    regions = set()
-    
-    with open(blast_results) as f, open(output_fasta, "w") as out:
-        for line in f:
-            if line.strip():
-                fields = line.split('\t')
-                contig = fields[1]
-                start = int(fields[8])
-                end = int(fields[9])
-                
-                # Find valid coordinates
-                region_start = max(1, min(start, end) - padding)
-                region_end = min(len(genome[contig]), max(start, end) + padding)
-                
-                region_id = f"{contig}:{region_start}-{region_end}"
-                if region_id not in regions:
-                    regions.add(region_id)
-                    try:
-                        seq = genome[contig][region_start-1:region_end].seq
-                        out.write(f">{region_id}\n{seq}\n")
-                    except Exception as e:
-                        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Ignoring region {region_id}: {str(e)}, continuing..")
+    with metrics.measure("extract_regions"):
+        contig_lengths = genome_catalog(GENOMES_DIR).contig_lengths(genome_file)
+        region_sequences = {}
+        n_regions = extract_regions(blast_results, genome_file, contig_lengths, output_fasta, regions_map, region_sequences)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Extracted {n_regions} merged regions, query map in {regions_map}..")
 
     # Generate hint file
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Generating hint files..")
-    generate_hints_file(blast_results, hints_gff, extrinsic_cfg)
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Finished generating hint files..")
+    with metrics.measure("generate_hints_file"):
+        if not compact_hints:
+            hints_groups.unlink(missing_ok=True)
+        n_hits, n_hints = generate_hints_file(blast_results, hints_gff, extrinsic_cfg, hints_groups)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Finished generating hint files ({n_hints} hints from {n_hits} hits)..")
 
     # Running Augustus
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Running Augustus..")
-    cmd = [
-        "augustus",
-        f"--species={species}",
-        "--protein=on",
-        "--gff3=on"
-    ]
-    
-    # Include extrinsic file
-    if extrinsic_cfg:
-        cmd.append(f"--extrinsicCfgFile={extrinsic_cfg}")
-        cmd.append(f"--hintsfile={hints_gff}")
-    
-    cmd.append(str(output_fasta))
-    
-    with open(augustus_gff, "w") as out:
+    if (augustus_shards or available_cores()) > 1:
         try:
-            subprocess.run(cmd, check=True, stdout=out)
+            run_augustus_sharded(genus, output_fasta, hints_gff, extrinsic_cfg, augustus_gff, jobs)
         except subprocess.CalledProcessError as e:
             print(f"Erro ao executar Augustus: {e}")
             return
+    else:
+        cmd = augustus_command(output_fasta, hints_gff, extrinsic_cfg)
+        with open(augustus_gff, "w") as out:
+            try:
+                metrics.run(cmd, check=True, stdout=out)
+            except subprocess.CalledProcessError as e:
+                print(f"Erro ao executar Augustus: {e}")
+                return
     
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Finished Augustus!")
 
-    # Converting to GTF files
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Converting to GTF..")
-    cmd_gffread = [
-        "gffread",
-        augustus_gff,
-        "-T",
-        "-o",
-        augustus_gtf
-    ]
-    subprocess.run(cmd_gffread, check=True)
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Finished conversion, results in {augustus_gtf}!")
-
-    # Cleaning GTF file (for IGV)
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Cleaning GTF headers..")
-    cmd_clean = [
-        "sed",
-        r"s/^\([^[:space:]]\+\):[0-9]\+-[0-9]\+/\1/",
-        augustus_gtf
-    ]
-    with open(augustus_gtf_clean, "w") as outfile:
-        subprocess.run(cmd_clean, stdout=outfile, check=True)
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Cleaned GTF saved to {augustus_gtf_clean}")
-    
-    # Generating transcript FASTA using gffread
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Generating transcript FASTA using gffread..")
-    cmd_transcript = [
-        "gffread",
-        augustus_gff,
-        "-g", output_fasta,
-        "-w", augustus_transcripts
-    ]
+    # Converting to GTF files and transcript FASTA (region and genome coordinates, one pass)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Converting to GTF and extracting transcripts..")
+    with metrics.measure("convert_augustus_gff"):
+        n_transcripts, n_missing = convert_augustus_gff(augustus_gff, augustus_gtf, augustus_gtf_clean, augustus_transcripts, region_sequences)
+    if n_missing:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] {n_missing} transcripts on unknown regions have no sequence, continuing..")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] {n_transcripts} transcripts in {augustus_gtf}, genome coordinates in {augustus_gtf_clean}, sequences in {augustus_transcripts}..")
     
-    try:
-        subprocess.run(cmd_transcript, check=True)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Transcript FASTA saved to: {augustus_transcripts}..")
-    except subprocess.CalledProcessError as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] gffread failed: {e}")
+    write_tables(tables, table_format)
+    manifest.record(genus, inputs, params, outputs)
 
 # Main
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract hit regions and run AUGUSTUS for each genus")
+    parser.add_argument("--jobs", type=int, default=jobs, help="Genera processed in parallel")
+    parser.add_argument("--force", action="store_true", default=force, help="Rerun genera that are up to date")
+    parser.add_argument("--genus", nargs="+", help="Only process these genera")
+    parser.add_argument("--table-format", choices=TABLE_FORMATS, default=table_format, help="Also write the GFF/GTF outputs as Parquet or bgzip/tabix copies")
+    args = parser.parse_args()
+    jobs = max(1, args.jobs)
+    metrics.track_step()
+    
     OUTPUT_DIR.mkdir(exist_ok=True)
     
     # Find all files *_BH.txt
@@ -225,12 +477,12 @@ if __name__ == "__main__":
         sys.exit(1)
     
     # Processar cada arquivo BLAST
-    for blast_file in blast_files:
-        genus = Path(blast_file).stem.replace("_BH", "")
-        try:
-            process_genus(genus)
-        except Exception as e:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Error processing {genus}: {str(e)}")
-            continue
+    genera = [Path(blast_file).stem.replace("_BH", "") for blast_file in blast_files]
+    if args.genus:
+        genera = [genus for genus in genera if genus in args.genus]
+    _, failures = run_genera(process_genus, [(genus, (genus, jobs, args.force, args.table_format)) for genus in genera], jobs)
+    print_failures(failures, len(genera))
 
     print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISHED] All genus processed")
+    if failures:
+        sys.exit(1)
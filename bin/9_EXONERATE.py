@@ -2,9 +2,22 @@ import subprocess
 from pathlib import Path
 import sys
 import glob
+import argparse
 import re
 import os
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from ptpp.catalog import genome_catalog
+from ptpp.fasta import read_fasta, record_id, format_record
+from ptpp.genome import GenomeReader
+from ptpp.jobs import available_cores, available_memory, balanced_shards, run_genera, print_failures
+from ptpp.manifest import RunManifest
+from ptpp.tables import TABLE_FORMATS, read_table, write_tables
+from ptpp import metrics
 
 # Exonerate params
 min_percent = 20
@@ -13,11 +26,25 @@ max_intron = 50000
 bestn = 1
 verbose = 3
 
+# Target mode: "genome" aligns every query to the whole genome, "hits" aligns each
+# query only to the window around its tblastn best hit (outputs/blast_results/{genus}_BH.txt)
+target_mode = "genome"
+hit_padding = 2000 # Extra bp around the hit, added to max_intron on each side
+
+# Query sharding in genome mode (finished shards are checkpointed, killed runs resume)
+query_shards = 0 # Query shards per genus (0 = available cores, 1 = single Exonerate process)
+exonerate_workers = 0 # Concurrent Exonerate processes per genus (0 = available cores / --jobs), also limited by RAM / --jobs
+rss_per_genome_byte = 2.0 # Estimated Exonerate peak RSS per byte of genome file
+rss_base = 256 * 1024**2 # Estimated Exonerate peak RSS overhead (bytes)
+force = False # Rerun genera whose inputs, parameters and outputs are unchanged (--force)
+table_format = "text" # Also write the Exonerate GFF lines as a "parquet" or "bgzip" (bgzip + tabix) copy (--table-format)
+
 # Directories
 BASE_DIR = Path(__file__).resolve().parent.parent
 FILTERED_FASTA_DIR = BASE_DIR/"outputs/filtered_fasta"
 GENOMES_DIR = BASE_DIR/"data/genomes"
 OUTPUT_DIR = BASE_DIR/"outputs/exonerate_results"
+BLAST_RESULTS_DIR = BASE_DIR/"outputs/blast_results"
 
 # Logging function
 def log(message):
@@ -25,16 +52,7 @@ def log(message):
 
 # Function to find first match of genome
 def find_genome_file(genus):
-    pattern = re.compile(rf'{genus}.*\.(fa|fna|fasta)$', re.IGNORECASE)
-    matching_files = []
-    
-    for file in GENOMES_DIR.glob('*'):
-        if pattern.search(file.name):
-            matching_files.append(file)
-    
-    if matching_files:
-        return matching_files[0]
-    return None
+    return genome_catalog(GENOMES_DIR).find(genus)
 
 # Find exonerate executable
 def get_exonerate_path():
@@ -45,8 +63,184 @@ def get_exonerate_path():
         log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Exonerate not found in PATH!")
         return "exonerate"
 
+# Exonerate command line for a query/target pair
+# (hits mode turns the human-readable alignment off: its target coordinates are not lifted)
+def exonerate_command(exonerate_path, query_file, target_file, show_alignment=True):
+    return [
+        exonerate_path,
+        "--model", "protein2genome",
+        str(query_file),
+        str(target_file),
+        "--showtargetgff", "yes",
+        "--showalignment", "yes" if show_alignment else "no",
+        "--showvulgar", "yes",
+        "--verbose", str(verbose),
+        "--percent", str(min_percent),
+        "--minintron", str(min_intron),
+        "--maxintron", str(max_intron),
+        "--bestn", str(bestn)
+    ]
+
+# First (best) hit of each query in a best hits file: {query: (contig, start, end)}
+def read_best_hits(bh_file):
+    hits = {}
+    table = read_table(bh_file, "outfmt6", columns=["qseqid", "sseqid", "sstart", "send"])
+    for query, contig, start, end in table.itertuples(index=False, name=None):
+        if query not in hits:
+            hits[query] = (contig, min(start, end), max(start, end))
+    return hits
+
+# Lift Exonerate output from window coordinates (contig:start-end) to genome coordinates
+# (GFF lines, vulgar and cigar lines; the alignment text is not lifted, hits mode turns it off)
+ALIGN_BLOCK = re.compile(r'(Align )(\d+)')
+
+def lift_exonerate_output(text, window_name, contig, shift):
+    lifted = []
+    for line in text.splitlines(keepends=True):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) == 9 and fields[0] == window_name:
+            # GFF features (similarity "Align" blocks carry target positions too)
+            fields[0] = contig
+            fields[3] = str(int(fields[3]) + shift)
+            fields[4] = str(int(fields[4]) + shift)
+            fields[8] = ALIGN_BLOCK.sub(lambda m: f"{m.group(1)}{int(m.group(2)) + shift}", fields[8])
+            line = '\t'.join(fields) + '\n'
+        elif line.startswith(('vulgar:', 'cigar:')):
+            parts = line.split(' ')
+            if len(parts) > 8 and parts[5] == window_name:
+                parts[5] = contig
+                parts[6] = str(int(parts[6]) + shift)
+                parts[7] = str(int(parts[7]) + shift)
+                line = ' '.join(parts)
+        lifted.append(line)
+    return ''.join(lifted)
+
+# Align each query only against the genome window around its best hit
+def run_exonerate_hits(genus, fasta_file, genome_file, output_file, exonerate_path):
+    bh_file = BLAST_RESULTS_DIR/f"{genus}_BH.txt"
+    if not bh_file.exists():
+        log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Best hits file not found: {bh_file}, run step 7 first!")
+        return False
+    
+    hits = read_best_hits(bh_file)
+    contig_lengths = genome_catalog(GENOMES_DIR).contig_lengths(genome_file)
+    slack = hit_padding + max_intron
+    aligned = skipped = failed = 0
+    
+    log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Running Exonerate on hit windows (+-{slack} bp)..")
+    with tempfile.TemporaryDirectory(dir=OUTPUT_DIR) as tmp_dir, open(output_file, "w") as out, \
+            GenomeReader(genome_file) as genome:
+        query_file = Path(tmp_dir)/"query.fasta"
+        target_file = Path(tmp_dir)/"target.fasta"
+        for header, sequence in read_fasta(fasta_file):
+            query = record_id(header)
+            if query not in hits:
+                skipped += 1
+                continue
+            
+            contig, hit_start, hit_end = hits[query]
+            # Hit on a contig the genome does not have (stale best hits or renamed contigs)
+            if contig not in contig_lengths:
+                log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Best hit contig {contig} of {query} not in {genome_file.name}, skipping..")
+                skipped += 1
+                continue
+            start = max(1, hit_start - slack)
+            end = min(contig_lengths[contig], hit_end + slack)
+            window_name = f"{contig}:{start}-{end}"
+            query_file.write_text(format_record(header, sequence))
+            target_file.write_text(format_record(window_name, genome.fetch(contig, start, end)))
+            
+            result = metrics.run(exonerate_command(exonerate_path, query_file, target_file, show_alignment=False),
+                                 stdout=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Exonerate failed for {query}, continuing..")
+                failed += 1
+                continue
+            out.write(lift_exonerate_output(result.stdout, window_name, contig, start - 1))
+            aligned += 1
+    
+    log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] {aligned} queries aligned, {skipped} without best hit on the genome, {failed} failed")
+    return aligned > 0 or failed == 0
+
+# Concurrent Exonerate processes allowed by cores and available memory,
+# both shared by the genera processed at once (--jobs)
+def exonerate_worker_limit(genome_file, n_shards, jobs=1):
+    workers = min(n_shards, exonerate_workers or max(1, available_cores() // jobs))
+    free = available_memory()
+    if free:
+        peak_rss = Path(genome_file).stat().st_size * rss_per_genome_byte + rss_base
+        workers = min(workers, max(1, int(free // jobs // peak_rss)))
+    return workers
+
+# Shard the queries, run them concurrently and merge the shard outputs in order
+def run_exonerate_sharded(genus, fasta_file, genome_file, output_file, exonerate_path, jobs):
+    records = list(read_fasta(fasta_file))
+    shards = balanced_shards(records, query_shards or available_cores(), weight=lambda record: len(record[1]))
+    shard_dir = OUTPUT_DIR/f"{genus}_exonerate_shards"
+    checkpoint_file = shard_dir/"checkpoint.json"
+    
+    # Checkpoint is only valid for the same queries, genome, shards and parameters
+    fasta_stat = Path(fasta_file).stat()
+    genome_stat = Path(genome_file).stat()
+    signature = {
+        "fasta": [str(fasta_file), fasta_stat.st_size, fasta_stat.st_mtime],
+        "genome": [str(genome_file), genome_stat.st_size, genome_stat.st_mtime],
+        "shards": len(shards),
+        "params": exonerate_command("exonerate", "", "")[1:]
+    }
+    done = set()
+    if checkpoint_file.exists():
+        try:
+            checkpoint = json.loads(checkpoint_file.read_text())
+            if checkpoint.get("signature") == signature:
+                done = set(checkpoint.get("done", []))
+        except ValueError:
+            pass
+    if not done and shard_dir.exists():
+        shutil.rmtree(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    
+    shard_names = [f"shard_{i:04d}" for i in range(len(shards))]
+    pending = [i for i, name in enumerate(shard_names) if name not in done or not (shard_dir/f"{name}.gff").exists()]
+    workers = exonerate_worker_limit(genome_file, max(1, len(pending)), jobs)
+    log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Running {len(pending)}/{len(shards)} Exonerate shards with {workers} workers..")
+    
+    lock = threading.Lock()
+    
+    def save_checkpoint():
+        tmp_file = checkpoint_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps({"signature": signature, "done": sorted(done)}))
+        os.replace(tmp_file, checkpoint_file)
+    
+    def run_shard(i):
+        name = shard_names[i]
+        query_file = shard_dir/f"{name}.fasta"
+        with open(query_file, "w") as out:
+            for header, sequence in shards[i]:
+                out.write(format_record(header, sequence))
+        part_file = shard_dir/f"{name}.gff.part"
+        with open(part_file, "w") as out:
+            metrics.run(exonerate_command(exonerate_path, query_file, genome_file), check=True, stdout=out)
+        os.replace(part_file, shard_dir/f"{name}.gff")
+        query_file.unlink()
+        with lock:
+            done.add(name)
+            save_checkpoint()
+        log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Exonerate {name} finished ({len(done)}/{len(shards)})")
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_shard, pending))
+    
+    # Merge shard outputs in order
+    with open(output_file, "w") as out:
+        for name in shard_names:
+            with open(shard_dir/f"{name}.gff") as f:
+                shutil.copyfileobj(f, out)
+    shutil.rmtree(shard_dir)
+
 # Process each genus with Exonerate
-def process_genus(genus, fasta_file):
+# (settings are arguments, not module globals, so process pool workers get them under any start method)
+def process_genus(genus, fasta_file, target_mode, force, table_format, jobs):
     log(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][START] Processing {genus} with Exonerate..")
     
     # Find genome file
@@ -60,31 +254,56 @@ def process_genus(genus, fasta_file):
     # Define output file
     output_file = OUTPUT_DIR/f"{genus}_exonerate.gff"
     
+    # Skip genera already aligned with the same queries, genome and parameters
+    manifest = RunManifest("9_EXONERATE")
+    inputs = [fasta_file, genome_file]
+    params = {"target_mode": target_mode, "exonerate": exonerate_command("exonerate", "", "", show_alignment=target_mode != "hits")[1:]}
+    if target_mode == "hits":
+        inputs.append(BLAST_RESULTS_DIR/f"{genus}_BH.txt")
+        params["hit_padding"] = hit_padding
+    if not force and manifest.is_current(genus, inputs, params, [output_file]):
+        log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SKIP] {genus} is up to date, use --force to rerun..")
+        write_tables([(output_file, "gff")], table_format)
+        return True
+    manifest.invalidate(genus)
+    
+    if run_exonerate(genus, fasta_file, genome_file, output_file, target_mode, jobs):
+        write_tables([(output_file, "gff")], table_format)
+        manifest.record(genus, inputs, params, [output_file])
+        return True
+    return False
+
+# Run Exonerate for a genus in the configured target mode
+def run_exonerate(genus, fasta_file, genome_file, output_file, target_mode, jobs):
     # Get exonerate path
     exonerate_path = get_exonerate_path()
     
+    # Execute exonerate on the best hit windows only
+    if target_mode == "hits":
+        if run_exonerate_hits(genus, fasta_file, genome_file, output_file, exonerate_path):
+            log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Exonerate finished for {genus}, results in {output_file}")
+            return True
+        return False
+    
+    # Execute exonerate on query shards
+    if (query_shards or available_cores()) > 1:
+        try:
+            run_exonerate_sharded(genus, fasta_file, genome_file, output_file, exonerate_path, jobs)
+            log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Exonerate finished for {genus}, results in {output_file}")
+            return True
+        except subprocess.CalledProcessError as e:
+            log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ERROR] Exonerate failed for {genus}: {e}, finished shards are kept for resume")
+            return False
+    
     # Execute exonerate
-    cmd = [
-        exonerate_path,
-        "--model", "protein2genome",
-        str(fasta_file),
-        str(genome_file),
-        "--showtargetgff", "yes",
-        "--showalignment", "yes", 
-        "--showvulgar", "yes",
-        "--verbose", str(verbose),
-        "--percent", str(min_percent),
-        "--minintron", str(min_intron),
-        "--maxintron", str(max_intron),
-        "--bestn", str(bestn)
-    ]
+    cmd = exonerate_command(exonerate_path, fasta_file, genome_file)
     
     log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Running Exonerate..")
     log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][CMD] {' '.join(cmd)}")
     
     try:
         with open(output_file, "w") as out:
-            subprocess.run(cmd, check=True, stdout=out)
+            metrics.run(cmd, check=True, stdout=out)
         log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][DONE] Exonerate finished for {genus}, results in {output_file}")
         return True
     except subprocess.CalledProcessError as e:
@@ -93,9 +312,21 @@ def process_genus(genus, fasta_file):
 
 # Main
 def main():
+    parser = argparse.ArgumentParser(description="Run Exonerate protein2genome for each genus")
+    parser.add_argument("--jobs", type=int, default=1, help="Genera processed in parallel")
+    parser.add_argument("--target-mode", choices=["genome", "hits"], default=target_mode,
+                        help="Align to the whole genome or only to the tblastn best hit windows")
+    parser.add_argument("--force", action="store_true", default=force, help="Rerun genera that are up to date")
+    parser.add_argument("--genus", nargs="+", help="Only process these genera")
+    parser.add_argument("--table-format", choices=TABLE_FORMATS, default=table_format, help="Also write the GFF lines as a Parquet or bgzip/tabix copy")
+    args = parser.parse_args()
+    metrics.track_step()
+    
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     # Find all FASTA files
     fasta_files = list(FILTERED_FASTA_DIR.glob('*.fasta'))
+    if args.genus:
+        fasta_files = [f for f in fasta_files if f.stem in args.genus]
     
     if not fasta_files:
         log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] No FASTA files found in {FILTERED_FASTA_DIR}, exiting!")
@@ -104,17 +335,14 @@ def main():
     log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][INFO] Found {len(fasta_files)} FASTA files to process")
     
     # Process each FASTA file
-    success_count = 0
-    for fasta_file in fasta_files:
-        genus = fasta_file.stem
-        try:
-            if process_genus(genus, fasta_file):
-                success_count += 1
-        except Exception as e:
-            log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Error processing {genus}: {str(e)}")
-            continue
+    jobs = max(1, args.jobs)
+    results, failures = run_genera(process_genus, [(f.stem, (f.stem, f, args.target_mode, args.force, args.table_format, jobs)) for f in fasta_files], jobs)
+    success_count = sum(1 for ok in results.values() if ok)
+    print_failures(failures, len(fasta_files))
     
     log(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][FINISHED] Processed {success_count}/{len(fasta_files)} genera successfully")
+    if success_count < len(fasta_files):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+"""Shared helpers for the PTPP pipeline scripts in bin/."""
@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+# Allow "python bin/ptpp run" as well as "python -m ptpp run" from bin/
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ptpp.runner import main
+
+sys.exit(main())
@@ -0,0 +1,179 @@
+"""Streaming best-hit selection and HSP chaining for tblastn outfmt 6 tables."""
+
+from itertools import islice
+
+import numpy as np
+
+OUTFMT6_COLUMNS = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen",
+                   "qstart", "qend", "sstart", "send", "evalue", "bitscore"]
+HSP_DTYPE = np.dtype([
+    ("qstart", "i8"), ("qend", "i8"), ("sstart", "i8"), ("send", "i8"),
+    ("evalue", "f8"), ("bitscore", "f8")
+])
+LOCI_COLUMNS = ["query", "contig", "start", "end", "strand", "evalue", "bitscore", "n_hsps", "hsps"]
+
+
+# Read outfmt 6 in blocks: (queries, subjects, hsps structured array, raw lines)
+def read_outfmt6_blocks(path, block_rows=200000):
+    with open(path) as f:
+        while True:
+            raw = list(islice(f, block_rows))
+            lines = [line for line in raw if line.strip()]
+            if not raw:
+                break
+            if not lines:
+                continue
+            fields = [line.rstrip("\n").split("\t") for line in lines]
+            hsps = np.array(
+                [(int(x[6]), int(x[7]), int(x[8]), int(x[9]), float(x[10]), float(x[11])) for x in fields],
+                dtype=HSP_DTYPE
+            )
+            yield (np.array([x[0] for x in fields]), np.array([x[1] for x in fields]), hsps, lines)
+            if len(raw) < block_rows:
+                break
+
+
+# Best hit (highest bit score) of each query, written sorted by query
+# Ties go to the smallest line, as in `sort -k1,1 -k12,12gr | awk '!seen[$1]++'` (C locale):
+# without -s, sort orders rows with equal keys by the whole line
+def best_hits(tblastn_file, bh_file, block_rows=200000):
+    best = {}
+    for queries, _, hsps, lines in read_outfmt6_blocks(tblastn_file, block_rows):
+        # Best row of each query inside the block
+        order = np.lexsort((np.array(lines), -hsps["bitscore"], queries))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = queries[order][1:] != queries[order][:-1]
+        for i in order[first]:
+            query = queries[i]
+            score = hsps["bitscore"][i]
+            if query not in best or score > best[query][0] or (score == best[query][0] and lines[i] < best[query][1]):
+                best[query] = (score, lines[i])
+
+    with open(bh_file, "w") as out:
+        for query in sorted(best):
+            out.write(best[query][1])
+    return len(best)
+
+
+# Best collinear chain of HSPs (same contig and strand) by total bit score
+# Subject gaps must not exceed max_intron, overlaps are tolerated up to `overlap` bp/aa
+# Predecessors are looked up in the subject window max_intron wide, not among all HSPs
+def chain_hsps(hsps, strand, max_intron, overlap=10):
+    lo = np.minimum(hsps["sstart"], hsps["send"])
+    hi = np.maximum(hsps["sstart"], hsps["send"])
+    qstart, qend, bitscore = hsps["qstart"], hsps["qend"], hsps["bitscore"]
+    order = np.argsort(qstart, kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    score = np.zeros(len(order))
+    previous = np.full(len(order), -1)
+
+    # Predecessor end on the subject: hi on "+" (it lies before), lo on "-" (it lies after)
+    edge = hi if strand == "+" else lo
+    by_edge = np.argsort(edge, kind="stable")
+    sorted_edge = edge[by_edge]
+
+    for a, i in enumerate(order):
+        score[a] = bitscore[i]
+        # Gap lo[i] - hi[j] (+) or lo[j] - hi[i] (-) within [-overlap, max_intron]
+        if strand == "+":
+            left, right = lo[i] - max_intron, lo[i] + overlap
+        else:
+            left, right = hi[i] - overlap, hi[i] + max_intron
+        window = by_edge[np.searchsorted(sorted_edge, left, "left"):np.searchsorted(sorted_edge, right, "right")]
+        candidates = np.sort(rank[window])
+        candidates = candidates[candidates < a]
+        candidates = candidates[qend[order[candidates]] <= qstart[i] + overlap]
+        if len(candidates):
+            # First (lowest rank) predecessor on ties
+            b = candidates[np.argmax(score[candidates])]
+            if score[b] + bitscore[i] > score[a]:
+                score[a] = score[b] + bitscore[i]
+                previous[a] = b
+
+    a = int(np.argmax(score))
+    chain = []
+    while a >= 0:
+        chain.append(order[a])
+        a = previous[a]
+    chain = np.array(chain[::-1])
+    return chain, score.max()
+
+
+def _query_loci(query, subjects, hsps, max_intron):
+    strands = np.where(hsps["sstart"] <= hsps["send"], "+", "-")
+    best = None
+    for key in sorted(set(zip(subjects, strands))):
+        mask = (subjects == key[0]) & (strands == key[1])
+        group = hsps[mask]
+        chain, score = chain_hsps(group, key[1], max_intron)
+        if best is None or score > best[0]:
+            best = (score, key, group[chain])
+    score, (contig, strand), chain = best
+    lo = np.minimum(chain["sstart"], chain["send"])
+    hi = np.maximum(chain["sstart"], chain["send"])
+    segments = ";".join(f"{s}-{e}" for s, e in sorted(zip(lo.tolist(), hi.tolist())))
+    return [query, contig, int(lo.min()), int(hi.max()), strand,
+            f"{chain['evalue'].min():.3g}", f"{score:g}", len(chain), segments]
+
+
+# Chain HSPs of each query into its best gene-level locus
+# tblastn writes the HSPs of a query consecutively, so queries are flushed as they end
+def chain_loci(tblastn_file, loci_file, max_intron=50000, block_rows=200000):
+    n_loci = 0
+    pending = None  # (query, [subjects blocks], [hsps blocks])
+
+    with open(loci_file, "w") as out:
+        out.write("\t".join(LOCI_COLUMNS) + "\n")
+
+        def flush():
+            nonlocal n_loci
+            query, subjects, hsps = pending
+            locus = _query_loci(query, np.concatenate(subjects), np.concatenate(hsps), max_intron)
+            out.write("\t".join(str(x) for x in locus) + "\n")
+            n_loci += 1
+
+        for queries, subjects, hsps, _ in read_outfmt6_blocks(tblastn_file, block_rows):
+            # Runs of consecutive rows with the same query
+            starts = np.flatnonzero(np.concatenate(([True], queries[1:] != queries[:-1])))
+            ends = np.append(starts[1:], len(queries))
+            for s, e in zip(starts, ends):
+                if pending is not None and pending[0] == queries[s]:
+                    pending[1].append(subjects[s:e])
+                    pending[2].append(hsps[s:e])
+                    continue
+                if pending is not None:
+                    flush()
+                pending = (queries[s], [subjects[s:e]], [hsps[s:e]])
+        if pending is not None:
+            flush()
+    return n_loci
+
+
+# Read a loci table: yields dicts with the LOCI_COLUMNS fields (hsps as [(start, end)])
+def read_loci(loci_file):
+    with open(loci_file) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        for line in f:
+            if not line.strip():
+                continue
+            locus = dict(zip(header, line.rstrip("\n").split("\t")))
+            locus["start"] = int(locus["start"])
+            locus["end"] = int(locus["end"])
+            locus["hsps"] = [tuple(int(x) for x in segment.split("-")) for segment in locus["hsps"].split(";")]
+            yield locus
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Select tblastn best hits and chain HSPs into loci")
+    parser.add_argument("tblastn_file")
+    parser.add_argument("bh_file")
+    parser.add_argument("--loci", help="Also write the chained loci table to this file")
+    parser.add_argument("--max-intron", type=int, default=50000)
+    args = parser.parse_args()
+
+    best_hits(args.tblastn_file, args.bh_file)
+    if args.loci:
+        chain_loci(args.tblastn_file, args.loci, args.max_intron)
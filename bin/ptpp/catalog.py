@@ -0,0 +1,254 @@
+"""On-disk catalog of the genomes in data/genomes shared by steps 8, 9 and 10.
+
+The catalog is a JSON manifest next to the genomes. Every genome file is
+recorded with its size and mtime; contig lengths (from the .fai index, built in
+a single streaming pass when missing) and the MD5 checksum are filled in the
+first time they are needed and reused until the file changes. Genus lookups are
+resolved once and stored as well.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CATALOG_NAME = ".genome_catalog.json"
+GENOME_PATTERN = re.compile(r'\.(fa|fna|fasta)(\.b?gz)?$', re.IGNORECASE)
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 1 << 24
+
+
+# Read contig lengths from a samtools/pyfaidx .fai index
+def read_fai(fai_file):
+    lengths = {}
+    with open(fai_file) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2:
+                lengths[fields[0]] = int(fields[1])
+    return lengths
+
+
+# Incremental .fai builder fed with consecutive blocks of an uncompressed FASTA stream
+class FaiBuilder:
+    def __init__(self):
+        self.entries = []
+        self.current = None  # [name, length, offset, line_bases, line_width]
+        self.header = bytearray()
+        self.first_line = bytearray()
+        self.in_header = False
+        self.line_start = True
+        self.pos = 0
+
+    def _finish_first_line(self, line):
+        self.current[3] = len(line.rstrip(b"\r"))
+        self.current[4] = len(line) + 1
+
+    def feed(self, chunk):
+        i = 0
+        size = len(chunk)
+        while i < size:
+            if self.in_header:
+                nl = chunk.find(b"\n", i)
+                if nl < 0:
+                    self.header += chunk[i:]
+                    i = size
+                    continue
+                self.header += chunk[i:nl]
+                name = self.header.decode().strip().split(None, 1)[0] if self.header.strip() else ""
+                self.current = [name, 0, self.pos + nl + 1, 0, 0]
+                self.entries.append(self.current)
+                self.header = bytearray()
+                self.first_line = bytearray()
+                self.in_header = False
+                self.line_start = True
+                i = nl + 1
+                continue
+
+            if self.line_start and chunk[i:i + 1] == b">":
+                self.in_header = True
+                i += 1
+                continue
+
+            # Sequence bytes up to the next header line
+            j = chunk.find(b"\n>", i)
+            j = size if j < 0 else j + 1
+            part = chunk[i:j]
+            if self.current is not None:
+                self.current[1] += len(part) - part.count(b"\n") - part.count(b"\r")
+                if not self.current[4]:
+                    nl = part.find(b"\n")
+                    if nl < 0:
+                        self.first_line += part
+                    else:
+                        self._finish_first_line(self.first_line + part[:nl])
+            self.line_start = part.endswith(b"\n")
+            i = j
+        self.pos += size
+
+    def write(self, fai_file):
+        # Last contig ending without a newline
+        if self.current is not None and not self.current[4] and self.first_line:
+            self._finish_first_line(self.first_line)
+        with open(fai_file, "w") as out:
+            for name, length, offset, line_bases, line_width in self.entries:
+                out.write(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+
+
+# Build a .fai index by streaming the genome in blocks, summing line lengths
+# (bgzip/gzip genomes are indexed on uncompressed offsets, as samtools does)
+def build_fai(genome_file, fai_file):
+    with open(genome_file, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    opener = gzip.open if compressed else open
+
+    builder = FaiBuilder()
+    with opener(genome_file, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            builder.feed(chunk)
+    builder.write(fai_file)
+
+
+# Build (if missing or stale) the .fai index of a genome and return its contig lengths
+def fai_lengths(genome_file):
+    genome_file = Path(genome_file)
+    fai_file = genome_file.with_name(genome_file.name + ".fai")
+    if not fai_file.exists() or fai_file.stat().st_mtime < genome_file.stat().st_mtime:
+        build_fai(genome_file, fai_file)
+    return read_fai(fai_file)
+
+
+# MD5 checksum of a file, read in blocks
+def file_md5(path, block_size=1 << 20):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class GenomeCatalog:
+    def __init__(self, genomes_dir, catalog_file=None):
+        self.genomes_dir = Path(genomes_dir)
+        self.catalog_file = Path(catalog_file) if catalog_file else self.genomes_dir / CATALOG_NAME
+        self.files = {}
+        self.genera = {}
+        self._load()
+        self.refresh()
+
+    def _read(self):
+        try:
+            with open(self.catalog_file) as f:
+                data = json.load(f)
+            return data.get("files", {}), data.get("genera", {})
+        except (OSError, ValueError):
+            return {}, {}
+
+    def _load(self):
+        self.files, self.genera = self._read()
+
+    # Merge the entries another process saved since this one loaded the catalog
+    # (contigs and md5 of the same file version, files this process has not seen yet)
+    def _merge(self, files, genera):
+        for name, entry in files.items():
+            known = self.files.get(name)
+            if known is None:
+                try:
+                    stat = (self.genomes_dir / name).stat()
+                except OSError:
+                    continue
+                if (entry.get("size"), entry.get("mtime")) == (stat.st_size, stat.st_mtime):
+                    self.files[name] = entry
+            elif (known["size"], known["mtime"]) == (entry.get("size"), entry.get("mtime")):
+                for key, value in entry.items():
+                    known.setdefault(key, value)
+        # Genus lookups are only valid for the file set they were resolved on
+        if files.keys() == self.files.keys():
+            for key, value in genera.items():
+                self.genera.setdefault(key, value)
+
+    # Concurrent processes (--jobs) save under a lock, merging the catalog on disk first,
+    # so entries indexed by one process are not overwritten by the snapshot of another
+    def save(self):
+        tmp_file = self.catalog_file.with_name(f"{self.catalog_file.name}.{os.getpid()}.tmp")
+        lock_file = self.catalog_file.with_name(f"{self.catalog_file.name}.lock")
+        try:
+            with open(lock_file, "a") as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                self._merge(*self._read())
+                with open(tmp_file, "w") as f:
+                    json.dump({"files": self.files, "genera": self.genera}, f, indent=1)
+                os.replace(tmp_file, self.catalog_file)
+        except OSError:
+            tmp_file.unlink(missing_ok=True)
+
+    # Rescan the directory, dropping entries whose files changed or disappeared
+    def refresh(self):
+        current = {}
+        if self.genomes_dir.is_dir():
+            for entry in os.scandir(self.genomes_dir):
+                if entry.is_file() and GENOME_PATTERN.search(entry.name):
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_size, stat.st_mtime)
+
+        changed = set(self.files) != set(current)
+        for name, (size, mtime) in current.items():
+            known = self.files.get(name)
+            if not known or known["size"] != size or known["mtime"] != mtime:
+                self.files[name] = {"size": size, "mtime": mtime}
+                changed = True
+        for name in set(self.files) - set(current):
+            del self.files[name]
+
+        if changed:
+            self.genera = {}
+            self.save()
+
+    # Resolve the genome file of a genus (names starting with the genus first)
+    def find(self, genus):
+        key = genus.lower()
+        if key not in self.genera:
+            names = sorted(name for name in self.files if key in name.lower())
+            names.sort(key=lambda name: not name.lower().startswith(key))
+            self.genera[key] = names[0] if names else None
+            self.save()
+        name = self.genera[key]
+        return self.genomes_dir / name if name else None
+
+    def entry(self, genome_file):
+        name = Path(genome_file).name
+        if name not in self.files:
+            self.refresh()
+        return self.files[name]
+
+    def contig_lengths(self, genome_file):
+        entry = self.entry(genome_file)
+        if "contigs" not in entry:
+            entry["contigs"] = fai_lengths(self.genomes_dir / Path(genome_file).name)
+            self.save()
+        return entry["contigs"]
+
+    def checksum(self, genome_file):
+        entry = self.entry(genome_file)
+        if "md5" not in entry:
+            entry["md5"] = file_md5(self.genomes_dir / Path(genome_file).name)
+            self.save()
+        return entry["md5"]
+
+
+_catalogs = {}
+
+# Catalog for a genomes directory, loaded once per process
+def genome_catalog(genomes_dir):
+    key = Path(genomes_dir).resolve()
+    if key not in _catalogs:
+        _catalogs[key] = GenomeCatalog(key)
+    return _catalogs[key]
@@ -0,0 +1,91 @@
+"""Lightweight FASTA reading and writing without Biopython record objects."""
+
+import gzip
+from collections import OrderedDict
+from pathlib import Path
+
+GZIP_MAGIC = b"\x1f\x8b"
+LINE_WIDTH = 60
+
+
+# Open plain or gzip/bgzip compressed text files
+def open_text(path, mode="rt"):
+    with open(path, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+# Stream (header, sequence) tuples, holding a single record in memory
+def read_fasta(path):
+    header = None
+    chunks = []
+    with open_text(path) as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(chunks)
+                header = line[1:]
+                chunks = []
+            elif header is not None:
+                chunks.append(line.strip())
+    if header is not None:
+        yield header, "".join(chunks)
+
+
+# Record ID as Biopython reports it (first word of the header)
+def record_id(header):
+    return header.split(None, 1)[0] if header else ""
+
+
+# Format a record the same way SeqIO.write does
+def format_record(header, sequence, width=LINE_WIDTH):
+    lines = [f">{header}\n"]
+    for i in range(0, len(sequence), width):
+        lines.append(sequence[i:i + width] + "\n")
+    return "".join(lines)
+
+
+# Per-key output writers with a cap on open handles (LRU reopen in append mode)
+class FastaWriterPool:
+    def __init__(self, max_open=256):
+        self.max_open = max(1, max_open)
+        self.handles = OrderedDict()
+        self.paths = {}
+        self.counts = {}
+
+    def add(self, key, path):
+        # Truncate once, later writes always append
+        path = Path(path)
+        path.write_text("")
+        self.paths[key] = path
+        self.counts[key] = 0
+
+    def _handle(self, key):
+        handle = self.handles.get(key)
+        if handle is not None:
+            self.handles.move_to_end(key)
+            return handle
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        handle = open(self.paths[key], "a")
+        self.handles[key] = handle
+        return handle
+
+    def write(self, key, header, sequence):
+        self._handle(key).write(format_record(header, sequence))
+        self.counts[key] += 1
+
+    def close(self):
+        while self.handles:
+            _, handle = self.handles.popitem()
+            handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,262 @@
+"""Random access to genome FASTA files through their .fai index.
+
+Regions are translated to byte ranges with the .fai line layout and read in
+file order, so a batch of windows is served in one forward pass instead of
+seeking back and forth across the genome. Plain files are read with buffered
+seeks or through mmap; bgzip files are read block by block through their .gzi
+index (built from the block headers when missing); plain gzip files are read
+with forward seeks only. BgzfWriter writes bgzip files and their .gzi index
+from a stream, for genomes compressed while they are extracted.
+"""
+
+import gzip
+import mmap
+import struct
+import zlib
+from bisect import bisect_right
+from pathlib import Path
+
+from ptpp.catalog import GZIP_MAGIC, fai_lengths
+
+BGZF_HEADER = struct.Struct("<4BI2BH")
+BGZF_BLOCK_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_BLOCK_DATA = 0xff00  # Uncompressed bytes per block, as bgzip writes them
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+# .fai entries: {contig: (length, offset, line_bases, line_width)}
+def read_fai_entries(fai_file):
+    entries = {}
+    with open(fai_file) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 5:
+                entries[fields[0]] = tuple(int(x) for x in fields[1:5])
+    return entries
+
+
+# Byte offset of a 0-based position inside a contig
+def _byte_offset(entry, pos):
+    _, offset, line_bases, line_width = entry
+    return offset + (pos // line_bases) * line_width + pos % line_bases
+
+
+# Size of the BGZF block starting at the current position (None at EOF or if not BGZF)
+def _bgzf_block_size(f):
+    header = f.read(BGZF_HEADER.size)
+    if len(header) < BGZF_HEADER.size:
+        return None
+    id1, id2, _, flags, _, _, _, xlen = BGZF_HEADER.unpack(header)
+    if (id1, id2) != (0x1f, 0x8b) or not flags & 4:
+        return None
+    extra = f.read(xlen)
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack_from("<H", extra, i + 2)[0]
+        if extra[i:i + 2] == b"BC" and slen == 2:
+            return struct.unpack_from("<H", extra, i + 4)[0] + 1
+        i += 4 + slen
+    return None
+
+
+def is_bgzf(path):
+    with open(path, "rb") as f:
+        return _bgzf_block_size(f) is not None
+
+
+# Build a bgzip .gzi index (compressed, uncompressed offset of every block after the first)
+def build_gzi(genome_file, gzi_file):
+    entries = []
+    compressed = uncompressed = 0
+    with open(genome_file, "rb") as f:
+        while True:
+            f.seek(compressed)
+            size = _bgzf_block_size(f)
+            if size is None:
+                break
+            f.seek(compressed + size - 4)
+            isize = struct.unpack("<I", f.read(4))[0]
+            compressed += size
+            uncompressed += isize
+            entries.append((compressed, uncompressed))
+    # The last entry points past the end of the file
+    entries = entries[:-1]
+    with open(gzi_file, "wb") as out:
+        out.write(struct.pack("<Q", len(entries)))
+        for entry in entries:
+            out.write(struct.pack("<QQ", *entry))
+
+
+def read_gzi(gzi_file):
+    data = Path(gzi_file).read_bytes()
+    count = struct.unpack_from("<Q", data)[0]
+    pairs = struct.unpack_from(f"<{2 * count}Q", data, 8)
+    return [(0, 0)] + list(zip(pairs[::2], pairs[1::2]))
+
+
+# Write a bgzip file from a stream, keeping the block offsets for its .gzi index
+class BgzfWriter:
+    def __init__(self, path, level=6):
+        self.file = open(path, "wb")
+        self.level = level
+        self.buffer = bytearray()
+        self.compressed = 0
+        self.uncompressed = 0
+        self.blocks = []  # (compressed, uncompressed) offsets of every block after the first
+
+    def _write_block(self, data):
+        deflate = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        payload = deflate.compress(data) + deflate.flush()
+        block_size = BGZF_BLOCK_HEADER.size + len(payload) + 8
+        if self.compressed:
+            self.blocks.append((self.compressed, self.uncompressed))
+        self.file.write(BGZF_BLOCK_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, block_size - 1))
+        self.file.write(payload)
+        self.file.write(struct.pack("<II", zlib.crc32(data), len(data)))
+        self.compressed += block_size
+        self.uncompressed += len(data)
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) < BGZF_BLOCK_DATA:
+            return
+        view = memoryview(self.buffer)
+        end = len(self.buffer) - len(self.buffer) % BGZF_BLOCK_DATA
+        for start in range(0, end, BGZF_BLOCK_DATA):
+            self._write_block(view[start:start + BGZF_BLOCK_DATA])
+        view.release()
+        del self.buffer[:end]
+
+    def close(self):
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.file.write(BGZF_EOF)
+        self.file.close()
+
+    def write_gzi(self, gzi_file):
+        with open(gzi_file, "wb") as out:
+            out.write(struct.pack("<Q", len(self.blocks)))
+            for entry in self.blocks:
+                out.write(struct.pack("<QQ", *entry))
+
+
+class _PlainSource:
+    def __init__(self, path, use_mmap, buffer_size):
+        self.file = open(path, "rb", buffering=buffer_size)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else None
+
+    def read(self, start, end):
+        if self.map is not None:
+            return self.map[start:end]
+        self.file.seek(start)
+        return self.file.read(end - start)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+class _BgzfSource:
+    def __init__(self, path, buffer_size):
+        gzi_file = Path(f"{path}.gzi")
+        if not gzi_file.exists() or gzi_file.stat().st_mtime < Path(path).stat().st_mtime:
+            build_gzi(path, gzi_file)
+        index = read_gzi(gzi_file)
+        self.compressed = [c for c, _ in index]
+        self.uncompressed = [u for _, u in index]
+        self.file = open(path, "rb", buffering=buffer_size)
+        self.block = (0, -1, b"")  # (compressed offset, uncompressed offset, data) of the last block
+
+    def _block_at(self, i):
+        compressed, uncompressed = self.compressed[i], self.uncompressed[i]
+        if self.block[0] != compressed or self.block[1] != uncompressed:
+            self.file.seek(compressed)
+            size = _bgzf_block_size(self.file)
+            self.file.seek(compressed)
+            raw = self.file.read(size)
+            xlen = struct.unpack_from("<H", raw, 10)[0]
+            self.block = (compressed, uncompressed, zlib.decompress(raw[12 + xlen:-8], -15))
+        return self.block[2]
+
+    def read(self, start, end):
+        parts = []
+        i = bisect_right(self.uncompressed, start) - 1
+        while start < end and i < len(self.uncompressed):
+            data = self._block_at(i)
+            block_start = self.uncompressed[i]
+            parts.append(data[start - block_start:end - block_start])
+            start = block_start + len(data)
+            i += 1
+        return b"".join(parts)
+
+    def close(self):
+        self.file.close()
+
+
+class _GzipSource:
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "rb")
+
+    def read(self, start, end):
+        # Only forward seeks are cheap, rewinding decompresses from the start again
+        if start < self.file.tell():
+            self.file.close()
+            self.file = gzip.open(self.path, "rb")
+        self.file.seek(start)
+        return self.file.read(end - start)
+
+    def close(self):
+        self.file.close()
+
+
+class GenomeReader:
+    def __init__(self, genome_file, use_mmap=False, buffer_size=1 << 20):
+        self.genome_file = Path(genome_file)
+        fai_lengths(self.genome_file)
+        self.index = read_fai_entries(self.genome_file.with_name(self.genome_file.name + ".fai"))
+        self.order = {contig: n for n, contig in enumerate(self.index)}
+
+        with open(self.genome_file, "rb") as f:
+            compressed = f.read(2) == GZIP_MAGIC
+        if not compressed:
+            self.source = _PlainSource(self.genome_file, use_mmap, buffer_size)
+        elif is_bgzf(self.genome_file):
+            self.source = _BgzfSource(self.genome_file, buffer_size)
+        else:
+            self.source = _GzipSource(self.genome_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.source.close()
+
+    def __contains__(self, contig):
+        return contig in self.index
+
+    # Sequence of contig[start..end] (1-based, inclusive, clipped to the contig)
+    def fetch(self, contig, start, end):
+        entry = self.index[contig]
+        start = max(0, start - 1)
+        end = min(end, entry[0])
+        if end <= start:
+            return ""
+        raw = self.source.read(_byte_offset(entry, start), _byte_offset(entry, end))
+        return raw.translate(None, b"\r\n").decode("ascii")
+
+    # Fetch many regions (contig, start, end, ...) in file order: yields (region, sequence)
+    # Regions on contigs missing from the index are yielded with sequence None
+    def fetch_many(self, regions):
+        missing = len(self.order)
+        ordered = sorted(regions, key=lambda region: (self.order.get(region[0], missing), region[1]))
+        for region in ordered:
+            if region[0] not in self.index:
+                yield region, None
+                continue
+            yield region, self.fetch(region[0], region[1], region[2])
@@ -0,0 +1,150 @@
+"""Streaming GFF3 reading and GTF/transcript writing for AUGUSTUS predictions.
+
+AUGUSTUS runs on region sequences named contig:start-end, so its coordinates
+are relative to the region. One pass over the GFF3 writes the GTF in region
+coordinates, the same GTF lifted to genome coordinates and the spliced
+transcript sequences (taken from the region sequences already in memory),
+replacing the gffread -T / sed / gffread -w chain.
+"""
+
+import re
+
+from ptpp.fasta import format_record
+
+REGION_ID = re.compile(r'^(.+):(\d+)-(\d+)$')
+TRANSCRIPT_TYPES = {"transcript", "mRNA"}
+EXON_PARTS = {"CDS", "five_prime_UTR", "three_prime_UTR", "5'-UTR", "3'-UTR"}
+COMPLEMENT = str.maketrans("ACGTRYKMBDHVNacgtrykmbdhvn", "TGCAYRMKVHDBNtgcayrmkvhdbn")
+
+
+def parse_attributes(text):
+    attributes = {}
+    for field in text.strip().rstrip(";").split(";"):
+        if "=" in field:
+            key, value = field.split("=", 1)
+            attributes[key.strip()] = value.strip()
+    return attributes
+
+
+def reverse_complement(sequence):
+    return sequence.translate(COMPLEMENT)[::-1]
+
+
+# Contig and coordinate shift of a region ID (contig:start-end), or the seqid itself with no shift
+def region_offset(seqid):
+    match = REGION_ID.match(seqid)
+    if not match:
+        return seqid, 0
+    return match.group(1), int(match.group(2)) - 1
+
+
+class Transcript:
+    def __init__(self, transcript_id, gene_id, seqid, source, start, end, score, strand):
+        self.transcript_id = transcript_id
+        self.gene_id = gene_id
+        self.seqid = seqid
+        self.source = source
+        self.start = start
+        self.end = end
+        self.score = score
+        self.strand = strand
+        self.exons = []
+        self.cds = []  # (start, end, score, phase)
+        self.parts = []  # CDS and UTR segments, used as exons when the GFF has no exon lines
+
+    # Exons sorted by start, merged from CDS/UTR segments when none were given
+    def exon_spans(self):
+        if self.exons:
+            return sorted(self.exons)
+        spans = []
+        for start, end in sorted(self.parts):
+            if spans and start <= spans[-1][1] + 1:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+            else:
+                spans.append((start, end))
+        return spans
+
+    # GTF lines (transcript, exon, CDS) with the seqid replaced and coordinates shifted
+    def gtf_lines(self, seqid=None, shift=0):
+        seqid = seqid or self.seqid
+        attributes = f'transcript_id "{self.transcript_id}"; gene_id "{self.gene_id}";'
+        prefix = f"{seqid}\t{self.source}\t"
+        lines = [f"{prefix}transcript\t{self.start + shift}\t{self.end + shift}\t{self.score}\t{self.strand}\t.\t{attributes}\n"]
+        for start, end in self.exon_spans():
+            lines.append(f"{prefix}exon\t{start + shift}\t{end + shift}\t.\t{self.strand}\t.\t{attributes}\n")
+        for start, end, score, phase in sorted(self.cds):
+            lines.append(f"{prefix}CDS\t{start + shift}\t{end + shift}\t{score}\t{self.strand}\t{phase}\t{attributes}\n")
+        return lines
+
+    # Spliced transcript sequence from the sequence of its seqid
+    def sequence(self, seqid_sequence):
+        spliced = "".join(seqid_sequence[start - 1:end] for start, end in self.exon_spans())
+        return reverse_complement(spliced) if self.strand == "-" else spliced
+
+
+# Stream the transcripts of a GFF3 file, in file order
+# Features of a gene are expected together (as AUGUSTUS writes them): transcripts are
+# yielded when the next gene starts, so only one gene is held in memory
+def read_transcripts(gff_file):
+    pending = {}
+    with open(gff_file) as f:
+        for line in f:
+            if line.startswith("#"):
+                if line.startswith("###") and pending:
+                    yield from pending.values()
+                    pending = {}
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 9:
+                continue
+            seqid, source, feature, start, end, score, strand, phase, text = fields
+            if feature == "gene":
+                if pending:
+                    yield from pending.values()
+                    pending = {}
+                continue
+
+            attributes = parse_attributes(text)
+            start, end = int(start), int(end)
+            if feature in TRANSCRIPT_TYPES:
+                transcript_id = attributes.get("ID")
+                if transcript_id:
+                    gene_id = attributes.get("Parent", transcript_id.rsplit(".", 1)[0])
+                    pending[transcript_id] = Transcript(transcript_id, gene_id, seqid, source, start, end, score, strand)
+                continue
+
+            for parent in attributes.get("Parent", "").split(","):
+                transcript = pending.get(parent)
+                if transcript is None:
+                    continue
+                if feature == "exon":
+                    transcript.exons.append((start, end))
+                elif feature in EXON_PARTS:
+                    transcript.parts.append((start, end))
+                    if feature == "CDS":
+                        transcript.cds.append((start, end, score, phase))
+    if pending:
+        yield from pending.values()
+
+
+# Write the GTF, the genome-coordinate GTF and the transcript FASTA in one pass
+# sequences: {seqid: sequence} of the sequences the GFF refers to (the extracted regions)
+# Returns (transcripts written, transcripts without sequence)
+def convert_augustus_gff(gff_file, gtf_file, lifted_gtf_file, transcripts_fasta, sequences):
+    offsets = {}
+    n_transcripts = n_missing = 0
+    with open(gtf_file, "w") as gtf, open(lifted_gtf_file, "w") as lifted, open(transcripts_fasta, "w") as fasta:
+        for transcript in read_transcripts(gff_file):
+            if transcript.seqid not in offsets:
+                offsets[transcript.seqid] = region_offset(transcript.seqid)
+            contig, shift = offsets[transcript.seqid]
+            gtf.write("".join(transcript.gtf_lines()))
+            lifted.write("".join(transcript.gtf_lines(contig, shift)))
+            n_transcripts += 1
+
+            sequence = sequences.get(transcript.seqid)
+            if sequence is None:
+                n_missing += 1
+                continue
+            fasta.write(format_record(f"{transcript.transcript_id} gene={transcript.gene_id}", transcript.sequence(sequence)))
+    return n_transcripts, n_missing
@@ -0,0 +1,107 @@
+"""Protein ID table (inputs/PROT_IDS.xlsx, .tsv or .csv) shared by steps 1 and 6.
+
+The table is parsed once: Tax_Name is normalized into Species (step 1) and
+Genus (step 6) on its unique values only, and the result is cached as a
+Feather file in outputs/.cache/ with the size, mtime and MD5 of the source.
+Later runs load the cache instead of parsing the sheet again; it is rebuilt
+whenever the source changes, and skipped when pyarrow is not installed.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ptpp.catalog import file_md5
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+INPUT_DIR = BASE_DIR / "inputs"
+CACHE_DIR = BASE_DIR / "outputs" / ".cache"
+CACHE_VERSION = 1
+ID_TABLE_NAMES = ("PROT_IDS.xlsx", "PROT_IDS.tsv", "PROT_IDS.csv")
+
+
+# First PROT_IDS.* found in the inputs folder (None when there is none)
+def find_id_table(input_dir=INPUT_DIR):
+    for name in ID_TABLE_NAMES:
+        path = Path(input_dir) / name
+        if path.exists():
+            return path
+    return None
+
+
+# IDs are read as text, so a numeric ID is "12345" in every format; pd.read_excel without
+# dtype made it "12345.0" when the ID column had empty cells (float column)
+def read_source(path):
+    path = Path(path)
+    dtypes = {"ID": str, "Tax_Name": str}
+    if path.suffix.lower() in (".xlsx", ".xls"):
+        return pd.read_excel(path, dtype=dtypes)
+    if path.suffix.lower() == ".tsv":
+        sep = "\t"
+    else:
+        # CSV files are written with "," or ";" (as species_frequency.csv)
+        with open(path, encoding="utf-8-sig") as f:
+            header = f.readline()
+        sep = ";" if header.count(";") > header.count(",") else ","
+    return pd.read_csv(path, sep=sep, dtype=dtypes, encoding="utf-8-sig")
+
+
+# Categorical column from per-category values (codes -1 and missing values stay missing)
+def _from_categories(codes, values):
+    value_codes, uniques = pd.factorize(values)
+    return pd.Categorical.from_codes(np.where(codes >= 0, value_codes[codes], -1), uniques)
+
+
+# ID, Tax_Name, Species and Genus; names are normalized once per distinct Tax_Name
+def normalize(table):
+    missing = [column for column in ("ID", "Tax_Name") if column not in table.columns]
+    if missing:
+        raise ValueError(f"ID table without column {', '.join(missing)}")
+    names = table["Tax_Name"].astype("category")
+    categories = names.cat.categories.to_series()
+    codes = names.cat.codes.to_numpy()
+    return pd.DataFrame({
+        "ID": table["ID"].astype(str).to_numpy(),
+        "Tax_Name": names.to_numpy(),
+        "Species": _from_categories(codes, categories.str.strip().str.replace(r"[^\w]", "_", regex=True).to_numpy()),
+        "Genus": _from_categories(codes, categories.str.extract(r'^(\w+)', expand=False).to_numpy())
+    })
+
+
+def _cache_files(path, cache_dir):
+    base = Path(cache_dir) / Path(path).name
+    return base.with_name(f"{base.name}.feather"), base.with_name(f"{base.name}.json")
+
+
+# Load the ID table from its cache, or parse it and write the cache
+def load_id_table(path=None, cache_dir=CACHE_DIR):
+    path = Path(path) if path else find_id_table()
+    if path is None:
+        raise FileNotFoundError(f"no {' / '.join(ID_TABLE_NAMES)} in {INPUT_DIR}")
+    stat = path.stat()
+    key = {"version": CACHE_VERSION, "source": str(path.resolve()), "size": stat.st_size,
+           "mtime": stat.st_mtime, "md5": file_md5(path)}
+    cache_file, key_file = _cache_files(path, cache_dir)
+
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        feather = None
+    if feather is not None and cache_file.exists():
+        try:
+            if json.loads(key_file.read_text()) == key:
+                return feather.read_feather(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    table = normalize(read_source(path))
+    if feather is not None:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        feather.write_feather(table, tmp_file)
+        os.replace(tmp_file, cache_file)
+        key_file.write_text(json.dumps(key, indent=1))
+    return table
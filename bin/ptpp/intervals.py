@@ -0,0 +1,45 @@
+"""Interval operations on 1-based, closed genomic coordinates."""
+
+from collections import defaultdict
+
+
+# Merge overlapping or nearby (<= gap bp apart) intervals with sort-and-sweep
+# intervals: iterable of (start, end, label), returns [(start, end, [labels])]
+def merge_intervals(intervals, gap=0):
+    merged = []
+    for start, end, label in sorted(intervals, key=lambda x: (x[0], x[1])):
+        if merged and start <= merged[-1][1] + gap + 1:
+            last = merged[-1]
+            last[1] = max(last[1], end)
+            last[2].append(label)
+        else:
+            merged.append([start, end, [label]])
+    return [tuple(interval) for interval in merged]
+
+
+# Merge intervals separately for each contig
+# intervals: iterable of (contig, start, end, label), returns {contig: [(start, end, [labels])]}
+def merge_by_contig(intervals, gap=0):
+    by_contig = defaultdict(list)
+    for contig, start, end, label in intervals:
+        by_contig[contig].append((start, end, label))
+    return {contig: merge_intervals(items, gap) for contig, items in by_contig.items()}
+
+
+
+# Cluster near-identical intervals, given sorted by (key, start, end): an interval joins the current
+# cluster of its key when it overlaps the cluster's first interval by at least min_overlap of both
+# lengths (so clusters do not drift along chains of overlaps); returns the cluster index of each interval
+def cluster_sorted(keys, starts, ends, min_overlap=1.0):
+    clusters = []
+    cluster = -1
+    last_key = None
+    seed_start = seed_end = 0
+    for key, start, end in zip(keys, starts, ends):
+        overlap = min(seed_end, end) - start + 1
+        if (key != last_key or overlap < min_overlap * (end - start + 1)
+                or overlap < min_overlap * (seed_end - seed_start + 1)):
+            cluster += 1
+            last_key, seed_start, seed_end = key, start, end
+        clusters.append(cluster)
+    return clusters
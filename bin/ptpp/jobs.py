@@ -0,0 +1,118 @@
+"""Helpers for running independent work items concurrently."""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from ptpp.metrics import reset_context, set_context
+
+
+# Cores available to this process (respects taskset/cgroup affinity)
+def available_cores():
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+# Available memory in bytes (MemAvailable from /proc/meminfo), None if unknown
+def available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# Split items into n bins of similar total weight (largest first, into the lightest bin)
+def balanced_shards(items, n, weight):
+    n = max(1, min(n, len(items)))
+    shards = [[] for _ in range(n)]
+    loads = [0] * n
+    order = sorted(range(len(items)), key=lambda i: weight(items[i]), reverse=True)
+    for i in order:
+        target = loads.index(min(loads))
+        shards[target].append(i)
+        loads[target] += weight(items[i])
+    # Keep the input order inside each shard
+    return [[items[i] for i in sorted(shard)] for shard in shards if shard]
+
+
+# Stream wrapper adding a prefix to every line (per-genus log output)
+class PrefixedStream:
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.line_start = True
+
+    def write(self, text):
+        out = []
+        for line in text.splitlines(keepends=True):
+            if self.line_start and line.strip():
+                out.append(self.prefix)
+            out.append(line)
+            self.line_start = line.endswith("\n")
+        self.stream.write("".join(out))
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+# The genus context is reset afterwards, so later records of the process (the step total
+# of a serial run) are not labelled with the last genus
+def _run_job(func, genus, args, prefix):
+    previous = set_context(genus=genus)
+    if prefix:
+        sys.stdout = PrefixedStream(sys.__stdout__, f"[{genus}]")
+        sys.stderr = PrefixedStream(sys.__stderr__, f"[{genus}]")
+    try:
+        return genus, func(*args), None
+    except Exception as e:
+        return genus, None, str(e)
+    finally:
+        sys.stdout.flush()
+        reset_context(previous)
+
+
+# Run func(*args) for each (genus, args), in a process pool when jobs > 1
+# Returns ({genus: result}, {genus: error}) in the input order
+def run_genera(func, items, jobs=1):
+    results = {}
+    errors = {}
+
+    def collect(genus, result, error):
+        if error is not None:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] Error processing {genus}: {error}", flush=True)
+            errors[genus] = error
+        else:
+            results[genus] = result
+
+    if jobs <= 1 or len(items) <= 1:
+        for genus, args in items:
+            collect(*_run_job(func, genus, args, prefix=False))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_run_job, func, genus, args, True) for genus, args in items]
+            for future in as_completed(futures):
+                collect(*future.result())
+
+    order = [genus for genus, _ in items]
+    return ({g: results[g] for g in order if g in results},
+            {g: errors[g] for g in order if g in errors})
+
+
+# End-of-run summary of failed genera
+def print_failures(failures, total):
+    if not failures:
+        return
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][SUMMARY] {len(failures)}/{total} genera failed:")
+    for genus, error in failures.items():
+        print(f"  {genus}: {error}")
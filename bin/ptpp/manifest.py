@@ -0,0 +1,86 @@
+"""Run manifest: skip pipeline steps whose inputs, parameters and outputs are unchanged.
+
+Each (step, genus) pair has a small JSON record in outputs/.manifest/<step>/ with
+the content hashes of its input files, its parameters and its output files. A
+step is up to date when all of them still match. Files are rehashed only when
+their size or mtime changed, so checking a step costs a few stat calls. Because
+the outputs of one step are the inputs of the next, a change in one genus only
+invalidates the downstream steps of that genus, and a rerun that produces
+identical outputs does not invalidate anything.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from ptpp.catalog import file_md5
+
+MANIFEST_DIR = Path(__file__).resolve().parent.parent.parent / "outputs" / ".manifest"
+
+
+def _params_key(params):
+    return json.loads(json.dumps(params, sort_keys=True, default=str))
+
+
+class RunManifest:
+    def __init__(self, step, manifest_dir=MANIFEST_DIR):
+        self.step = step
+        self.step_dir = Path(manifest_dir) / step
+
+    def _record_file(self, genus):
+        return self.step_dir / f"{genus}.json"
+
+    def _load(self, genus):
+        try:
+            return json.loads(self._record_file(genus).read_text())
+        except (OSError, ValueError):
+            return None
+
+    # Content hash of a file, reusing a known hash while size and mtime are unchanged
+    @staticmethod
+    def _file_state(path, known=None):
+        stat = Path(path).stat()
+        if known and known.get("size") == stat.st_size and known.get("mtime") == stat.st_mtime:
+            return known
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "hash": file_md5(path)}
+
+    def _files_match(self, paths, recorded):
+        if sorted(str(p) for p in paths) != sorted(recorded):
+            return False
+        for path in paths:
+            if not Path(path).exists():
+                return False
+            if self._file_state(path, recorded[str(path)])["hash"] != recorded[str(path)]["hash"]:
+                return False
+        return True
+
+    # True when the step already ran for this genus with the same inputs and parameters
+    # and its outputs are still in place
+    def is_current(self, genus, inputs, params, outputs):
+        record = self._load(genus)
+        if not record or record.get("params") != _params_key(params):
+            return False
+        return (self._files_match(inputs, record.get("inputs", {}))
+                and self._files_match(outputs, record.get("outputs", {})))
+
+    def record(self, genus, inputs, params, outputs):
+        previous = self._load(genus) or {}
+        known_inputs = previous.get("inputs", {})
+        known_outputs = previous.get("outputs", {})
+        record = {
+            "inputs": {str(p): self._file_state(p, known_inputs.get(str(p))) for p in inputs},
+            "params": _params_key(params),
+            "outputs": {str(p): self._file_state(p, known_outputs.get(str(p))) for p in outputs if Path(p).exists()}
+        }
+        self.step_dir.mkdir(parents=True, exist_ok=True)
+        record_file = self._record_file(genus)
+        tmp_file = record_file.with_name(f"{record_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(record, indent=1))
+        os.replace(tmp_file, record_file)
+
+    # True when the step has a record for this genus (a completed run, current or not)
+    def has_record(self, genus):
+        return self._record_file(genus).exists()
+
+    def invalidate(self, genus):
+        self._record_file(genus).unlink(missing_ok=True)
@@ -0,0 +1,333 @@
+"""Resource metrics for the pipeline steps and the external tools they run.
+
+Every record is one JSON line in the metrics file of the run:
+    kind     "step" (whole script), "section" (Python code block) or "tool" (subprocess)
+    step     script name (e.g. 8_AUGUSTUS), genus when known, name of the section/tool
+    wall     elapsed seconds
+    cpu      CPU seconds (user + system; the calling thread for sections)
+    max_rss  peak resident set size in bytes (the child for tools, the process for sections)
+    read_bytes / write_bytes  bytes read from and written to storage
+
+The metrics file is $PTPP_METRICS_FILE (set by `ptpp run` for all its tasks) or
+logs/metrics/<step>_<date>.jsonl for a script run on its own. A summary table
+is printed when a step ends.
+
+Profiling is opt-in with PTPP_PROFILE=cprofile or PTPP_PROFILE=tracemalloc:
+every measured section then also writes a cProfile dump (.prof) or its top
+allocations (.txt) to a profiles/ folder next to the metrics file.
+"""
+
+import atexit
+import cProfile
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+LOG_DIR = Path(__file__).resolve().parent.parent.parent / "logs"
+METRICS_ENV = "PTPP_METRICS_FILE"
+PROFILE_ENV = "PTPP_PROFILE"
+INVOCATION_ENV = "PTPP_METRICS_INVOCATION"
+SUMMARY_FIELDS = ["wall", "cpu", "max_rss", "read_bytes", "write_bytes"]
+
+_context = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _step_name():
+    return Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else "python"
+
+
+# Metrics file of the current run (created on first use and shared with child processes)
+def metrics_file():
+    path = os.environ.get(METRICS_ENV)
+    if not path:
+        path = str(LOG_DIR / "metrics" / f"{_step_name()}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        os.environ[METRICS_ENV] = path
+    return Path(path)
+
+
+# Fields added to every record of this process (e.g. the genus being processed)
+# Returns the previous context, to be restored with reset_context when the work is done
+def set_context(**fields):
+    previous = dict(_context)
+    _context.update(fields)
+    return previous
+
+
+def reset_context(previous):
+    _context.clear()
+    _context.update(previous)
+
+
+def _maxrss_bytes(maxrss):
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+# Storage I/O of this process: (read_bytes, write_bytes)
+def _process_io():
+    try:
+        with open("/proc/self/io") as f:
+            values = dict(line.split(": ") for line in f.read().splitlines())
+        return int(values["read_bytes"]), int(values["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        if resource:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_inblock * 512, usage.ru_oublock * 512
+        return 0, 0
+
+
+def record(kind, name, **fields):
+    entry = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "kind": kind,
+        "step": _step_name(),
+        "name": name,
+        "invocation": os.environ.get(INVOCATION_ENV),
+        "pid": os.getpid()
+    }
+    entry.update(_context)
+    entry.update(fields)
+    path = metrics_file()
+    line = json.dumps(entry) + "\n"
+    with _lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(line)
+
+
+def _profile_file(name, suffix):
+    genus = _context.get("genus")
+    label = "_".join(str(x) for x in (_step_name(), name, genus, os.getpid()) if x)
+    path = metrics_file().parent / "profiles" / f"{label}_{time.time_ns()}{suffix}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+# Measure a block of Python code (and profile it when PTPP_PROFILE is set)
+@contextmanager
+def measure(name, **fields):
+    mode = os.environ.get(PROFILE_ENV, "").lower()
+    # Only the outermost section of a thread is profiled (profilers do not nest)
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    profiler = None
+    tracing = False
+    if depth == 0 and mode == "cprofile":
+        profiler = cProfile.Profile()
+    elif depth == 0 and mode == "tracemalloc":
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    read_start, write_start = _process_io()
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        read_end, write_end = _process_io()
+        _local.depth = depth
+        extra = {}
+        if resource:
+            extra["max_rss"] = _maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        if profiler:
+            profile_file = _profile_file(name, ".prof")
+            profiler.dump_stats(profile_file)
+            extra["profile"] = str(profile_file)
+        elif depth == 0 and mode == "tracemalloc" and tracemalloc.is_tracing():
+            extra["traced_peak"] = tracemalloc.get_traced_memory()[1]
+            profile_file = _profile_file(name, ".txt")
+            stats = tracemalloc.take_snapshot().statistics("lineno")[:25]
+            profile_file.write_text("".join(f"{stat}\n" for stat in stats))
+            extra["profile"] = str(profile_file)
+            if tracing:
+                tracemalloc.stop()
+        record("section", name, wall=round(wall, 6), cpu=round(cpu, 6),
+               read_bytes=read_end - read_start, write_bytes=write_end - write_start,
+               **extra, **fields)
+
+
+# Popen whose wait() reaps the child with os.wait4 to keep its resource usage
+# (per child, so tools run by concurrent threads are not mixed up as with RUSAGE_CHILDREN);
+# once returncode is set, Popen.wait returns it without waiting again
+class MeasuredPopen(subprocess.Popen):
+    rusage = None
+
+    def wait(self, timeout=None):
+        if self.returncode is None and hasattr(os, "wait4"):
+            deadline = None if timeout is None else time.monotonic() + timeout
+            delay = 0.0005
+            while True:
+                try:
+                    pid, status, rusage = os.wait4(self.pid, 0 if deadline is None else os.WNOHANG)
+                except ChildProcessError:
+                    # Reaped elsewhere, Popen.wait handles it
+                    break
+                if pid == self.pid:
+                    self.rusage = rusage
+                    self.returncode = os.waitstatus_to_exitcode(status)
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.args, timeout)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        return super().wait(timeout)
+
+
+# Resource usage of a finished MeasuredPopen
+# (Linux counts the RSS of the forked Python parent before exec, so tiny tools report at least that)
+def child_usage(process):
+    usage = process.rusage
+    if usage is None:
+        return {}
+    return {
+        "cpu": round(usage.ru_utime + usage.ru_stime, 6),
+        "max_rss": _maxrss_bytes(usage.ru_maxrss),
+        "read_bytes": usage.ru_inblock * 512,
+        "write_bytes": usage.ru_oublock * 512
+    }
+
+
+# Drop-in for subprocess.run that records the tool's wall time, CPU, peak RSS and I/O
+# (fields: extra values stored with the record, e.g. {"genus": genus})
+# input can also be an iterable of byte chunks, streamed to stdin as they come; stdout and stderr
+# should then go to files, as they are only read once the input is written
+def run(cmd, *, name=None, fields=None, input=None, capture_output=False, timeout=None, check=False, **kwargs):
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    name = name or Path(str(cmd[0] if isinstance(cmd, (list, tuple)) else cmd.split()[0])).name
+
+    wall_start = time.perf_counter()
+    with MeasuredPopen(cmd, **kwargs) as process:
+        try:
+            if input is not None and not isinstance(input, (bytes, str)):
+                chunks, input = input, None
+                try:
+                    for chunk in chunks:
+                        process.stdin.write(chunk)
+                except BrokenPipeError:
+                    pass
+                finally:
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except BaseException:
+            process.kill()
+            raise
+        returncode = process.wait()
+    record("tool", name, wall=round(time.perf_counter() - wall_start, 6),
+           returncode=returncode, **child_usage(process), **(fields or {}))
+
+    if check and returncode:
+        raise subprocess.CalledProcessError(returncode, process.args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(process.args, returncode, stdout, stderr)
+
+
+# Aggregate records by (step, kind, name): calls, total wall/cpu/io and the peak RSS
+def summarize(path, invocation=None):
+    rows = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if invocation and entry.get("invocation") != invocation:
+                    continue
+                key = (entry.get("step"), entry.get("kind"), entry.get("name"))
+                row = rows.setdefault(key, dict.fromkeys(["calls"] + SUMMARY_FIELDS, 0))
+                row["calls"] += 1
+                for field in SUMMARY_FIELDS:
+                    value = entry.get(field) or 0
+                    row[field] = max(row[field], value) if field == "max_rss" else row[field] + value
+    except OSError:
+        pass
+    return [dict(zip(("step", "kind", "name"), key), **row) for key, row in rows.items()]
+
+
+def _size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def format_summary(rows):
+    header = ["step", "kind", "name", "calls", "wall(s)", "cpu(s)", "peak RSS", "read", "written"]
+    table = [header] + [
+        [row["step"], row["kind"], row["name"], str(row["calls"]), f"{row['wall']:.2f}",
+         f"{row['cpu']:.2f}", _size(row["max_rss"]), _size(row["read_bytes"]), _size(row["write_bytes"])]
+        for row in sorted(rows, key=lambda r: (r["kind"] != "step", -r["wall"]))
+    ]
+    widths = [max(len(str(line[i])) for line in table) for i in range(len(header))]
+    return "\n".join("  ".join(str(cell).ljust(width) for cell, width in zip(line, widths)) for line in table)
+
+
+# Record the whole script at exit and print the summary of this invocation
+def track_step():
+    invocation = f"{_step_name()}-{os.getpid()}-{time.time_ns()}"
+    os.environ[INVOCATION_ENV] = invocation
+    wall_start = time.perf_counter()
+    read_start, write_start = _process_io()
+    metrics_file()
+
+    def finish():
+        extra = {}
+        if resource:
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            extra["cpu"] = round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 6)
+            extra["max_rss"] = _maxrss_bytes(max(own.ru_maxrss, children.ru_maxrss))
+        read_end, write_end = _process_io()
+        record("step", "total", wall=round(time.perf_counter() - wall_start, 6),
+               read_bytes=read_end - read_start, write_bytes=write_end - write_start, **extra)
+        rows = summarize(metrics_file(), invocation)
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][METRICS] Resource usage (details in {metrics_file()}):")
+        print(format_summary(rows), flush=True)
+
+    atexit.register(finish)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a PTPP metrics file")
+    parser.add_argument("metrics_file")
+    parser.add_argument("--csv", help="Also write the summary as CSV")
+    args = parser.parse_args()
+
+    rows = summarize(args.metrics_file)
+    print(format_summary(rows))
+    if args.csv:
+        import csv
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["step", "kind", "name", "calls"] + SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
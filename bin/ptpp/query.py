@@ -0,0 +1,229 @@
+"""Per-genus interval index over the pipeline results, queried by region or protein ID.
+
+Every source (tblastn best hits, AUGUSTUS hints, AUGUSTUS transcripts in
+genome coordinates, Exonerate alignments) is kept as NumPy arrays sorted by
+contig and start, with the running maximum of the ends inside each contig.
+A region query is then two binary searches and a filter over the slice that
+can overlap the window; a protein query is a binary search over the sorted
+names. The index is saved as outputs/.index/{genus}.npz and rebuilt when a
+source file changes.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ptpp.tables import read_table
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+OUTPUT_DIR = BASE_DIR / "outputs"
+INDEX_DIR = OUTPUT_DIR / ".index"
+INDEX_VERSION = 2
+SOURCES = ("hits", "hints", "genes", "alignments")
+COLUMNS = ["source", "contig", "start", "end", "strand", "name", "score"]
+
+REGION = re.compile(r'^(.+):([\d,]+)-([\d,]+)$')
+GRP = re.compile(r'grp=([^;]+)')
+TRANSCRIPT_ID = re.compile(r'transcript_id "([^"]+)"')
+EXONERATE_QUERY = re.compile(r'sequence ([^ ;]+)')
+
+
+# Queries behind each hint, written by step 8 when hints are compacted (merged hints have no grp=)
+def hints_groups_file(genus):
+    return OUTPUT_DIR / f"{genus}_hints_groups.tsv"
+
+
+# Result files of a genus by source (None when the step did not run)
+def source_files(genus):
+    genes = sorted(OUTPUT_DIR.glob(f"{genus}_*_augustus_clean.gtf"))
+    return {
+        "hits": OUTPUT_DIR / "blast_results" / f"{genus}_BH.txt",
+        "hints": OUTPUT_DIR / f"{genus}_hints.gff",
+        "genes": genes[0] if genes else None,
+        "alignments": OUTPUT_DIR / "exonerate_results" / f"{genus}_exonerate.gff"
+    }
+
+
+# "contig:start-end" (1-based, inclusive, commas allowed) or a whole "contig"
+def parse_region(text):
+    match = REGION.match(text)
+    if not match:
+        return text, 1, None
+    start, end = int(match.group(2).replace(",", "")), int(match.group(3).replace(",", ""))
+    return match.group(1), min(start, end), max(start, end)
+
+
+# Records (contig, start, end, strand, name, score) of one source file
+def _load_source(source, path):
+    if source == "hits":
+        table = read_table(path, "outfmt6", columns=["sseqid", "sstart", "send", "evalue", "qseqid"])
+        return pd.DataFrame({
+            "contig": table["sseqid"],
+            "start": np.minimum(table["sstart"], table["send"]),
+            "end": np.maximum(table["sstart"], table["send"]),
+            "strand": np.where(table["sstart"] <= table["send"], "+", "-"),
+            "name": table["qseqid"],
+            "score": table["evalue"]
+        })
+
+    groups = Path(path).with_name(Path(path).name.replace("_hints.gff", "_hints_groups.tsv")) if source == "hints" else None
+    if groups is not None and groups.exists():
+        # One record per hint and query, so merged hints are found from any of their proteins
+        table = pd.read_csv(groups, sep="\t", dtype={"contig": str, "strand": str, "evalue": str, "grp": str},
+                            keep_default_na=False)
+        table = table.assign(name=table["grp"].str.split(",")).explode("name")
+        return pd.DataFrame({
+            "contig": table["contig"], "start": table["start"], "end": table["end"],
+            "strand": table["strand"], "name": table["name"], "score": table["evalue"]
+        })
+
+    table = read_table(path, "gff", columns=["seqid", "type", "start", "end", "score", "strand", "attributes"])
+    if source == "hints":
+        pattern = GRP
+    elif source == "genes":
+        table = table[table["type"] == "transcript"]
+        pattern = TRANSCRIPT_ID
+    else:
+        table = table[table["type"] == "gene"]
+        pattern = EXONERATE_QUERY
+    names = table["attributes"].str.extract(pattern, expand=False).fillna("")
+    return pd.DataFrame({
+        "contig": table["seqid"], "start": table["start"], "end": table["end"],
+        "strand": table["strand"], "name": names, "score": table["score"]
+    })
+
+
+# Arrays of one source sorted by contig and start
+def _source_arrays(source, records):
+    records = records.sort_values(["contig", "start"], kind="stable")
+    contigs, codes = np.unique(records["contig"].to_numpy(dtype=str), return_inverse=True)
+    ends = records["end"].to_numpy(dtype=np.int64)
+    names = records["name"].to_numpy(dtype=str)
+    name_order = np.argsort(names, kind="stable")
+    return {
+        f"{source}.contigs": contigs,
+        f"{source}.offsets": np.searchsorted(codes, np.arange(len(contigs) + 1)),
+        f"{source}.starts": records["start"].to_numpy(dtype=np.int64),
+        f"{source}.ends": ends,
+        f"{source}.max_ends": pd.Series(ends).groupby(codes).cummax().to_numpy(dtype=np.int64),
+        f"{source}.strands": records["strand"].to_numpy(dtype=str),
+        f"{source}.names": names,
+        f"{source}.scores": records["score"].astype(str).to_numpy(dtype=str),
+        f"{source}.name_order": name_order,
+        f"{source}.sorted_names": names[name_order]
+    }
+
+
+def _file_state(path):
+    if path is None or not Path(path).exists():
+        return None
+    stat = Path(path).stat()
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+class ResultIndex:
+    def __init__(self, genus, index_dir=INDEX_DIR, rebuild=False):
+        self.genus = genus
+        self.index_file = Path(index_dir) / f"{genus}.npz"
+        self.files = source_files(genus)
+        state = {source: _file_state(path) for source, path in self.files.items()}
+        state["hints_groups"] = _file_state(hints_groups_file(genus))
+        self.arrays = None if rebuild else self._load(state)
+        if self.arrays is None:
+            self.arrays = self._build(state)
+
+    def _load(self, state):
+        try:
+            with np.load(self.index_file) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != INDEX_VERSION or meta.get("state") != state:
+                    return None
+                return {key: data[key] for key in data.files}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _build(self, state):
+        arrays = {}
+        for source, path in self.files.items():
+            if state[source] is not None:
+                arrays.update(_source_arrays(source, _load_source(source, path)))
+        arrays["meta"] = np.array(json.dumps({"version": INDEX_VERSION, "genus": self.genus, "state": state}))
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_name(f"{self.index_file.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, self.index_file)
+        return arrays
+
+    # Sources present in the index
+    def sources(self):
+        return [source for source in SOURCES if f"{source}.starts" in self.arrays]
+
+    def _rows(self, source, rows):
+        a = self.arrays
+        contigs = a[f"{source}.contigs"]
+        codes = np.searchsorted(a[f"{source}.offsets"], rows, side="right") - 1
+        return [
+            (source, str(contigs[code]), int(a[f"{source}.starts"][row]), int(a[f"{source}.ends"][row]),
+             str(a[f"{source}.strands"][row]), str(a[f"{source}.names"][row]), str(a[f"{source}.scores"][row]))
+            for code, row in zip(codes, rows)
+        ]
+
+    # Records overlapping contig[start..end] (1-based, inclusive; end None for the whole contig)
+    def region(self, contig, start=1, end=None, sources=SOURCES):
+        results = []
+        for source in sources:
+            if f"{source}.starts" not in self.arrays:
+                continue
+            contigs = self.arrays[f"{source}.contigs"]
+            code = np.searchsorted(contigs, contig)
+            if code >= len(contigs) or contigs[code] != contig:
+                continue
+            lo, hi = self.arrays[f"{source}.offsets"][code:code + 2]
+            starts = self.arrays[f"{source}.starts"][lo:hi]
+            # Rows starting after the window end, and rows whose running max end is before its start, are out
+            last = hi if end is None else lo + np.searchsorted(starts, end, side="right")
+            first = lo + np.searchsorted(self.arrays[f"{source}.max_ends"][lo:hi], start, side="left")
+            rows = first + np.flatnonzero(self.arrays[f"{source}.ends"][first:last] >= start)
+            results.extend(self._rows(source, rows))
+        return sorted(results, key=lambda row: (row[2], row[3], SOURCES.index(row[0])))
+
+    # Records of a protein (query) ID
+    def protein(self, name, sources=SOURCES):
+        results = []
+        for source in sources:
+            if f"{source}.starts" not in self.arrays:
+                continue
+            sorted_names = self.arrays[f"{source}.sorted_names"]
+            lo, hi = np.searchsorted(sorted_names, name, side="left"), np.searchsorted(sorted_names, name, side="right")
+            rows = np.sort(self.arrays[f"{source}.name_order"][lo:hi])
+            results.extend(self._rows(source, rows))
+        return results
+
+
+def format_rows(rows, as_json=False):
+    if as_json:
+        return "\n".join(json.dumps(dict(zip(COLUMNS, row))) for row in rows)
+    return "\n".join("\t".join(str(x) for x in row) for row in [COLUMNS] + list(rows))
+
+
+# `ptpp query`: print the records of the requested regions and protein IDs
+def cli(args):
+    sources = [source.strip() for source in args.sources.split(",") if source.strip()]
+    unknown = [source for source in sources if source not in SOURCES]
+    if unknown:
+        raise SystemExit(f"unknown sources: {', '.join(unknown)} (choose from {', '.join(SOURCES)})")
+
+    index = ResultIndex(args.genus, rebuild=args.rebuild)
+    if not index.sources():
+        raise SystemExit(f"no results found for {args.genus} in {OUTPUT_DIR}")
+    rows = []
+    for region in args.region or []:
+        rows.extend(index.region(*parse_region(region), sources=sources))
+    for name in args.protein or []:
+        rows.extend(index.protein(name, sources=sources))
+    print(format_rows(rows, args.json))
+    return 0
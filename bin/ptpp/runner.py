@@ -0,0 +1,362 @@
+"""Pipeline runner: steps 1 to 10 as a per-genus DAG under one scheduler.
+
+The dataset-wide steps (species list, downloads, unzip, move, BLAST DBs and the
+FASTA split) run once; steps 7 to 10 run per genus as soon as their own
+dependencies are done, so one genus can be in AUGUSTUS while another is still
+in tblastn. Every task is a subprocess running the step script for one genus.
+Tasks share one budget of cores and memory, and each task is pinned to its own
+CPUs so the tools it starts stay inside its share.
+
+Progress is written as JSON lines, one event per line:
+    run_start, task_start, log (batched output lines), task_done,
+    task_failed, task_skipped, metrics (per-step resource summary), run_done
+    (task_planned with --dry-run)
+
+Resource metrics of all tasks and the tools they run go to metrics.jsonl in
+the run's log folder (see ptpp.metrics).
+"""
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from ptpp import metrics, query
+from ptpp.catalog import genome_catalog
+from ptpp.jobs import available_cores, available_memory
+from ptpp.tables import TABLE_FORMATS
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+BIN_DIR = BASE_DIR / "bin"
+LOG_DIR = BASE_DIR / "logs"
+FILTERED_FASTA_DIR = BASE_DIR / "outputs" / "filtered_fasta"
+GENOMES_DIR = BASE_DIR / "data" / "genomes"
+
+# Dataset-wide steps: (step, script, dependencies)
+GLOBAL_STEPS = [
+    ("1", "1_EXT_SPECIES.py", []),
+    ("2", "2_GENOMES_DOWNLOAD.py", ["1"]),
+    ("3", "3_GENOMES_EXTRACT.py", ["2"]),
+    ("5", "5_GENOMES_MAKEDB.py", ["3"]),
+    ("6", "6_SEQUENCES_SPLIT.py", []),
+]
+# Per-genus steps: (step, script, dataset-wide dependencies, same-genus dependencies)
+GENUS_STEPS = [
+    ("7", "7_SEQUENCES_TBLASTN.py", ["5", "6"], []),
+    ("8", "8_AUGUSTUS.py", ["3"], ["7"]),
+    ("9", "9_EXONERATE.py", ["3", "6"], []),
+    ("10", "10_SCHEMA.py", [], ["8"]),
+]
+STEP_ORDER = [step for step, _, _ in GLOBAL_STEPS] + [step for step, _, _, _ in GENUS_STEPS]
+
+# Cores requested by the tasks of each step (capped by the budget)
+step_cores = {"1": 1, "2": 1, "3": 4, "5": 4, "6": 1, "7": 4, "8": 4, "9": 4, "10": 1}
+log_batch_lines = 100 # Output lines per log event
+log_batch_seconds = 1.0 # Longest wait before a partial batch of output lines is emitted
+
+
+class Task:
+    def __init__(self, step, script, genus=None, deps=(), cores=1, memory=0, weight=0, args=()):
+        self.step = step
+        self.script = script
+        self.genus = genus
+        self.name = f"{step}:{genus}" if genus else step
+        self.deps = list(deps)
+        self.cores = cores
+        self.memory = memory
+        self.weight = weight
+        self.args = list(args)
+        self.state = "pending"
+        self.cpus = []
+
+    def command(self):
+        if self.script.endswith(".sh"):
+            return ["bash", str(BIN_DIR / self.script)] + self.args
+        return [sys.executable, "-u", str(BIN_DIR / self.script)] + self.args
+
+
+# Thread-safe JSON lines writer
+class EventWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        record = {"time": datetime.now().isoformat(timespec="milliseconds"), "event": event}
+        record.update(fields)
+        with self.lock:
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+
+# Parse "6-10", "7,8" or "8" into an ordered list of steps (ValueError on unknown steps)
+def parse_steps(spec):
+    steps = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = [bound.strip() for bound in part.split("-", 1)]
+        unknown = [bound for bound in bounds if bound not in STEP_ORDER]
+        if unknown:
+            raise ValueError(f"unknown step {unknown[0]} in {part!r}, choose from {', '.join(STEP_ORDER)}")
+        first, last = STEP_ORDER.index(bounds[0]), STEP_ORDER.index(bounds[-1])
+        if first > last:
+            raise ValueError(f"empty step range {part!r}, choose from {', '.join(STEP_ORDER)}")
+        steps.extend(STEP_ORDER[first:last + 1])
+    if not steps:
+        raise ValueError(f"no steps given, choose from {', '.join(STEP_ORDER)}")
+    return [step for step in STEP_ORDER if step in steps]
+
+
+# Estimated peak memory of an Exonerate task (every query shard loads the genome)
+def exonerate_memory(genus, cores):
+    catalog = genome_catalog(GENOMES_DIR)
+    catalog.refresh()
+    genome_file = catalog.find(genus)
+    if not genome_file:
+        return 0
+    exonerate = importlib.import_module("9_EXONERATE")
+    return int(Path(genome_file).stat().st_size * exonerate.rss_per_genome_byte * cores + exonerate.rss_base)
+
+
+class Runner:
+    def __init__(self, steps, genera=None, cores=None, memory=None, events=None,
+                 target_mode="genome", force=False, run_dir=None, profile=None, table_format="text"):
+        self.steps = steps
+        self.genera = genera
+        self.memory = memory or available_memory() or 0
+        self.events = events or EventWriter(sys.stdout)
+        self.target_mode = target_mode
+        self.force = force
+        self.profile = profile
+        self.table_format = table_format
+        self.run_dir = Path(run_dir or LOG_DIR / f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+        cores = max(1, cores or available_cores())
+        try:
+            self.free_cpus = sorted(os.sched_getaffinity(0))[:cores]
+        except AttributeError:
+            self.free_cpus = list(range(cores))
+        self.cores = len(self.free_cpus)
+        self.pinning = hasattr(os, "sched_setaffinity")
+        self.memory_used = 0
+        self.tasks = {}
+        self.cond = threading.Condition()
+
+    # Tasks of the selected steps, dependencies on steps that are not selected are dropped
+    def plan_global(self):
+        for step, script, deps in GLOBAL_STEPS:
+            if step in self.steps:
+                args = ["--force"] if self.force and step in ("3", "5", "6") else []
+                if step == "3":
+                    args += ["--jobs", str(min(step_cores[step], self.cores))]
+                if step == "5":
+                    args += ["--cores", str(min(step_cores[step], self.cores))]
+                self.add(Task(step, script, deps=[d for d in deps if d in self.steps],
+                              cores=min(step_cores[step], self.cores), args=args))
+
+    def plan_genera(self):
+        genera = sorted(path.stem for path in FILTERED_FASTA_DIR.glob("*.fasta"))
+        if self.genera:
+            genera = [genus for genus in genera if genus in self.genera]
+        for genus in genera:
+            weight = (FILTERED_FASTA_DIR / f"{genus}.fasta").stat().st_size
+            for step, script, global_deps, genus_deps in GENUS_STEPS:
+                if step not in self.steps:
+                    continue
+                if step == "9" and self.target_mode == "hits":
+                    genus_deps = genus_deps + ["7"]
+                deps = [d for d in global_deps if d in self.steps]
+                deps += [f"{d}:{genus}" for d in genus_deps if d in self.steps]
+                cores = min(step_cores[step], self.cores)
+                args = ["--genus", genus]
+                if step == "7":
+                    args += ["--cores", str(cores)]
+                if step == "9":
+                    args += ["--target-mode", self.target_mode]
+                if step in ("7", "8", "9") and self.table_format != "text":
+                    args += ["--table-format", self.table_format]
+                if self.force:
+                    args.append("--force")
+                # Exonerate memory is estimated when the task starts (genomes may not be downloaded yet)
+                memory = None if step == "9" and self.target_mode == "genome" else 0
+                self.add(Task(step, script, genus, deps, cores, memory, weight, args))
+
+    def add(self, task):
+        self.tasks[task.name] = task
+
+    # Ready tasks, downstream steps first so genera finish early, then the largest genera
+    def ready(self):
+        ready = []
+        for task in self.tasks.values():
+            if task.state != "pending":
+                continue
+            states = [self.tasks[d].state if d in self.tasks else "done" for d in task.deps]
+            if any(state in ("failed", "skipped") for state in states):
+                task.state = "skipped"
+                failed = [d for d, state in zip(task.deps, states) if state in ("failed", "skipped")]
+                self.events.emit("task_skipped", task=task.name, step=task.step, genus=task.genus,
+                                 reason=f"dependency {', '.join(failed)} did not complete")
+                continue
+            if all(state == "done" for state in states):
+                ready.append(task)
+        ready.sort(key=lambda t: (-STEP_ORDER.index(t.step), -t.weight, t.name))
+        return ready
+
+    def fits(self, task, running):
+        if task.memory is None:
+            task.memory = exonerate_memory(task.genus, task.cores)
+        if len(self.free_cpus) < task.cores:
+            return False
+        return not running or not self.memory or self.memory_used + task.memory <= self.memory
+
+    def run(self):
+        start = time.time()
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        # Tasks inherit the metrics file (and the profiling mode)
+        os.environ[metrics.METRICS_ENV] = str(self.run_dir / "metrics.jsonl")
+        if self.profile:
+            os.environ[metrics.PROFILE_ENV] = self.profile
+        self.plan_global()
+        if "6" not in self.tasks:
+            self.plan_genera()
+        self.events.emit("run_start", steps=self.steps, cores=self.cores, memory=self.memory,
+                         logs=str(self.run_dir), tasks=len(self.tasks))
+
+        running = 0
+        with self.cond:
+            while True:
+                # Stop after a full pass without finished tasks, none running, and nothing to start
+                progress = True
+                while progress:
+                    progress = False
+                    for task in self.ready():
+                        if not self.fits(task, running):
+                            continue
+                        task.cpus = self.free_cpus[:task.cores]
+                        del self.free_cpus[:task.cores]
+                        self.memory_used += task.memory
+                        task.state = "running"
+                        running += 1
+                        threading.Thread(target=self.execute, args=(task,), daemon=True).start()
+                        progress = True
+                if not running:
+                    break
+                self.cond.wait()
+                running = sum(1 for task in self.tasks.values() if task.state == "running")
+
+        counts = {}
+        for task in self.tasks.values():
+            counts[task.state] = counts.get(task.state, 0) + 1
+        self.events.emit("metrics", file=os.environ[metrics.METRICS_ENV],
+                         summary=metrics.summarize(os.environ[metrics.METRICS_ENV]))
+        self.events.emit("run_done", elapsed=round(time.time() - start, 3), **counts)
+        return all(task.state == "done" for task in self.tasks.values())
+
+    def execute(self, task):
+        started = time.time()
+        log_file = self.run_dir / f"{task.name.replace(':', '_')}.log"
+        self.events.emit("task_start", task=task.name, step=task.step, genus=task.genus,
+                         cores=task.cores, cpus=task.cpus, memory=task.memory, log=str(log_file))
+
+        cpus = set(task.cpus)
+        preexec = (lambda: os.sched_setaffinity(0, cpus)) if self.pinning else None
+        returncode = -1
+        try:
+            with open(log_file, "w") as log:
+                process = metrics.MeasuredPopen(task.command(), cwd=BASE_DIR, stdout=subprocess.PIPE,
+                                                stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                                preexec_fn=preexec)
+                batch = []
+                last_emit = time.time()
+                for line in process.stdout:
+                    log.write(line)
+                    batch.append(line.rstrip("\n"))
+                    if len(batch) >= log_batch_lines or time.time() - last_emit >= log_batch_seconds:
+                        self.events.emit("log", task=task.name, lines=batch)
+                        batch = []
+                        last_emit = time.time()
+                if batch:
+                    self.events.emit("log", task=task.name, lines=batch)
+                returncode = process.wait()
+            metrics.record("task", task.name, step=Path(task.script).stem, genus=task.genus,
+                           wall=round(time.time() - started, 6), returncode=returncode,
+                           cores=task.cores, **metrics.child_usage(process))
+        except OSError as e:
+            self.events.emit("log", task=task.name, lines=[f"Failed to start {task.script}: {e}"])
+
+        elapsed = round(time.time() - started, 3)
+        with self.cond:
+            self.free_cpus.extend(task.cpus)
+            self.free_cpus.sort()
+            self.memory_used -= task.memory
+            task.state = "done" if returncode == 0 else "failed"
+            self.events.emit("task_done" if returncode == 0 else "task_failed", task=task.name,
+                             step=task.step, genus=task.genus, returncode=returncode, elapsed=elapsed)
+            # The genus list is known once the FASTA split is done
+            if task.step == "6" and task.state == "done":
+                self.plan_genera()
+            self.cond.notify_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="ptpp", description="PTPP pipeline runner")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run pipeline steps as a per-genus DAG")
+    run.add_argument("--steps", default="1-10", help="Steps to run, e.g. 6-10 or 7,8 (default 1-10)")
+    run.add_argument("--genus", nargs="+", help="Only run the per-genus steps for these genera")
+    run.add_argument("--cores", type=int, default=available_cores(), help="Total core budget")
+    run.add_argument("--memory", type=float, help="Memory budget in GB (default: available memory)")
+    run.add_argument("--target-mode", choices=["genome", "hits"], default="genome", help="Exonerate target mode (step 9)")
+    run.add_argument("--force", action="store_true", help="Rerun steps that are up to date")
+    run.add_argument("--table-format", choices=TABLE_FORMATS, default="text", help="Also write Parquet or bgzip/tabix copies of the tables (steps 7 to 9)")
+    run.add_argument("--events", help="Write progress events to this file instead of stdout")
+    run.add_argument("--dry-run", action="store_true", help="Print the planned tasks and exit")
+    run.add_argument("--profile", choices=["cprofile", "tracemalloc"], help="Profile the measured Python sections of every task")
+    summary = commands.add_parser("metrics", help="Print the resource summary of a metrics file")
+    summary.add_argument("metrics_file")
+    lookup = commands.add_parser("query", help="Find the hits, hints, genes and alignments of a genus by region or protein ID")
+    lookup.add_argument("genus")
+    lookup.add_argument("--region", action="append", help="CONTIG:START-END (1-based, inclusive) or CONTIG, repeatable")
+    lookup.add_argument("--protein", nargs="+", help="Protein (query) IDs")
+    lookup.add_argument("--sources", default=",".join(query.SOURCES), help="Comma-separated sources to search")
+    lookup.add_argument("--json", action="store_true", help="Print JSON lines instead of TSV")
+    lookup.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date")
+    args = parser.parse_args(argv)
+
+    if args.command == "metrics":
+        print(metrics.format_summary(metrics.summarize(args.metrics_file)))
+        return 0
+    if args.command == "query":
+        if not args.region and not args.protein:
+            lookup.error("give at least one --region or --protein")
+        return query.cli(args)
+
+    try:
+        steps = parse_steps(args.steps)
+    except ValueError as e:
+        run.error(str(e))
+    memory = int(args.memory * 1024**3) if args.memory else None
+    stream = open(args.events, "a") if args.events else sys.stdout
+    try:
+        runner = Runner(steps, args.genus, args.cores, memory, EventWriter(stream), args.target_mode,
+                        args.force, profile=args.profile, table_format=args.table_format)
+        if args.dry_run:
+            runner.plan_global()
+            runner.plan_genera()
+            for task in runner.tasks.values():
+                runner.events.emit("task_planned", task=task.name, step=task.step, genus=task.genus,
+                                   deps=task.deps, cores=task.cores, memory=task.memory,
+                                   command=task.command())
+            return 0
+        return 0 if runner.run() else 1
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
@@ -0,0 +1,172 @@
+"""Optional Parquet and bgzip/tabix copies of the tab-separated outputs.
+
+The text files stay the outputs the tools write and read. With table format
+"parquet" a table also gets a {file}.parquet copy (pyarrow) sorted by contig
+and start, so readers load only the columns they need and skip the row groups
+of other contigs through their statistics. With "bgzip" it gets a {file}.gz
+copy compressed with bgzip and indexed with tabix (htslib), which IGV and
+tabix read directly and which is queried by contig.
+
+read_table loads a table from its freshest copy and falls back to the text
+file, so every reader works whether or not the copies exist.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from ptpp import metrics
+from ptpp.blast import OUTFMT6_COLUMNS
+from ptpp.fasta import open_text
+
+TABLE_FORMATS = ("text", "parquet", "bgzip")
+ROW_GROUP_SIZE = 100000 # Rows per Parquet row group (the unit skipped by contig filters)
+
+GFF_COLUMNS = ["seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes"]
+
+# Columns, dtypes, sort keys and tabix columns of each table kind
+# (e-values are kept as text, as BLAST wrote them)
+KINDS = {
+    "outfmt6": {
+        "columns": OUTFMT6_COLUMNS,
+        "dtypes": dict.fromkeys(OUTFMT6_COLUMNS, str) | {
+            "pident": "float64", "length": "int64", "mismatch": "int64", "gapopen": "int64",
+            "qstart": "int64", "qend": "int64", "sstart": "int64", "send": "int64", "bitscore": "float64"
+        },
+        "contig": "sseqid",
+        "start": "sstart",
+        "tabix": ["-s", "2", "-b", "9", "-e", "9"]
+    },
+    "gff": {
+        "columns": GFF_COLUMNS,
+        "dtypes": dict.fromkeys(GFF_COLUMNS, str) | {"start": "int64", "end": "int64"},
+        "contig": "seqid",
+        "start": "start",
+        "tabix": ["-p", "gff"]
+    }
+}
+
+
+def parquet_path(text_file):
+    return Path(f"{text_file}.parquet")
+
+
+def bgzip_path(text_file):
+    return Path(f"{text_file}.gz")
+
+
+# Copy exists and is not older than the text file (or the text file was removed)
+def _fresh(copy, text_file):
+    if not copy.exists():
+        return False
+    return not text_file.exists() or copy.stat().st_mtime >= text_file.stat().st_mtime
+
+
+# Data lines of a table: GFF files also hold comments and (Exonerate) alignment text
+def _data_lines(path, n_fields):
+    with open_text(path) as f:
+        for line in f:
+            if not line.startswith("#") and line.count("\t") == n_fields - 1:
+                yield line
+
+
+def _parse(source, kind, columns=None, typed=True):
+    spec = KINDS[kind]
+    dtypes = spec["dtypes"] if typed else str
+    try:
+        frame = pd.read_csv(source, sep="\t", header=None, names=spec["columns"], usecols=columns,
+                            dtype=dtypes, quoting=3, na_filter=False)
+    except pd.errors.EmptyDataError:
+        frame = pd.DataFrame({column: pd.Series(dtype=spec["dtypes"][column] if typed else str)
+                              for column in spec["columns"]})
+    return frame if columns is None else frame[columns]
+
+
+def _read_text(path, kind, columns=None, typed=True):
+    if kind == "outfmt6":
+        return _parse(path, kind, columns, typed)
+    text = "".join(_data_lines(path, len(KINDS[kind]["columns"])))
+    return _parse(io.StringIO(text), kind, columns, typed)
+
+
+# Write the Parquet or bgzip/tabix copy of a text table; returns its path
+def write_table(text_file, kind, table_format):
+    spec = KINDS[kind]
+    text_file = Path(text_file)
+    if table_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        frame = _read_text(text_file, kind).sort_values([spec["contig"], spec["start"]], kind="stable")
+        output = parquet_path(text_file)
+        tmp_output = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_output,
+                       row_group_size=ROW_GROUP_SIZE, compression="zstd")
+        os.replace(tmp_output, output)
+        return output
+
+    if table_format == "bgzip":
+        # Values are written back as read, only sorted for tabix
+        frame = _read_text(text_file, kind, typed=False)
+        order = frame.assign(_start=frame[spec["start"]].astype("int64")).sort_values([spec["contig"], "_start"], kind="stable").index
+        frame = frame.loc[order]
+        output = bgzip_path(text_file)
+        tmp_output = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+        with open(tmp_output, "wb") as out:
+            metrics.run(["bgzip", "-c"], input=frame.to_csv(sep="\t", header=False, index=False).encode(), stdout=out, check=True)
+        os.replace(tmp_output, output)
+        metrics.run(["tabix", "-f", *spec["tabix"], str(output)], check=True)
+        return output
+
+    raise ValueError(f"unknown table format {table_format}")
+
+
+# Write missing or stale copies of [(text_file, kind)]; failures are reported and skipped
+def write_tables(tables, table_format):
+    if table_format == "text":
+        return
+    for text_file, kind in tables:
+        text_file = Path(text_file)
+        copy = parquet_path(text_file) if table_format == "parquet" else bgzip_path(text_file)
+        if not text_file.exists() or _fresh(copy, text_file):
+            continue
+        try:
+            with metrics.measure(f"write_table_{table_format}"):
+                write_table(text_file, kind, table_format)
+        except (ImportError, OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}][ALERT] {table_format} copy of {text_file.name} not written: {e}, continuing..")
+
+
+# Load a table (only the given columns and contigs) from its freshest copy, or from the text file
+def read_table(text_file, kind, columns=None, contigs=None):
+    spec = KINDS[kind]
+    text_file = Path(text_file)
+    contigs = list(contigs) if contigs is not None else None
+
+    parquet_file = parquet_path(text_file)
+    if _fresh(parquet_file, text_file):
+        try:
+            import pyarrow.parquet as pq
+            filters = [(spec["contig"], "in", contigs)] if contigs is not None else None
+            return pq.read_table(parquet_file, columns=columns, filters=filters).to_pandas()
+        except ImportError:
+            pass
+
+    bgzip_file = bgzip_path(text_file)
+    if _fresh(bgzip_file, text_file):
+        if contigs is not None and Path(f"{bgzip_file}.tbi").exists() and shutil.which("tabix"):
+            result = metrics.run(["tabix", str(bgzip_file), *contigs], capture_output=True, check=True)
+            return _parse(io.BytesIO(result.stdout), kind, columns)
+        if not text_file.exists():
+            text_file = bgzip_file
+
+    if contigs is None:
+        return _read_text(text_file, kind, columns)
+    read_columns = None if columns is None else list(dict.fromkeys(columns + [spec["contig"]]))
+    frame = _read_text(text_file, kind, read_columns)
+    frame = frame[frame[spec["contig"]].isin(contigs)].reset_index(drop=True)
+    return frame if columns is None else frame[columns]